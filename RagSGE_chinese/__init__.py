@@ -1 +1 @@
-from .main import sort, generate, evaluate
\ No newline at end of file
+from .main import fetch, sort, generate, collect, evaluate
\ No newline at end of file
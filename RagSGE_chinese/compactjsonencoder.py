@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import json
+from json.encoder import encode_basestring, encode_basestring_ascii
 
 class CompactJSONEncoder(json.JSONEncoder):
     """A JSON Encoder that puts small containers on single lines."""
@@ -20,15 +21,108 @@ class CompactJSONEncoder(json.JSONEncoder):
             kwargs["indent"] = 4
         super().__init__(*args, **kwargs)
         self.indentation_level = 0
+        self._encode_str = encode_basestring_ascii if self.ensure_ascii else encode_basestring
 
     def encode(self, o):
         """Encode JSON object *o* with respect to single line lists."""
-        if isinstance(o, (list, tuple)):
-            return self._encode_list(o)
+        return "".join(self.iterencode(o))
+
+    def iterencode(self, o, **kwargs):
+        """Encode *o* chunk by chunk, so that `json.dump` can stream to the file."""
+        if isinstance(o, self.CONTAINER_TYPES):
+            return self._iterencode(o, self.indentation_level)
+        return iter((self._encode_primitive(o),))
+
+    def _iterencode(self, o, level):
         if isinstance(o, dict):
-            return self._encode_object(o)
+            if not o:
+                yield "{}"
+                return
+
+            # ensure keys are converted to strings
+            o = {str(k) if k is not None else "null": v for k, v in o.items()}
+
+            if self.sort_keys:
+                o = dict(sorted(o.items(), key=lambda x: x[0]))
+
+            keys = [encode_basestring_ascii(k) for k in o]
+            values = o.values()
+            opening, closing = "{", "}"
+        else:
+            keys = None
+            values = o
+            opening, closing = "[", "]"
+
+        pieces = self._single_line(o, values)
+        if pieces is not None:
+            if keys is None:
+                yield "[" + ", ".join(pieces) + "]"
+            else:
+                yield "{ " + ", ".join(f"{k}: {v}" for k, v in zip(keys, pieces)) + " }"
+            return
+
+        indent = self._indent(level + 1)
+        yield opening + "\n"
+        for i, v in enumerate(values):
+            if i:
+                yield ",\n"
+            yield indent if keys is None else f"{indent}{keys[i]}: "
+            if isinstance(v, self.CONTAINER_TYPES):
+                yield from self._iterencode(v, level + 1)
+            else:
+                yield self._encode_primitive(v)
+        yield "\n" + self._indent(level) + closing
+
+    def _single_line(self, o, values):
+        """
+        Encode the items of a container of primitives and measure the width
+        ``len(str(o)) - 2`` on the way. Returns the encoded items if the
+        container fits on a single line, otherwise None.
+        """
+        if len(o) > self.MAX_ITEMS or not self._primitives_only(o):
+            return None
+
+        if type(o) is not list and type(o) is not tuple and type(o) is not dict:
+            # subclasses may have their own __str__
+            if len(str(o)) - 2 > self.MAX_WIDTH:
+                return None
+            return [self._encode_primitive(v) for v in values]
+
+        # same width as str(o): items separated by ", ", dict items are "key: value"
+        width = 2 * (len(o) - 1) if o else 0
+        if type(o) is tuple and len(o) == 1:
+            width = 1  # (x,)
+        elif type(o) is dict:
+            width += sum(len(repr(k)) + 2 for k in o)
+        pieces = []
+        for v in values:
+            t = type(v)
+            if t is str:
+                piece = self._encode_str(v)
+                width += len(repr(v))
+            elif t is int:
+                piece = int.__repr__(v)
+                width += len(piece)
+            elif t is float:
+                piece = format(v, "g")
+                width += len(repr(v))
+            elif v is None or v is True or v is False:
+                # null/None, true/True, false/False have the same length
+                piece = "null" if v is None else "true" if v else "false"
+                width += len(piece)
+            else:
+                piece = self._encode_primitive(v)
+                width += len(repr(v))
+            if width > self.MAX_WIDTH:
+                return None
+            pieces.append(piece)
+        return pieces
+
+    def _encode_primitive(self, o):
         if isinstance(o, float):  # Use scientific notation for floats
             return format(o, "g")
+        if isinstance(o, str):
+            return self._encode_str(o)
         return json.dumps(
             o,
             skipkeys=self.skipkeys,
@@ -41,65 +135,22 @@ class CompactJSONEncoder(json.JSONEncoder):
             default=self.default if hasattr(self, "default") else None,
         )
 
-    def _encode_list(self, o):
-        if self._put_on_single_line(o):
-            return "[" + ", ".join(self.encode(el) for el in o) + "]"
-        self.indentation_level += 1
-        output = [self.indent_str + self.encode(el) for el in o]
-        self.indentation_level -= 1
-        return "[\n" + ",\n".join(output) + "\n" + self.indent_str + "]"
-
-    def _encode_object(self, o):
-        if not o:
-            return "{}"
-
-        # ensure keys are converted to strings
-        o = {str(k) if k is not None else "null": v for k, v in o.items()}
-
-        if self.sort_keys:
-            o = dict(sorted(o.items(), key=lambda x: x[0]))
-
-        if self._put_on_single_line(o):
-            return (
-                "{ "
-                + ", ".join(
-                    f"{json.dumps(k)}: {self.encode(el)}" for k, el in o.items()
-                )
-                + " }"
-            )
-
-        self.indentation_level += 1
-        output = [
-            f"{self.indent_str}{json.dumps(k)}: {self.encode(v)}" for k, v in o.items()
-        ]
-        self.indentation_level -= 1
-
-        return "{\n" + ",\n".join(output) + "\n" + self.indent_str + "}"
-
-    def iterencode(self, o, **kwargs):
-        """Required to also work with `json.dump`."""
-        return self.encode(o)
-
-    def _put_on_single_line(self, o):
-        return (
-            self._primitives_only(o)
-            and len(o) <= self.MAX_ITEMS
-            and len(str(o)) - 2 <= self.MAX_WIDTH
-        )
-
     def _primitives_only(self, o: list | tuple | dict):
         if isinstance(o, (list, tuple)):
             return not any(isinstance(el, self.CONTAINER_TYPES) for el in o)
         elif isinstance(o, dict):
             return not any(isinstance(el, self.CONTAINER_TYPES) for el in o.values())
 
-    @property
-    def indent_str(self) -> str:
+    def _indent(self, level) -> str:
         if isinstance(self.indent, int):
-            return " " * (self.indentation_level * self.indent)
+            return " " * (level * self.indent)
         elif isinstance(self.indent, str):
-            return self.indentation_level * self.indent
+            return level * self.indent
         else:
             raise ValueError(
                 f"indent must either be of type int or str (is: {type(self.indent)})"
-            )
\ No newline at end of file
+            )
+
+    @property
+    def indent_str(self) -> str:
+        return self._indent(self.indentation_level)
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+from collections import defaultdict, deque
+
+
+class Compare_Graph():
+    '''
+    一个问题的两两比较结果图, 用于避免重复询问GPT
+
+    节点是context内容的哈希值 (与下标无关, 不同运行/不同排序方法之间可以复用)
+    保存的比较图按 模型+问题 区分, 不同GPT模型的比较结果不会混用
+    每一次GPT比较的结果都按两个方向保存: (a, b) = True 同时 (b, a) = False
+    如果a比b重要且b比c重要, 那么不需要询问GPT即可推断a比c重要 (传递闭包)
+    '''
+
+    def __init__(self, question="", model=""):
+        self.question = question
+        self.model = model
+        self.direct = {}                 # (a, b) -> True: a比b重要
+        self.better = defaultdict(set)   # a -> {比a不重要的节点}
+        self.asked = 0                   # 实际询问GPT的次数
+        self.saved = 0                   # 通过比较图直接得到答案, 节省的GPT调用次数
+
+    @staticmethod
+    def node(context):
+        return hashlib.sha1(context.encode("utf-8")).hexdigest()[:16]
+
+    def add(self, a, b, a_high):
+        '''记录一次比较结果, a_high: True = a比b重要'''
+        if a == b:   # 内容相同的两个context, 不记录 (否则会形成自环)
+            return
+        old = self.direct.get((a, b))
+        if old is not None and old != a_high:
+            # GPT前后回答矛盾, 以最新一次回答为准
+            winner, loser = (b, a) if a_high else (a, b)
+            self.better[winner].discard(loser)
+        self.direct[(a, b)] = a_high
+        self.direct[(b, a)] = not a_high
+        if a_high:
+            self.better[a].add(b)
+        else:
+            self.better[b].add(a)
+
+    def _reaches(self, src, dst):
+        # 广度优先搜索, 判断src是否(间接)比dst重要
+        seen = {src}
+        queue = deque([src])
+        while queue:
+            for nxt in self.better.get(queue.popleft(), ()):
+                if nxt == dst:
+                    return True
+                if nxt not in seen:
+                    seen.add(nxt)
+                    queue.append(nxt)
+        return False
+
+    def query(self, a, b):
+        '''
+        输出：True = a比b重要, False = b比a重要, None = 无法推断, 需要询问GPT
+        '''
+        if a == b:   # 内容相同, 保持原来的顺序
+            return True
+        if (a, b) in self.direct:
+            return self.direct[(a, b)]
+        a_high = self._reaches(a, b)
+        b_high = self._reaches(b, a)
+        if a_high != b_high:     # 两个方向都可达说明GPT的回答存在环, 无法推断
+            return a_high
+        return None
+
+    def to_dict(self):
+        edges = [[a, b] for (a, b), a_high in self.direct.items() if a_high]
+        return {"question": self.question, "model": self.model, "edges": edges}
+
+    @classmethod
+    def from_dict(cls, data):
+        graph = cls(question=data.get("question", ""), model=data.get("model", ""))
+        for a, b in data.get("edges", []):
+            graph.add(a, b, True)
+        return graph
+
+    @staticmethod
+    def path(folder, question, model=""):
+        name = hashlib.sha1(f"{model}\n{question}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(folder, f"{name}.json")
+
+    def save(self, folder):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(self.path(folder, self.question, self.model), 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, folder, question, model=""):
+        '''读取保存的比较图, 如果不存在则返回一个空的比较图'''
+        if folder is not None:
+            path = cls.path(folder, question, model)
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return cls.from_dict(json.load(f))
+        return cls(question=question, model=model)
@@ -1,13 +1,22 @@
 # 测试全部200个文件并排序
 import json
 import os
+import re
 from dotenv import load_dotenv
 from langchain_openai.chat_models import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain.prompts import ChatPromptTemplate
 from tqdm import tqdm
-from scipy.stats import spearmanr
 from .compactjsonencoder import CompactJSONEncoder
+from .llm_cache import Cached_Chain, default_cache, invoke_all
+from .rate_limit import default_governor
+from .compare_graph import Compare_Graph
+from .run_journal import Run_Journal, content_key
+from .result_store import Result_Writer, write_json
+from .metrics import staged, default_metrics, start_run
+from .lexical_filter import Lexical_Filter
+from .rank_metrics import rank_metrics
+from .near_duplicates import make_dedup, cluster_contexts
 
 class DOC_SORT:
 
@@ -29,20 +38,59 @@ class DOC_SORT:
         文档: {context}
         请不要输出"0"或"1"以外的任何内容
         """
+
+    template_list = """
+        下面给出了{num}个背景，每个背景前面都有一个编号。
+        请根据背景与问题的相关性，从最相关到最不相关对全部背景进行排序。
+        请只输出编号的排列，格式为"[2] > [1] > [3]"，必须包含全部{num}个编号且每个编号只出现一次。不要输出其他内容。
+
+        问题: {question}
+
+        {contexts}
+        """
     
     OPENAI_API_KEY = ""
 
     # 初始化GPT模型, 模型初始化为GPT-3.5
-    def __init__(self, GPT_model_name="gpt-3.5-turbo"):
+    # concurrency: 同时发送的GPT请求数量上限, 默认为1即逐个调用
+    # cache: GPT回答缓存LLM_Cache, 默认为None使用全局共享的./cache/llm_cache.sqlite
+    # graph_dir: 每个问题两两比较结果图的保存位置, 默认为./cache/compare_graph, None代表不保存; 关闭GPT缓存时同样不读取/保存
+    # governor: GPT请求限流与重试Rate_Governor, 默认为None使用全局共享的限流器
+    # prefilter: 0-1筛选前的本地词法预筛选Lexical_Filter, 默认为None不预筛选; True代表读取./cache/lexical_filter.json中校准的阈值
+    # dedup: 近似重复去重, 默认为None不去重; True使用默认阈值0.8, 数字为Jaccard相似度阈值, 也可以传入Near_Duplicates
+    def __init__(self, GPT_model_name="gpt-3.5-turbo", concurrency=1, cache=None, graph_dir="./cache/compare_graph", governor=None, prefilter=None, dedup=None):
         load_dotenv()
+        self.dedup = make_dedup(dedup)
+        if prefilter is True:
+            prefilter = Lexical_Filter.load()
+        self.prefilter = prefilter or None
+        self.concurrency = max(1, int(concurrency))
+        self.cache = cache if cache is not None else default_cache()
+        self.governor = governor if governor is not None else default_governor()
+        # 比较图与GPT缓存一样是之前的回答, 关闭缓存时 (enabled=False或RAGSGE_CACHE=off) 不使用保存的比较图
+        self.graph_dir = graph_dir if self.cache.enabled else None
+        self.model_name = GPT_model_name
+        self.graphs = {}
         self.OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
         prompt_bin = ChatPromptTemplate.from_template(self.template_bin)
         prompt_01 = ChatPromptTemplate.from_template(self.template_01)
-        model = ChatOpenAI(openai_api_key=self.OPENAI_API_KEY, model=GPT_model_name)
+        prompt_list = ChatPromptTemplate.from_template(self.template_list)
+        # 重试由Rate_Governor统一处理
+        model = ChatOpenAI(openai_api_key=self.OPENAI_API_KEY, model=GPT_model_name, max_retries=0)
         parser = StrOutputParser()
-        self.chain_bin = prompt_bin | model | parser
-        self.chain_01 = prompt_01 | model | parser
+        self.chain_bin = Cached_Chain(prompt_bin, model, parser, self.cache, self.governor, stage="compare")
+        self.chain_01 = Cached_Chain(prompt_01, model, parser, self.cache, self.governor, stage="sort_01")
+        self.chain_list = Cached_Chain(prompt_list, model, parser, self.cache, self.governor, stage="listwise_sort")
+
+    # 近似重复聚类, 没有设置dedup时每个context单独一类
+    def near_duplicates(self, contexts):
+        return cluster_contexts(self.dedup, contexts)
 
+    # 并发调用chain, 输出顺序与inputs一致 (最多同时发送concurrency个请求)
+    def invoke_all(self, chain, inputs, desc=None):
+        return invoke_all(chain, inputs, concurrency=self.concurrency, desc=desc)
+
+    @staged("sort_01")
     def sort_01(self, contexts, question):
         '''
         contexts: 数组， 200个背景知识的数组
@@ -51,33 +99,49 @@ class DOC_SORT:
         输出：
         good: 有答案的contexts, 需要继续使用二分排序精确排序
         bad: 没有答案的contexts, 无需排序
+
+        如果concurrency>1, 全部contexts的0-1判断会并发发送, good和bad仍按原输入顺序排列
+        如果设置了prefilter, 词法分数明显高/低的contexts直接判断, 只有不确定的和抽查的contexts询问GPT
         '''
+        todo = list(range(len(contexts)))
+        labels = None
+        if self.prefilter is not None:
+            labels, audit = self.prefilter.split(question, contexts)
+            todo = sorted(set((labels < 0).nonzero()[0].tolist()) | set(audit))
+
+        inputs = [{"question": question, "context": contexts[i]} for i in todo]
+        responses = self.invoke_all(self.chain_01, inputs, desc="0-1排序")
+        answers = {i: self.parse_01(res) for i, res in zip(todo, responses)}
+
+        if labels is not None:
+            self.prefilter.observe(labels, answers)
+
+        # GPT的判断优先 (包括抽查的contexts), 其余使用预筛选结果
         good = []
         bad = []
+        for i in range(len(contexts)):
+            is_good = answers[i] if i in answers else labels[i] == 1
+            (good if is_good else bad).append(i)
 
-        for i, context in enumerate(tqdm(contexts,desc="0-1排序")):
-            res = self.chain_01.invoke({
-                "question": question,
-                "context": context,
-            })
-
-            if res == "1":     # 可以回答，good
-                good.append(i)
-            elif res == "0":   # 不可以回答，bad
-                bad.append(i)
-            else:              # 测试用例：如果GPT给出异常输出，打印出来（测试时并未出现问题）
-                if '1' in res:
-                    good.append(i)
-                    print(f"\n compare warning1 (可忽略): {res}")
-                elif '0' in res:
-                    bad.append(i)
-                    print(f"\n compare warning0 (可忽略): {res}")
-                else:           # 不知道回答了啥，报错，放入bad
-                    bad.append(i)
-                    print(f"\n compare error: {res}")
-        
         return good, bad
 
+    # 解析0-1筛选的GPT输出, True = 可以回答 (good), False = 不可以回答 (bad)
+    def parse_01(self, res):
+        if res == "1":     # 可以回答，good
+            return True
+        elif res == "0":   # 不可以回答，bad
+            return False
+        else:              # 测试用例：如果GPT给出异常输出，打印出来（测试时并未出现问题）
+            if '1' in res:
+                print(f"\n compare warning1 (可忽略): {res}")
+                return True
+            elif '0' in res:
+                print(f"\n compare warning0 (可忽略): {res}")
+                return False
+            else:           # 不知道回答了啥，报错，放入bad
+                print(f"\n compare error: {res}")
+                return False
+
     # 使用GPT比较两个contexts，并给出比较
     def doc_compare(self, doc1, doc2, question):
         '''
@@ -93,6 +157,10 @@ class DOC_SORT:
             "context2": doc2
         })
 
+        return self.parse_compare(compare_response)
+
+    # 解析两两比较的GPT输出, True = doc1更重要, False = doc2更重要
+    def parse_compare(self, compare_response):
         if compare_response == "1":     # doc1更重要，排在前面
             doc1_high = True
         elif compare_response == "2":   # doc2更重要，排在前面
@@ -110,7 +178,45 @@ class DOC_SORT:
 
         return doc1_high
 
+    # 获取问题对应的两两比较结果图 (从graph_dir读取之前运行的结果, 只在排序这个问题期间保存在内存中)
+    def compare_graph(self, question):
+        if question not in self.graphs:
+            self.graphs[question] = Compare_Graph.load(self.graph_dir, question, self.model_name)
+        return self.graphs[question]
+
+    # 批量比较多对contexts, 先查询比较图, 只有无法推断的才询问GPT (并发)
+    def compare_pairs(self, contexts, question, pairs):
+        '''
+        contexts: 数组， 200个背景知识的数组
+        question: 问题
+        pairs: [(i, j), ...] 需要比较的contexts下标对
+
+        输出：
+        results: 与pairs一一对应, True = contexts[i]更重要, False = contexts[j]更重要
+        calls: 实际询问GPT的次数
+        '''
+        graph = self.compare_graph(question)
+        nodes = [(Compare_Graph.node(contexts[i]), Compare_Graph.node(contexts[j])) for i, j in pairs]
+        results = [graph.query(a, b) for a, b in nodes]
+
+        todo = [n for n, res in enumerate(results) if res is None]
+        graph.saved += len(pairs) - len(todo)
+        if todo:
+            inputs = [{
+                "question": question,
+                "context1": contexts[pairs[n][0]],
+                "context2": contexts[pairs[n][1]],
+            } for n in todo]
+            responses = self.invoke_all(self.chain_bin, inputs)
+            for n, response in zip(todo, responses):
+                results[n] = self.parse_compare(response)
+                graph.add(*nodes[n], results[n])
+            graph.asked += len(todo)
+
+        return results, len(todo)
+
     # 二分排序法将good contexts排序（GPT两两排序）
+    @staged("binary_insert_sort")
     def binary_insert_sort(self, contexts, question, indices=None):
 
         '''
@@ -121,7 +227,7 @@ class DOC_SORT:
 
         输出：
         indices: 按照相关性从强到弱排序的一个索引数组
-        comparisons: [测试用例] 输出200个一共比较次数 (1082)
+        comparisons: [测试用例] 输出200个一共比较次数 (1082), 比较图可以推断的比较不计入
         '''
 
         # 如果没有输入indices, 默认contexts全排（200个全排）
@@ -133,14 +239,14 @@ class DOC_SORT:
 
         # 二分排序，从前往后开始排序
         for i in tqdm(range(1, length), desc="二分排序"):
-            value_to_insert = contexts[indices[i]]
             insertion_index = i
 
             be, en = 0, i - 1
             while be <= en:
-                comparisons += 1
                 mid = (be + en) // 2
-                if self.doc_compare(value_to_insert, contexts[indices[mid]], question):  # 如果当前值应该排在中间值前面，更重要
+                (doc1_high,), calls = self.compare_pairs(contexts, question, [(indices[i], indices[mid])])
+                comparisons += calls
+                if doc1_high:  # 如果当前值应该排在中间值前面，更重要
                     en = mid - 1
                     insertion_index = mid
                 else:   # 如果当前值应该排在中间值后面，更不重要
@@ -152,7 +258,285 @@ class DOC_SORT:
             indices.insert(insertion_index, index_to_move)
 
         return indices, comparisons
+
+    # 排序网络(Batcher odd-even merge sort)的全部比较轮次
+    @staticmethod
+    def network_rounds(length):
+        '''
+        length: 需要排序的数组长度
+
+        输出：
+        rounds: 二维数组, rounds[r] = [(a, b), ...] 是第r轮需要比较的位置对 (a < b)
+                同一轮中的位置对互不重叠, 可以同时比较, 总轮数约为 log2(n)*(log2(n)+1)/2
+        '''
+        rounds = []
+        p = 1
+        while p < length:
+            k = p
+            while k >= 1:
+                pairs = []
+                for j in range(k % p, length - k, 2 * k):
+                    for i in range(min(k, length - j - k)):
+                        if (i + j) // (2 * p) == (i + j + k) // (2 * p):
+                            pairs.append((i + j, i + j + k))
+                if pairs:
+                    rounds.append(pairs)
+                k //= 2
+            p *= 2
+        return rounds
+
+    # 排序网络法将good contexts排序（GPT两两排序, 每一轮的比较并发进行）
+    @staged("network_sort")
+    def network_sort(self, contexts, question, indices=None):
+        '''
+        contexts: 数组， 200个背景知识的数组
+        questions: 问题
+        indices: (可选) 可以选择输入0-1排序后有用的数组good, 随后仅排列good数组的序号
+                        默认为None，则代表全部200个contexts都需要排序
+
+        输出：
+        indices: 按照相关性从强到弱排序的一个索引数组
+        comparisons: [测试用例] 一共比较次数 (200个为2906次, 分36轮), 比较图可以推断的比较不计入
+
+        与binary_insert_sort相比, 总比较次数更多, 但每一轮中的比较互不依赖, 按concurrency并发发送,
+        需要等待的轮数从1082次降低到36轮。即使GPT的判断前后矛盾, 输出也一定是一个完整的排列
+        '''
+
+        # 如果没有输入indices, 默认contexts全排（200个全排）
+        if indices is None:
+            indices = [x for x in range(len(contexts))]
+
+        comparisons = 0
+        for pairs in tqdm(self.network_rounds(len(indices)), desc="并行排序"):
+            results, calls = self.compare_pairs(contexts, question, [(indices[a], indices[b]) for a, b in pairs])
+            comparisons += calls
+
+            # 位置靠后的context更重要，交换位置
+            for (a, b), doc1_high in zip(pairs, results):
+                if not doc1_high:
+                    indices[a], indices[b] = indices[b], indices[a]
+
+        return indices, comparisons
+
+    # 输出本次排序的GPT比较次数和比较图节省的次数, 保存比较图后从内存中释放 (内存占用与问题数量无关)
+    def report_graph(self, question, comparisons):
+        graph = self.compare_graph(question)
+        del self.graphs[question]
+        print(f"GPT比较次数: {comparisons}, 比较图累计节省GPT调用: {graph.saved}")
+        if self.graph_dir is not None:
+            graph.save(self.graph_dir)
+
+    # 锦标赛树法只找出并排序Top-k (或Bottom-k) 个contexts, 其余contexts不排序
+    @staged("topk_sort")
+    def topk_sort(self, contexts, question, indices=None, k=10, top=True):
+        '''
+        contexts: 数组， 200个背景知识的数组
+        questions: 问题
+        indices: (可选) 可以选择输入0-1排序后有用的数组good, 默认为None代表全部contexts
+        k: 需要排序的个数
+        top: True=找出最相关的k个并排在最前, False=找出最不相关的k个并排在最后
+
+        输出：
+        indices: top=True时 前k个按相关性从强到弱排序, 其余保持原顺序(未排序)
+                 top=False时 后k个按相关性从强到弱排序, 其余保持原顺序(未排序)
+        comparisons: [测试用例] 一共比较次数, 约为 n + k*log2(n), 比较图可以推断的比较不计入
+        '''
+        if indices is None:
+            indices = [x for x in range(len(contexts))]
+
+        length = len(indices)
+        k = min(k, length)
+        comparisons = 0
+        if k == 0:
+            return indices, comparisons
+
+        # 比赛: 返回胜者, top=True时更相关的获胜, top=False时更不相关的获胜
+        def winners(matches):
+            nonlocal comparisons
+            pairs = [(a, b) for a, b in matches if a is not None and b is not None]
+            results, calls = self.compare_pairs(contexts, question, pairs)
+            comparisons += calls
+            results = iter(results)
+            out = []
+            for a, b in matches:
+                if a is None or b is None:
+                    out.append(b if a is None else a)
+                else:
+                    out.append(a if next(results) == top else b)
+            return out
+
+        # 锦标赛树: tree[size + i]为第i个选手, tree[1]为冠军, 同一层的比赛并发进行
+        size = 1
+        while size < length:
+            size *= 2
+        tree = [None] * size + indices + [None] * (size - length)
+        level = size
+        while level > 1:
+            nodes = range(level // 2, level)
+            for node, winner in zip(nodes, winners([(tree[2 * n], tree[2 * n + 1]) for n in nodes])):
+                tree[node] = winner
+            level //= 2
+
+        # 依次取出冠军, 只重新比赛冠军所在的路径 (log2(n)次比较)
+        leaf = {x: size + i for i, x in enumerate(indices)}
+        ranked = []
+        for _ in tqdm(range(k), desc=f"{'Top' if top else 'Bottom'}-{k}排序"):
+            champion = tree[1]
+            ranked.append(champion)
+            node = leaf[champion]
+            tree[node] = None
+            node //= 2
+            while node >= 1:
+                tree[node] = winners([(tree[2 * node], tree[2 * node + 1])])[0]
+                node //= 2
+
+        chosen = set(ranked)
+        rest = [x for x in indices if x not in chosen]
+        if top:
+            return ranked + rest, comparisons
+        return rest + ranked[::-1], comparisons
+
+    # 解析列表排序的GPT输出, 返回0开始的排列; 如果编号缺失或越界则返回None
+    # 只读取"[n]"形式的编号, 回答中其他的数字 (例如资料内容里的年份) 不作为编号
+    def parse_permutation(self, response, num):
+        permutation = []
+        for number in re.findall(r"\[(\d+)\]", response):
+            position = int(number) - 1
+            if not 0 <= position < num:
+                return None
+            if position not in permutation:
+                permutation.append(position)
+        if len(permutation) != num:
+            return None
+        return permutation
+
+    # 列表排序法将good contexts排序（GPT一次排序一个窗口内的contexts, 窗口从后往前滑动）
+    @staged("listwise_sort")
+    def listwise_sort(self, contexts, question, indices=None, window=10, step=None, passes=None, max_length=600, k=None, top=True):
+        '''
+        contexts: 数组， 200个背景知识的数组
+        questions: 问题
+        indices: (可选) 可以选择输入0-1排序后有用的数组good, 默认为None代表全部contexts
+        window: 每次交给GPT排序的contexts数量
+        step: 窗口每次移动的距离, 小于window时相邻窗口重叠, 重叠部分把相关的contexts继续往前带;
+              默认为None即window的一半 (k较小时增大到window-k, 一轮即可确定Top-k)
+        passes: 滑动的轮数, 每一轮确定window-step个contexts, 下一轮跳过已经确定的部分;
+                默认为None即根据k计算保证Top-k准确所需的轮数 (没有k时为1轮)
+        max_length: 每个context在prompt中最多保留的字数, None代表不截断
+        k: (可选) 需要保证准确的Top-k (top=False时为Bottom-k) 的数量
+        top: True时窗口从后往前滑动, 最相关的排在最前面并确定; False时从前往后滑动, 确定最不相关的Bottom-k
+
+        输出：
+        indices: 按照相关性从强到弱排序的一个索引数组 (每一轮确定最前面(top=False时为最后面)的window-step个)
+        comparisons: [测试用例] 一共调用GPT的次数 (200个、k=10时为77次), 包括排列格式错误时回退到二分排序的两两比较
+
+        如果GPT输出的排列格式错误 (编号缺失/越界), 该窗口回退到binary_insert_sort两两比较
+        '''
+        if indices is None:
+            indices = [x for x in range(len(contexts))]
+        indices = list(indices)
+
+        length = len(indices)
+        comparisons = 0
+        if length <= 1:
+            return indices, comparisons
+
+        window = max(2, min(window, length))
+        if step is None:
+            step = max(window // 2, window - k) if k else window // 2
+        step = max(1, min(step, window - 1))
+        fixed = window - step   # 每一轮确定的数量
+        if passes is None:
+            passes = -(-min(k, length) // fixed) if k else 1
+
+        lo, hi = 0, length   # 还没有确定的范围
+        for _ in range(passes):
+            if hi - lo <= 1:
+                break
+            size = min(window, hi - lo)
+            starts = []
+            if top:   # 从后往前滑动, 最后一个窗口从lo开始
+                end = hi
+                while True:
+                    starts.append(max(lo, end - size))
+                    if end - lo <= size:
+                        break
+                    end -= step
+            else:   # 从前往后滑动, 最后一个窗口在hi结束
+                start = lo
+                while True:
+                    starts.append(min(start, hi - size))
+                    if hi - start <= size:
+                        break
+                    start += step
+
+            for start in tqdm(starts, desc="列表排序"):
+                block = indices[start:start + size]
+                texts = [contexts[i] if max_length is None else contexts[i][:max_length] for i in block]
+                response = self.chain_list.invoke({
+                    "num": len(block),
+                    "question": question,
+                    "contexts": "\n".join(f"[{n + 1}] {text}" for n, text in enumerate(texts)),
+                })
+                comparisons += 1
+
+                permutation = self.parse_permutation(response, len(block))
+                if permutation is None:
+                    print(f"\n list warning (回退到两两比较): {response}")
+                    block, calls = self.binary_insert_sort(contexts=contexts, question=question, indices=block)
+                    comparisons += calls
+                else:
+                    block = [block[position] for position in permutation]
+                indices[start:start + size] = block
+
+            if size == hi - lo:   # 一个窗口包含全部剩余的contexts, 已经完全排好
+                break
+            if top:
+                lo += fixed
+            else:
+                hi -= fixed
+
+        return indices, comparisons
+
+    # 根据method选择精排方法
+    # window/step/passes: 列表排序的参数, 见listwise_sort
+    def rank(self, contexts, question, indices=None, method="binary", k=10, top=True, window=10, step=None, passes=None):
+        if method == "binary":
+            return self.binary_insert_sort(contexts=contexts, question=question, indices=indices)
+        if method == "network":
+            return self.network_sort(contexts=contexts, question=question, indices=indices)
+        if method == "topk":
+            return self.topk_sort(contexts=contexts, question=question, indices=indices, k=k, top=top)
+        if method == "listwise":
+            return self.listwise_sort(contexts=contexts, question=question, indices=indices, window=window, step=step, passes=passes, k=k, top=top)
+        raise ValueError(f"method must be 'binary', 'network', 'topk' or 'listwise' (is: {method})")
     
+    # 将一个问题的排序结果写入运行日志 (不保存contexts), k为该问题实际使用的k值
+    def journal_result(self, journal, mode, key, res, k):
+        data = {name: value for name, value in res.items() if name not in ("question", "contexts")}
+        data["k"] = k
+        journal.record(mode, key, data)
+
+    # 从运行日志中恢复一个问题的排序结果
+    def restore(self, question, contexts, data):
+        res = {"question": question, "contexts": contexts}
+        res.update({key: value for key, value in data.items() if key != "k"})
+        return res
+
+    # 一个问题的k: 不超过参与排序的contexts数量 (没有可排序的contexts时为0)
+    @staticmethod
+    def clamp_k(k, length):
+        if k > length:
+            print(f"k值大于可排序contexts的数量，将取最大长度{length}")
+        return min(k, length)
+
+    # topk排序时未排序的部分 (下标), 其他排序方法返回None
+    def unordered(self, indices, method, k, top):
+        if method != "topk":
+            return None
+        k = min(k, len(indices))
+        return indices[k:] if top else indices[:len(indices) - k]
+
     # 计算spearman_score
     def spearman_score(self, list1, list2=None):
         '''
@@ -163,9 +547,15 @@ class DOC_SORT:
         '''
         if list2 is None:
             list2 = list(range(len(list1)))
-        
-        coef, _ = spearmanr(list1, list2)
-        return round(coef,3)
+
+        # 与scipy的spearmanr(list1, list2)相同: 按位置对应比较两个数组的值的排名
+        # list2升序且与list1是相同的下标时, 等价于list1相对list2的排序相关性, 用rank_metrics计算 (不需要导入scipy)
+        if len(list1) == len(list2) and list(list2) == sorted(list2) and set(list1) == set(list2):
+            coef = rank_metrics([list1], [list2])["spearman"][0]
+        else:
+            from scipy.stats import spearmanr   # scipy.stats导入较慢, 用到时才导入
+            coef, _ = spearmanr(list1, list2)
+        return round(float(coef), 3)
     
     # 计算top-k个元素中重复度
     def top_k_similarity(self, list1, list2=None, k=20, top=True):
@@ -178,27 +568,20 @@ class DOC_SORT:
         sim: 重合度数值
         overlap: 重合数字列列表
         '''
-        overlap = []
-        count = 0
         if list2 is None:
             list2 = list(range(len(list1)))
 
         if top:
-            for item in list1[:k]:
-                if item in list2[:k]:
-                    overlap.append(item)
-                    count+=1
+            reference = set(list2[:k])
+            overlap = [item for item in list1[:k] if item in reference]
         else:
-            for item in list1[len(list1)-k:]:
-                if item in list2[len(list1)-k:]:
-                    overlap.append(item)
-                    count+=1
+            reference = set(list2[len(list1)-k:])
+            overlap = [item for item in list1[len(list1)-k:] if item in reference]
 
-        sim = round(count/k, 3)
+        sim = round(len(overlap)/k, 3) if k else 0.0
         return sim, overlap
     
-    def run(self, question_list, contexts_list, k=10, top=True, fast=True):
-        results = []
+    def run(self, question_list, contexts_list, k=10, top=True, fast=True, method="binary", resume=False, journal_path=None, stream=True, result_dir='./result', window=10, step=None, passes=None, legacy=False):
         # 默认快速01排序，k=10, top-10
         '''
         排序调用的函数, 输入如下：
@@ -208,17 +591,63 @@ class DOC_SORT:
         top: 选择是查找Top-k个还是Bottom-k个， 默认为True, 对比最前面的k个
         fast: 选择是否需要先0-1排序提前筛选没用的信息再进行精细排序, 默认为True需要提前0-1筛序
         save: 选择是否需要保存结果, 默认为True需要保存
+        method: 精排方法, "binary"=二分插入排序(默认, 比较次数最少), "network"=排序网络(按轮并发比较, 配合concurrency使用速度最快),
+                "topk"=锦标赛树, 只排序Top-k (top=False时为Bottom-k) 个contexts, 其余contexts不排序并记录在结果的unordered中,
+                "listwise"=列表排序, GPT一次排序一个窗口内的10个contexts, GPT调用次数最少
+        resume: 是否从运行日志中恢复, 默认为False; True则跳过日志中已经完成的问题 (以及已经完成0-1筛选的问题)
+        journal_path: 运行日志路径, 每完成一个问题立即写入, 默认为None即result_dir/journal_sort.jsonl
+        stream: 是否逐个问题写入结果, 默认为True; 结果保存在result_dir/sorted_indices.jsonl, contexts去重后保存在result_dir/contexts.jsonl,
+                返回值为按需读取的Sorted_Results (用法与list相同), 内存占用与问题数量无关;
+                False则与旧版相同, 全部结果保存在内存中, 最后一次性写入result_dir/sorted_indices.json
+        result_dir: 结果文件夹, 默认为./result (分片运行时每个分片使用单独的文件夹, 见shard.py)
+        window/step/passes: method="listwise"时的窗口大小/移动距离/轮数, 默认根据k计算, 保证Top-k (top=False时为Bottom-k) 准确, 见listwise_sort
+        legacy: stream=True时是否同时生成与旧版相同的result_dir/sorted_indices.json (包含全部contexts, 文件较大), 默认为False
         '''
+        results = Result_Writer(result_dir) if stream else []
+        start_run()
+        journal = Run_Journal(journal_path or os.path.join(result_dir, 'journal_sort.jsonl'))
+        # 运行日志的kind包含模型和排序设置, key包含问题和contexts的哈希值, 任何一个变化后resume都不会误用旧的结果
+        mode = f"sorted/{self.model_name}/{'fast' if fast else 'full'}/{method}/{'top' if top else 'bottom'}/top{k}"
+        if method == "listwise":
+            mode += f"/{window}-{step}-{passes}"
+        # 去重的设置不同时0-1筛选和排序的结果不能复用 (否则被判为bad的成员可能回到sorted中)
+        kind_01 = f"01/{self.model_name}"
+        if self.dedup is not None:
+            tag = f"/dedup-{getattr(self.dedup, 'threshold', type(self.dedup).__name__)}"
+            mode += tag
+            kind_01 += tag
+
         if fast: #如果快速排序
             print("开始快速排序.....")
             for index, question in enumerate(question_list):
                 contexts = contexts_list[index]
+                key = content_key(question, contexts)
                 print(f'\nQuestion {index+1}/{len(question_list)}')
 
+                done = journal.get(mode, key) if resume else None
+                if done is not None:
+                    print("该问题已完成排序, 从运行日志中恢复")
+                    results.append(self.restore(question, contexts, done))
+                    continue
+
                 # good 和 bad 是包含/不包含回答问题信息的列表，按原输入列表升序排列
                 # indices 是根据上下文相关性对 good 列表进行排序的结果
-                good, bad = self.sort_01(contexts=contexts, question=question)
-                indices, comparisons = self.binary_insert_sort(contexts=contexts, question=question, indices=good[:])
+                # 近似重复的contexts只交给GPT处理每一类的代表, 结果再映射回全部成员的原始下标
+                clusters = self.near_duplicates(contexts)
+                view = clusters.contexts(contexts)
+                labels = journal.get(kind_01, key) if resume else None
+                if labels is not None:
+                    good, bad = labels["good"], labels["bad"]
+                else:
+                    good, bad = self.sort_01(contexts=view, question=question)
+                    good, bad = sorted(clusters.expand(good)), sorted(clusters.expand(bad))
+                    journal.record(kind_01, key, {"good": good, "bad": bad})
+                # 排序、Top-k和unordered都按每一类的代表计算, 最后再映射回全部成员; k不超过代表的数量, 只对这个问题有效
+                candidates = clusters.compress(good)
+                top_k = self.clamp_k(k, len(candidates))
+                positions, comparisons = self.rank(contexts=view, question=question, indices=candidates, method=method, k=top_k, top=top, window=window, step=step, passes=passes)
+                indices = clusters.expand(positions)
+                self.report_graph(question, comparisons)
                 print(f"Sorted Good indices: {indices}")
                 print(f"Bad indices: {bad}")
 
@@ -226,44 +655,66 @@ class DOC_SORT:
                 # e.g. [0, 1, 5, 3, 9, 19, 11, 13, 17, 14] 和 [0, 1, 3, 5, 9, 11, 13, 14, 17, 19] ...
                 score = self.spearman_score(list1=indices, list2=good)
                 print('Spearmans correlation coefficient: %.3f' % score)
-                if k > len(indices):
-                    if len(indices)>=10:
-                        print(f"k值大于有用contexts的长度，将取默认长度10")
-                        k = 10
-                    else:
-                        print(f"k值大于有用contexts的长度，将取最大长度{len(indices)}")
-                        k = len(indices)
-                sim, overlap = self.top_k_similarity(list1=indices, list2=good, k=k, top=top)
-                print(f"Top-{k} similarity score is: {sim}")
+                sim, overlap = self.top_k_similarity(list1=positions, list2=sorted(candidates), k=top_k, top=top)
+                overlap = clusters.expand(overlap)
+                print(f"Top-{top_k} similarity score is: {sim}")
                 print(f"Overlap indices are: {overlap}")
 
-                res = {"question": question, "contexts": contexts, "good": good, "bad": bad, "sorted": indices, "spearman": score, "sim": sim, "overlap": overlap}
+                unordered = self.unordered(positions, method, top_k, top)
+                res = {"question": question, "contexts": contexts, "good": good, "bad": bad, "sorted": indices, "unordered": None if unordered is None else clusters.expand(unordered), "spearman": score, "sim": sim, "overlap": overlap}
                 results.append(res)
+                self.journal_result(journal, mode, key, res, top_k)
             
         else: # 如果200个统一排序
             print("开始全部两两排序.....")
             for index, question in enumerate(question_list):
                 contexts = contexts_list[index]
+                key = content_key(question, contexts)
                 print(f'\nQuestion {index+1}/{len(question_list)}')
+
+                done = journal.get(mode, key) if resume else None
+                if done is not None:
+                    print("该问题已完成排序, 从运行日志中恢复")
+                    results.append(self.restore(question, contexts, done))
+                    continue
             
-                indices, comparisons = self.binary_insert_sort(contexts=contexts, question=question)
+                clusters = self.near_duplicates(contexts)
+                top_k = self.clamp_k(k, len(clusters))
+                positions, comparisons = self.rank(contexts=clusters.contexts(contexts), question=question, method=method, k=top_k, top=top, window=window, step=step, passes=passes)
+                indices = clusters.expand(positions)
+                self.report_graph(question, comparisons)
                 print("Sorted indices:", indices)
                 score = self.spearman_score(list1=indices)
                 print('Spearmans correlation coefficient: %.3f' % score)
-                if k > len(indices):
-                    print(f"k值大于有用contexts的长度，将取最大长度{len(indices)}")
-                    k = len(indices)
-                sim, overlap = self.top_k_similarity(list1=indices, k=k, top=top)            
-                print(f"Top-{k} similarity score is: {sim}")
+                sim, overlap = self.top_k_similarity(list1=positions, k=top_k, top=top)
+                overlap = clusters.expand(overlap)
+                print(f"Top-{top_k} similarity score is: {sim}")
                 print(f"Overlap indices are: {overlap}")
 
-                res = {"question": question, "contexts": contexts, "good": None, "bad": None, "sorted": indices, "spearman": score, "sim": sim, "overlap": overlap}
+                unordered = self.unordered(positions, method, top_k, top)
+                res = {"question": question, "contexts": contexts, "good": None, "bad": None, "sorted": indices, "unordered": None if unordered is None else clusters.expand(unordered), "spearman": score, "sim": sim, "overlap": overlap}
                 results.append(res)
+                self.journal_result(journal, mode, key, res, top_k)
 
+        journal.close()
 
-        with open(f'./result/sorted_indices.json', 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, cls=CompactJSONEncoder)
-        
+        if stream:
+            results.close()
+            results = results.reader()
+            if legacy:
+                # 从保存的结果逐个问题写入旧版的sorted_indices.json, 内存占用同样与问题数量无关
+                write_json(os.path.join(result_dir, 'sorted_indices.json'), results)
+        else:
+            if not os.path.exists(result_dir):
+                os.makedirs(result_dir)
+            with open(os.path.join(result_dir, 'sorted_indices.json'), 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, cls=CompactJSONEncoder)
+
+        print(f"GPT缓存统计: {self.cache.stats()}")
+        if self.prefilter is not None:
+            print(f"词法预筛选统计: {self.prefilter.report()}")
+        default_metrics().save(result_dir)
+        print(f"GPT调用统计已保存至{os.path.join(result_dir, 'metrics.json')}和{os.path.join(result_dir, 'metrics.prom')}中")
         return results
 
 
@@ -0,0 +1,221 @@
+'''
+从ES系统批量获取contexts: 每次msearch请求合并batch_size个问题的查询, 同时发送concurrency个请求,
+使用异步客户端AsyncElasticsearch (aiohttp连接池), 不返回向量字段
+
+pairs = [(company_name, question_body), ...]
+question_list, contexts_list = ES_Ingest().fetch(pairs)          # 一次取回全部问题
+for question_list, contexts_list in ES_Ingest().stream(pairs):   # 每取回batch_size个问题输出一次, 后面的批次继续在后台获取
+    sort(question_list, contexts_list)
+
+ES地址和账号读取自环境变量 (或.env) ES_SERVER_ADDRESS, ES_USER_NAME, ES_PASSWORD
+'''
+import asyncio
+import os
+import queue
+import threading
+from collections import deque
+from dotenv import load_dotenv
+
+INDEX = "company-news"
+EXCLUDES = ("content_embedding", "keywords_embedding")
+# msearch中单个查询失败时可以重试的状态码
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# 返回结果只保留contexts和错误信息, 去掉_id/_score等不需要的字段
+FILTER_PATH = ["responses.hits.hits._source", "responses.error", "responses.status"]
+
+
+def _serializers():
+    # 安装了orjson时用orjson解析返回结果 (200个contexts x 50个问题的结果约10MB, 比json快数倍), 否则使用客户端默认的json
+    try:
+        import orjson
+    except ImportError:
+        return None
+    from elasticsearch.serializer import JsonSerializer
+
+    class Orjson_Serializer(JsonSerializer):
+        def loads(self, data):
+            return orjson.loads(data) if data else None
+
+    serializer = Orjson_Serializer()
+    return {"application/json": serializer, "application/vnd.elasticsearch+json": serializer}
+
+
+class ES_Ingest():
+    '''
+    hosts: ES地址, 默认为None读取环境变量ES_SERVER_ADDRESS
+    basic_auth: (用户名, 密码), 默认为None读取环境变量ES_USER_NAME/ES_PASSWORD
+    index: 索引名称, 默认"company-news"
+    size: 每个问题获取的contexts数量 (top-N), 默认200
+    batch_size: 每个msearch请求包含的问题数量, 默认50
+    concurrency: 同时发送的msearch请求数量上限, 也是连接池大小, 默认4
+    content_field: contexts所在的字段, 默认"metadata.content"
+    excludes: 不返回的字段, 默认为两个向量字段 (体积很大); _source只包含content_field
+    max_retries: 请求失败/超时以及msearch中单个查询返回429/5xx时的重试次数, 默认3
+    request_timeout: 每个请求的超时时间(秒), 默认60
+    '''
+
+    def __init__(self, hosts=None, basic_auth=None, index=INDEX, size=200, batch_size=50, concurrency=4, content_field="metadata.content", excludes=EXCLUDES, max_retries=3, request_timeout=60):
+        load_dotenv()
+        self.hosts = hosts or os.getenv("ES_SERVER_ADDRESS")
+        if basic_auth is None and os.getenv("ES_USER_NAME"):
+            basic_auth = (os.getenv("ES_USER_NAME"), os.getenv("ES_PASSWORD", ""))
+        self.basic_auth = basic_auth
+        self.index = index
+        self.size = size
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.content_field = content_field
+        self.excludes = list(excludes)
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+
+    def query(self, company, question):
+        '''与原来es.search相同的查询: 限定公司, 按问题内容打分'''
+        return {
+            "bool": {
+                "must": [{"match_phrase": {"collection_info.collect_id": company}}],
+                "should": [{"match": {"metadata.content": {"query": question, "boost": 8}}}],
+            }
+        }
+
+    def searches(self, pairs):
+        '''msearch请求体: 每个问题一行header一行查询'''
+        searches = []
+        for company, question in pairs:
+            searches.append({"index": self.index})
+            searches.append({"query": self.query(company, question), "size": self.size, "_source": {"includes": [self.content_field], "excludes": self.excludes}})
+        return searches
+
+    def contexts(self, response):
+        '''一个查询的结果 -> contexts列表 (按ES的顺序)'''
+        contexts = []
+        for hit in response.get("hits", {}).get("hits", []):
+            value = hit.get("_source", {})
+            for key in self.content_field.split("."):
+                value = value.get(key) if isinstance(value, dict) else None
+            if value:
+                contexts.append(value)
+        return contexts
+
+    def client(self):
+        from elasticsearch import AsyncElasticsearch
+
+        if not self.hosts:
+            raise ValueError("未设置ES地址, 请传入hosts或设置环境变量ES_SERVER_ADDRESS")
+        hosts = [self.hosts] if isinstance(self.hosts, str) else list(self.hosts)
+        return AsyncElasticsearch(
+            hosts,
+            basic_auth=self.basic_auth,
+            connections_per_node=self.concurrency,
+            request_timeout=self.request_timeout,
+            max_retries=self.max_retries,
+            retry_on_timeout=True,
+            retry_on_status=RETRY_STATUS,
+            serializers=_serializers(),
+        )
+
+    async def search_batch(self, client, pairs):
+        '''一个msearch请求, 输出每个问题的contexts; 单个查询失败时只重试失败的查询'''
+        results = [None] * len(pairs)
+        pending = list(range(len(pairs)))
+        for attempt in range(self.max_retries + 1):
+            response = await client.msearch(searches=self.searches([pairs[i] for i in pending]), filter_path=FILTER_PATH)
+            failed = []
+            for i, item in zip(pending, response["responses"]):
+                if "error" not in item:
+                    results[i] = self.contexts(item)
+                elif item.get("status") in RETRY_STATUS and attempt < self.max_retries:
+                    failed.append(i)
+                else:
+                    raise RuntimeError(f"ES查询失败: {pairs[i]}, status={item.get('status')}, error={item['error']}")
+            if not failed:
+                break
+            pending = failed
+            await asyncio.sleep(0.5 * 2 ** attempt)
+        return results
+
+    async def abatches(self, pairs):
+        '''
+        异步生成器, 按输入顺序每次输出一个批次 (pairs, contexts_list)
+        同时最多有concurrency个msearch请求在进行, 先完成的批次等待前面的批次输出
+        '''
+        pairs = list(pairs)
+        client = self.client()
+        try:
+            starts = iter(range(0, len(pairs), self.batch_size))
+            running = deque()
+
+            def submit():
+                start = next(starts, None)
+                if start is not None:
+                    batch = pairs[start:start + self.batch_size]
+                    running.append((batch, asyncio.ensure_future(self.search_batch(client, batch))))
+
+            for _ in range(self.concurrency):
+                submit()
+            while running:
+                batch, task = running[0]
+                contexts_list = await task
+                running.popleft()
+                submit()
+                yield batch, contexts_list
+        finally:
+            # 出错或者调用方提前停止时取消还没有完成的请求
+            for _, task in running:
+                task.cancel()
+            await client.close()
+
+    def stream(self, pairs, template="{question}"):
+        '''
+        同步生成器, 每次输出一个批次的 (question_list, contexts_list), 可以直接传入sort/generate或DOC_SORT.run/Pipeline.run
+        获取在后台线程中进行, 处理当前批次时后面的批次继续获取 (最多提前concurrency个批次)
+        template: 问题文本的格式, 可以使用{company}和{question}, 例如"{company}{question}"
+        '''
+        output = queue.Queue(maxsize=self.concurrency)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    output.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        async def produce():
+            async for batch, contexts_list in self.abatches(pairs):
+                question_list = [template.format(company=company, question=question) for company, question in batch]
+                # 在线程中等待队列有空位, 调用方处理较慢时事件循环继续运行, 正在进行的msearch请求不会超时
+                if not await asyncio.to_thread(put, (question_list, contexts_list)):
+                    break
+
+        def worker():
+            try:
+                asyncio.run(produce())
+                put(done)
+            except BaseException as e:
+                put(e)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = output.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+    def fetch(self, pairs, template="{question}"):
+        '''获取全部问题的contexts, 输出 (question_list, contexts_list)'''
+        question_list, contexts_list = [], []
+        for questions, contexts in self.stream(pairs, template=template):
+            question_list.extend(questions)
+            contexts_list.extend(contexts)
+        return question_list, contexts_list
@@ -1,15 +1,23 @@
 import json
 import os
-from tqdm import tqdm
-from pathlib import Path
+import queue
+import threading
 from .gen_gt import Gen_GT
-from .ragas_eval import RAGAs_Eval
+from .run_journal import Run_Journal, content_key
+from .metrics import default_metrics, start_run
 
 class Pipeline():
-    def __init__(self):
-        self.gt = Gen_GT()
+    # cache: GPT回答缓存LLM_Cache, 默认为None使用全局共享的缓存
+    # governor: GPT请求限流与重试Rate_Governor, 默认为None使用全局共享的限流器
+    # concurrency: 生成标准答案时同时发送的GPT请求数量上限, 默认为1即逐个调用
+    # dedup: 生成标准答案时近似重复的contexts只使用一个, 见Gen_GT
+    # budget: 快速版按token数量分组, 每个prompt不超过该token数量, True代表模型上下文窗口减去输出预留, 默认为None即20个一组
+    def __init__(self, cache=None, governor=None, concurrency=1, dedup=None, budget=None):
+        self.gt = Gen_GT(cache=cache, governor=governor, concurrency=concurrency, dedup=dedup)
+        self.budget = budget
+        self.eval = None   # RAGAs评分系统在第一次评分时才创建, 之后重复使用
     
-    def run(self, question_list, contexts_list, answer_list=None, ground_truth_list=None, chat_model='gpt-4-turbo', k=10, fast=True):
+    def run(self, question_list, contexts_list, answer_list=None, ground_truth_list=None, chat_model='gpt-4-turbo', k=10, fast=True, batch_size=None, resume=False, journal_path=None, good_list=None, result_dir='./result'):
         '''
         Eval_Pipeline最终调用端口, 输入为:
         question_list = [q_1, q_2,...,q_n]  全部问题列表 list(str)
@@ -19,10 +27,19 @@ class Pipeline():
         chat_model: 生成标准答案的GPT模型 (可选, 默认为'gpt-4-turbo')
         save_data: 是否将数据保存成结构化的数据/是否将数据储存成.json (可选, 默认为True), 会将数据保存在./full或者./gt中
         k: Top-k个contexts用于RAGAs评分 (可选, 默认为10)
+        batch_size: RAGAs批量评分时每批的问题数量 (可选, 默认为None逐个问题评分)
+        resume: 是否从运行日志中恢复 (可选, 默认为False), True则跳过已经生成标准答案/已经评分的问题
+        journal_path: 运行日志路径 (可选, 默认为None即result_dir/journal_pipeline.jsonl), 每完成一个问题立即写入
+        good_list: 每个问题有用的contexts下标 (可选, 例如排序结果中的good), 按token分组时有用的contexts排在前面
+        result_dir: 结果文件夹 (可选, 默认为./result), 分数保存在result_dir/result.xlsx
         '''
+        start_run()
+        journal = Run_Journal(journal_path or os.path.join(result_dir, 'journal_pipeline.jsonl'))
         
         if answer_list is not None:
-            self.eval = RAGAs_Eval()
+            if self.eval is None:
+                from .ragas_eval import RAGAs_Eval   # ragas/datasets/pandas导入较慢, 只在评分时导入
+                self.eval = RAGAs_Eval(governor=self.gt.governor)
             if ground_truth_list is None:
                 print("生成标准答案中.....")
                 ground_truths = []
@@ -31,20 +48,19 @@ class Pipeline():
                 answer = answer_list[index]
                 if ground_truth_list is None:
                     print(f'Question {index+1}/{len(question_list)}')
-                    if fast:
-                        ground_truth = self.gt.generate_gt_fast(question, contexts, chat_model=chat_model, max_item=20) # 分成20个一组
-                    else:
-                        ground_truth = self.gt.generate_gt(question, contexts, chat_model=chat_model)
+                    ground_truth = self.ground_truth(question, contexts, chat_model, fast, journal, resume, good_list[index] if good_list else None)
                     ground_truths.append(ground_truth)
                 else:
                     ground_truth = ground_truth_list[index]
 
             print("\nRAGAs评分中.....")
             if ground_truth_list is None:
-                score = self.eval.run(question_list, contexts_list, answer_list, ground_truths, k=k)
+                score = self.eval.run(question_list, contexts_list, answer_list, ground_truths, k=k, batch_size=batch_size, journal=journal, resume=resume, result_dir=result_dir)
             else:
-                score = self.eval.run(question_list, contexts_list, answer_list, ground_truth_list, k=k)
-            print("\n分数结果已保存至./result/result.xlsx中")
+                score = self.eval.run(question_list, contexts_list, answer_list, ground_truth_list, k=k, batch_size=batch_size, journal=journal, resume=resume, result_dir=result_dir)
+            journal.close()
+            default_metrics().save(result_dir)
+            print(f"\n分数结果已保存至{os.path.join(result_dir, 'result.xlsx')}中")
             return score
         else:
             #print("仅生成问题的标准答案, 如需进行RAGAs评分, 请提供答案列表answer_list")
@@ -53,22 +69,163 @@ class Pipeline():
             for index, question in enumerate(question_list):
                 print(f'Question {index+1}/{len(question_list)}')
                 contexts = contexts_list[index]
-                if fast:
-                    ground_truth = self.gt.generate_gt_fast(question, contexts, chat_model=chat_model, max_item=20) # 分成20个一组
-                else:
-                    ground_truth = self.gt.generate_gt(question, contexts, chat_model=chat_model)
+                ground_truth = self.ground_truth(question, contexts, chat_model, fast, journal, resume, good_list[index] if good_list else None)
                 ground_truths.append(ground_truth)
                 
 
-                data = {"question": question, "contexts":contexts, "ground_truth":ground_truth}
-                # 将生成的ground_truth连同question和contexts一起存入一个json中
-                if not os.path.exists('./gt'):
-                    os.makedirs('./gt')
-                with open(f'./gt/GT_{question}.json', 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
+                self.save_ground_truth(question, contexts, ground_truth)
+            journal.close()
+            default_metrics().save(result_dir)
             print("\n标准答案已保存至./gt中") 
             return ground_truths
 
+    def stream(self, question_list, contexts_list, answer_list=None, ground_truth_list=None, chat_model='gpt-4-turbo', k=10, fast=True, gt_workers=2, eval_workers=2, queue_size=None, resume=False, journal_path=None, good_list=None, result_dir='./result'):
+        '''
+        流式版本的run: 每个问题生成标准答案后立即进入RAGAs评分, 不需要等待全部问题的标准答案
+        两个阶段各自使用一组线程, 中间用有界队列连接, 总耗时接近较慢的一个阶段, 而不是两个阶段之和
+        输入与run相同, 另外:
+        gt_workers: 同时生成标准答案的问题数量 (可选, 默认为2)
+        eval_workers: 同时进行RAGAs评分的问题数量 (可选, 默认为2)
+        queue_size: 等待评分的问题数量上限, 评分跟不上时暂停生成标准答案 (可选, 默认为None即2*eval_workers)
+
+        生成器, 每完成一个问题输出一次 (按完成的顺序): {"index": 下标, "question": 问题, "ground_truth": 标准答案, "score": 分数}
+        score为四个分数的dict, answer_list为None时为None (与run相同仅生成标准答案, 保存在./gt中)
+        全部问题完成后与run相同, 按输入顺序将分数保存至result_dir/result.xlsx
+        '''
+        start_run()
+        journal = Run_Journal(journal_path or os.path.join(result_dir, 'journal_pipeline.jsonl'))
+        if answer_list is not None and self.eval is None:
+            from .ragas_eval import RAGAs_Eval
+            self.eval = RAGAs_Eval(governor=self.gt.governor)
+
+        tasks = queue.Queue()
+        for index in range(len(question_list)):
+            tasks.put(index)
+        ready = queue.Queue(maxsize=queue_size or 2 * eval_workers)
+        output = queue.Queue()
+        stop = threading.Event()
+        done = object()
+
+        # 队列操作每0.1秒检查一次stop, 出错或者调用方提前停止时全部线程都可以退出
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return done
+
+        def generate():
+            while not stop.is_set():
+                try:
+                    index = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                question, contexts = question_list[index], contexts_list[index]
+                if ground_truth_list is not None:
+                    ground_truth = ground_truth_list[index]
+                else:
+                    ground_truth = self.ground_truth(question, contexts, chat_model, fast, journal, resume, good_list[index] if good_list else None)
+                if answer_list is None:
+                    self.save_ground_truth(question, contexts, ground_truth)
+                    put(output, {"index": index, "question": question, "ground_truth": ground_truth, "score": None})
+                else:
+                    put(ready, (index, ground_truth))
+
+        def score():
+            while True:
+                item = get(ready)
+                if item is done:
+                    return
+                index, ground_truth = item
+                question = question_list[index]
+                kind, key = self.eval.score_key(question, contexts_list[index], answer_list[index], ground_truth, k)
+                if resume and journal.has(kind, key):
+                    row = journal.get(kind, key)
+                else:
+                    result = self.eval.score_question(question, contexts_list[index], answer_list[index], ground_truth, k)
+                    row = result.to_pandas().to_dict('records')[0]
+                    journal.record(kind, key, row)
+                put(output, {"index": index, "question": question, "ground_truth": ground_truth, "score": row})
+
+        def worker(fn):
+            try:
+                fn()
+            except BaseException as e:
+                stop.set()
+                output.put(e)
+
+        def coordinate():
+            # 标准答案全部生成后通知评分线程结束, 评分全部完成后通知生成器结束
+            generators = [threading.Thread(target=worker, args=(generate,), daemon=True) for _ in range(max(1, gt_workers))]
+            scorers = [threading.Thread(target=worker, args=(score,), daemon=True) for _ in range(max(1, eval_workers) if answer_list is not None else 0)]
+            for thread in generators + scorers:
+                thread.start()
+            for thread in generators:
+                thread.join()
+            for _ in scorers:
+                put(ready, done)
+            for thread in scorers:
+                thread.join()
+            output.put(done)
+
+        coordinator = threading.Thread(target=coordinate, daemon=True)
+        coordinator.start()
+        rows = [None] * len(question_list)
+        try:
+            while True:
+                item = output.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                rows[item["index"]] = item["score"]
+                if item["score"] is not None:
+                    item = dict(item, score=self.eval.score_dict(item["score"]))
+                yield item
+        finally:
+            stop.set()
+            coordinator.join()
+            journal.close()
+            default_metrics().save(result_dir)
+
+        if answer_list is not None:
+            import pandas as pd
+            self.eval.save_frame(pd.DataFrame(rows), result_dir)
+            print(f"\n分数结果已保存至{os.path.join(result_dir, 'result.xlsx')}中")
+        else:
+            print("\n标准答案已保存至./gt中")
+
+    # 将生成的ground_truth连同question和contexts一起存入一个json中
+    def save_ground_truth(self, question, contexts, ground_truth):
+        data = {"question": question, "contexts":contexts, "ground_truth":ground_truth}
+        os.makedirs('./gt', exist_ok=True) # stream模式下多个线程可能同时创建
+        with open(f'./gt/GT_{question}.json', 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+
+    # 生成一个问题的标准答案并写入运行日志; resume=True时如果日志中已有该问题的标准答案则直接使用
+    def ground_truth(self, question, contexts, chat_model, fast, journal, resume, good=None):
+        # contexts (以及分组使用的good) 变化后需要重新生成
+        kind, key = f"gt/{'fast' if fast else 'full'}/{chat_model}", content_key(question, [contexts, good])
+        if resume and journal.has(kind, key):
+            print("该问题已生成标准答案, 从运行日志中恢复")
+            return journal.get(kind, key)
+        if fast:
+            ground_truth = self.gt.generate_gt_fast(question, contexts, chat_model=chat_model, max_item=20, budget=self.budget, good=good, journal=journal, resume=resume) # 分成20个一组, 或按token分组
+        else:
+            ground_truth = self.gt.generate_gt(question, contexts, chat_model=chat_model)
+        journal.record(kind, key, ground_truth)
+        return ground_truth
+
 # 三种调用方式：
 # 1. 用户上传question, contexts, answer, 让系统生成标准答案和评分 (常用！！！！)
     # score = p.run(question_list, contexts_list, answer_list, ground_truth_list=None, save_data=True, k=10, fast=True)
@@ -78,4 +235,7 @@ class Pipeline():
     # 返回分数列表
 # 3. 用户上传question, contexts, 并设置answer_list=None, 仅让系统生成标准答案
     # ground_truth = p.run(question_list, contexts_list, answer_list=None, ground_truth_list=None, save_data=True, k=10, fast=True)
-    # 返回标准答案列表
\ No newline at end of file
+    # 返回标准答案列表
+# 以上三种方式都可以使用流式版本, 每完成一个问题输出一次:
+    # for item in p.stream(question_list, contexts_list, answer_list, ground_truth_list=None, k=10, fast=True, gt_workers=2, eval_workers=2):
+    #     print(item["question"], item["score"])
@@ -1,17 +1,67 @@
 import os
 from tqdm import tqdm
 import openai
-import tiktoken
 import random
 from langchain_openai.chat_models import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain.prompts import ChatPromptTemplate
+from .llm_cache import Cached_Chain, default_cache, invoke_all
+from .rate_limit import default_governor
+from .token_counter import token_counter, context_window, first_fit_decreasing, budget_k, Message_Budget
+from .metrics import staged, default_metrics
+from .near_duplicates import make_dedup, cluster_contexts
+from .run_journal import content_key
+
+# chat消息格式额外占用的token (role, 分隔符等)
+PROMPT_MARGIN = 16
 
 
 class Gen_GT():
-    def __init__(self):
+    # concurrency: 快速版中同时发送的GPT请求数量上限, 默认为1即逐个调用
+    # dedup: 近似重复去重, 默认为None不去重; True使用默认阈值0.8, 数字为Jaccard相似度阈值, 也可以传入Near_Duplicates
+    def __init__(self, cache=None, governor=None, concurrency=1, dedup=None):
         # 加载openai key
         openai.api_key = os.getenv("OPENAI_API_KEY")
+        self.concurrency = max(1, int(concurrency))
+        # GPT回答缓存, 默认为None使用全局共享的缓存
+        self.cache = cache if cache is not None else default_cache()
+        # GPT请求限流与重试, 默认为None使用全局共享的限流器
+        self.governor = governor if governor is not None else default_governor()
+        self.dedup = make_dedup(dedup)
+        self._client = None
+
+    # send使用的openai客户端: 重试由Rate_Governor统一处理并计数, 关闭客户端自己的重试 (默认2次), 否则失败的请求会绕过限流器重复发送
+    def client(self):
+        if self._client is None:
+            self._client = openai.OpenAI(api_key=openai.api_key, max_retries=0)
+        return self._client
+
+    # 近似重复的contexts只保留每一类的代表 (下标最小的一个)
+    # good: (可选) contexts中有用的下标, 同时映射为去重后的下标
+    def unique_contexts(self, contexts, good=None):
+        if self.dedup is None:
+            return contexts, good
+        clusters = cluster_contexts(self.dedup, contexts)
+        return clusters.contexts(contexts), (None if good is None else clusters.compress(good))
+
+    # invoke_all的运行日志版本: 每得到一组的回答立即写入journal, resume=True时日志中已有的组直接使用
+    # 日志的key为问题+该组输入内容的哈希值, 分组或contexts变化后不会误用旧的回答
+    def invoke_journaled(self, chain, inputs, kind, journal=None, resume=False, desc=None):
+        if journal is None:
+            return invoke_all(chain, inputs, concurrency=self.concurrency, desc=desc)
+        keys = [content_key(x["question"], x["context_list"]) for x in inputs]
+        answers = [journal.get(kind, key) if resume else None for key in keys]
+        todo = [i for i, answer in enumerate(answers) if answer is None]
+
+        class Journaled():
+            def invoke(self, i):
+                answer = chain.invoke(inputs[i])
+                journal.record(kind, keys[i], answer)
+                return answer
+
+        for i, answer in zip(todo, invoke_all(Journaled(), todo, concurrency=self.concurrency, desc=desc)):
+            answers[i] = answer
+        return answers
 
     # GPT 长文档问题回答 (分割文本+每个文本单独回答)
     def send(self, prompt, text_data, chat_model="gpt-3.5-turbo", model_token_limit=8192, max_tokens=2000):
@@ -31,11 +81,11 @@ class Gen_GT():
         - list：GPT的回答。
         """
 
-        # 将文本数据tokenize
-        tokenizer = tiktoken.encoding_for_model(chat_model)
+        # 将文本数据tokenize (每个模型的tokenizer只加载一次)
+        tokenizer = token_counter(chat_model)
         token_integers = tokenizer.encode(text_data)
 
-        if len(token_integers) + len(tokenizer.encode(prompt))> max_tokens:
+        if len(token_integers) + tokenizer.count(prompt)> max_tokens:
             chunk_size = max_tokens
         else:
             chunk_size = len(token_integers)
@@ -47,30 +97,45 @@ class Gen_GT():
         ]
         chunks = [tokenizer.decode(chunk) for chunk in chunks]
 
-        # 初始化输入message, 包含问题的prompt
+        # 初始化输入message, 包含问题的prompt, 同时记录messages的token总数
         responses = []
-        messages = [
+        budget = Message_Budget(tokenizer, [
             {"role": "user", "content": prompt},
-        ]
+        ])
+        messages = budget.messages
 
         # 遍历全部的片段，并结合prompt+question生成答案
+        client = self.client()
         for chunk in chunks:
-            messages.append({"role": "user", "content": chunk})
+            budget.append({"role": "user", "content": chunk})
 
             # 如果全部文本长度超过该值，则删除最先输入的文本内容
-            while (
-                sum(len(tokenizer.encode(msg["content"])) for msg in messages)
-                > model_token_limit
-            ):
-                messages.pop(1)  # Remove the oldest chunk
-
-            response = openai.chat.completions.create(model=chat_model, messages=messages)
-            chatgpt_response = response.choices[0].message.content.strip()
+            while budget.total > model_token_limit:
+                budget.pop(1)  # Remove the oldest chunk
+
+            # 相同模型+相同messages直接读取缓存
+            key = self.cache.make_key(chat_model, messages)
+            chatgpt_response = self.cache.get(key)
+            if chatgpt_response is None:
+                with default_metrics().timed(chat_model, budget.total) as call:
+                    response = self.governor.call(
+                        chat_model,
+                        lambda: client.chat.completions.create(model=chat_model, messages=messages),
+                        tokens=budget.total,
+                    )
+                    if response.usage is not None:
+                        call["prompt_tokens"] = response.usage.prompt_tokens
+                        call["completion_tokens"] = response.usage.completion_tokens
+                chatgpt_response = response.choices[0].message.content.strip()
+                self.cache.set(key, chatgpt_response, model=chat_model)
+            else:
+                default_metrics().record(chat_model, cached=True)
             responses.append(chatgpt_response)
 
         return responses
 
     # GPT 长文档问题回答 (合并总结多个回答，最终仅生成一个回答)
+    @staged("generate_gt")
     def generate_gt(self, question, context_list, chat_model='gpt-4-turbo'):
         """
         该方程与上一个方程结合使用，用于总结全部回答并最终将200个回答缩减成一个标准答案ground_truth
@@ -86,6 +151,7 @@ class Gen_GT():
         """
 
         responses = []
+        context_list, _ = self.unique_contexts(context_list)
 
         prompt_text = f'''
                         请根据给定的文档回答问题
@@ -120,10 +186,11 @@ class Gen_GT():
         return responses[0]
     
     # 将contexts随机分割成小的数据集, 每个数据集大小为split_size
-    def split_dataset(self, contexts, max_item=20):
+    # seed: (可选) 随机种子, 相同的种子得到相同的分组, 便于重复运行时命中GPT缓存
+    def split_dataset(self, contexts, max_item=20, seed=None):
         contexts_datasets = []       
         length = len(contexts)
-        random.shuffle(contexts)
+        random.Random(seed).shuffle(contexts)
         num_dataset = int(len(contexts)/max_item)
         for _ in range(num_dataset):
             contexts_datasets.append(contexts[:max_item])
@@ -134,8 +201,112 @@ class Gen_GT():
         return contexts_datasets
 
 
+    # 每个prompt的输入token上限: budget=True时为模型上下文窗口减去输出预留, 整数为指定的上限
+    def input_budget(self, chat_model, budget):
+        if budget is True:
+            window = context_window(chat_model)
+            return window - min(4096, window // 4)
+        return int(budget)
+
+    # 一个prompt中文本部分的token上限: 返回 (counter, limit, capacity), limit为完整prompt的上限, capacity为除去prompt本身后留给文本的部分
+    def prompt_capacity(self, prompt_text, question, chat_model, budget):
+        counter = token_counter(chat_model)
+        # 预留chat消息格式的token
+        limit = self.input_budget(chat_model, budget) - PROMPT_MARGIN
+        capacity = limit - len(counter.encode(prompt_text.format(question=question, context_list=[])))
+        return counter, limit, capacity
+
+    # 截断过长的文本并计算每个文本在prompt中的token数量
+    def measure(self, counter, contexts, capacity, min_per_group=1):
+        item_limit = capacity // min_per_group - 1
+        if item_limit <= 0:
+            raise ValueError(f"token budget {capacity} is too small for the prompt")
+
+        # 文档以python列表的形式填入prompt, 每个文本按repr计算token数量, 另加1个token的分隔符
+        texts = [self.truncate(counter, context, item_limit) for context in contexts]
+        truncated = sum(text != context for text, context in zip(texts, contexts))
+        if truncated:
+            print(f"警告: {truncated}/{len(contexts)}个文本超过每组token上限的1/{min_per_group} ({item_limit}个token), 已截断")
+        return texts, [counter.count(repr(text)) + 1 for text in texts]
+
+    # 按顺序把文本分组, 每组最多max_item个, 且完整prompt不超过input_budget (每组的数量由budget_k计算, 与pack_dataset使用同一个token上限)
+    def chunk_dataset(self, prompt_text, question, contexts, chat_model, max_item=20, budget=True, min_per_group=1):
+        """
+        参数：
+        - contexts (list(str))：需要分组的文本, 组内和组间都保持原来的顺序
+        - max_item (int)：每组最多的文本数量
+        - budget (bool/int)：见input_budget, 默认为模型上下文窗口减去输出预留
+        - min_per_group (int, 可选)：单个文本最多占每组的 1/min_per_group, 更长的文本会被截断
+
+        返回值：
+        - list(list(str))：分组结果; 全部文本都放得下时与每max_item个一组相同
+        """
+        counter, limit, capacity = self.prompt_capacity(prompt_text, question, chat_model, budget)
+        texts, costs = self.measure(counter, contexts, capacity, min_per_group)
+        datasets = []
+        start = 0
+        while start < len(texts):
+            # budget_k: 前n个文本的token总数小于max_tokens, 这里允许恰好等于capacity
+            n = max(min_per_group, int(budget_k(costs[start:start + max_item], max_item, capacity + 1)))
+            while n > min_per_group and len(counter.encode(prompt_text.format(question=question, context_list=texts[start:start + n]))) > limit:
+                n -= 1
+            datasets.append(texts[start:start + n])
+            start += n
+        return datasets
+
+    # 按token数量把contexts装入尽量少的组 (first-fit-decreasing), 保证每组的完整prompt不超过input_budget
+    def pack_dataset(self, prompt_text, question, contexts, chat_model, budget, good=None, drop_bad=False, min_per_group=1):
+        """
+        参数：
+        - prompt_text (str)：包含{question}和{context_list}的prompt
+        - contexts (list(str))：需要分组的文本
+        - budget (bool/int)：见input_budget
+        - good (list(int), 可选)：有用的contexts下标, 有用的和没用的分别装组, 有用的组排在前面
+        - drop_bad (bool, 可选)：是否丢弃good以外的contexts
+        - min_per_group (int, 可选)：单个文本最多占每组的 1/min_per_group, 更长的文本会被截断
+
+        返回值：
+        - list(list(str))：分组结果, 组内保持原来的顺序
+        """
+        counter, limit, capacity = self.prompt_capacity(prompt_text, question, chat_model, budget)
+        texts, costs = self.measure(counter, contexts, capacity, min_per_group)
+        if good is None:
+            parts = [list(range(len(texts)))]
+        else:
+            good_set = set(good)
+            parts = [sorted(good_set), [] if drop_bad else [i for i in range(len(texts)) if i not in good_set]]
+
+        groups = []
+        for part in parts:
+            for group in first_fit_decreasing([costs[i] for i in part], capacity):
+                groups.append([part[n] for n in group])
+
+        # 逐组检查完整prompt的token数量, 超过时把最后的文本移出, 移出的文本重新装组后排在这一组后面
+        # (重新装出的组都比原来的组小, 一定会结束)
+        datasets = []
+        while groups:
+            group = groups.pop(0)
+            overflow = []
+            while len(group) > 1 and len(counter.encode(prompt_text.format(question=question, context_list=[texts[i] for i in group]))) > limit:
+                overflow.insert(0, group.pop())
+            if overflow:
+                groups[:0] = [[overflow[n] for n in repacked] for repacked in first_fit_decreasing([costs[i] for i in overflow], capacity)]
+            datasets.append([texts[i] for i in group])
+        return datasets
+
+    # 截断超过max_tokens的文本 (按repr计算)
+    @staticmethod
+    def truncate(counter, text, max_tokens):
+        tokens = counter.encode(text)
+        while counter.count(repr(text)) > max_tokens:
+            keep = int(len(tokens) * max_tokens / counter.count(repr(text)) * 0.95)
+            tokens = tokens[:max(0, keep)]
+            text = counter.decode(tokens)
+        return text
+
     # GPT 长文档问题回答 快速版 (不需要先依次回答200个contexts, 直接20个为一组回答再合并)
-    def generate_gt_fast(self, question, contexts, chat_model='gpt-4-turbo', max_item=20):
+    @staged("generate_gt_fast")
+    def generate_gt_fast(self, question, contexts, chat_model='gpt-4-turbo', max_item=20, fan_in=None, budget=None, good=None, drop_bad=False, journal=None, resume=False):
         """
         该方程与上一个方程结合使用，用于总结全部回答并最终将200个回答缩减成一个标准答案ground_truth
 
@@ -143,6 +314,16 @@ class Gen_GT():
         - question (str): 问题
         - context_list (list(str))：200个contexts列表
         - chat_model (str, 可选)：生成答案使用的GPT模型，默认为'gpt-4-turbo'
+        - max_item (int, 可选)：每一组contexts的数量，默认为20; 每组的完整prompt同样不超过模型的输入token上限, 超过时这一组少放几个
+        - fan_in (int, 可选)：缩减时每次合并多少个答案，默认为None即与max_item相同 (同样受输入token上限限制)
+        - budget (bool/int, 可选)：按token数量分组, 每个prompt不超过该token数量, 组数尽量少 (此时不使用max_item和fan_in);
+                                   True代表模型上下文窗口减去输出预留, 默认为None即按max_item随机分组
+        - good (list(int), 可选)：有用的contexts下标 (例如sort_01的结果), 按token分组时有用的和没用的分别装组, 有用的组排在前面
+        - drop_bad (bool, 可选)：按token分组时是否丢弃good以外的contexts, 默认为False
+        - journal (Run_Journal, 可选)：运行日志, 每一组的初始答案和每一次合并的结果立即写入
+        - resume (bool, 可选)：是否使用日志中已有的各组答案, 中断后重新运行时只调用还没有完成的组
+
+        每一组的初始答案, 以及每一层缩减中的各组合并, 相互独立, 按self.concurrency并发发送
 
         返回值：
         - str：GPT最后生成的标准答案ground_truth。
@@ -158,51 +339,44 @@ class Gen_GT():
                         '''
         OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
         prompt = ChatPromptTemplate.from_template(prompt_text)
-        model = ChatOpenAI(openai_api_key=OPENAI_API_KEY, model=chat_model)
+        model = ChatOpenAI(openai_api_key=OPENAI_API_KEY, model=chat_model, max_retries=0)
         parser = StrOutputParser()
-        chain_bin = prompt | model | parser
-
-        contexts_datasets = self.split_dataset(contexts[:], max_item=max_item)
-
-        # 针对每个小的数据集生成一个问题
-        answers = []
-        for contexts_data in tqdm(contexts_datasets, desc='初始答案生成中(快速版)'):
-            answer = chain_bin.invoke({
-                    "question": question,
-                    "context_list": contexts_data,
-                })
-            #print(answer)
-            if '不知道' not in answer:
-                answers.append(answer)
-
-        # 循环缩减回答
+        chain_bin = Cached_Chain(prompt, model, parser, self.cache, self.governor, stage="generate_gt_fast")
+        fan_in = max(2, fan_in or max_item)
+
+        contexts, good = self.unique_contexts(contexts, good)
+        if budget:
+            # 按token数量装组, 相同的输入每次分组相同
+            contexts_datasets = self.pack_dataset(prompt_text, question, contexts, chat_model, budget, good=good, drop_bad=drop_bad)
+            print(f"按token分组: {len(contexts)}个contexts分为{len(contexts_datasets)}组")
+        else:
+            # 以问题作为随机种子, 同一个问题每次分组相同, 重复运行时可以直接读取缓存
+            contexts = contexts[:]
+            random.Random(question).shuffle(contexts)
+            contexts_datasets = self.chunk_dataset(prompt_text, question, contexts, chat_model, max_item=max_item)
+
+        # 针对每个小的数据集生成一个问题 (各组并发)
+        inputs = [{"question": question, "context_list": contexts_data} for contexts_data in contexts_datasets]
+        kind = f"gt_group/{chat_model}"
+        answers = self.invoke_journaled(chain_bin, inputs, kind, journal, resume, desc='初始答案生成中(快速版)')
+        answers = [answer for answer in answers if '不知道' not in answer]
+
+        # 树状循环缩减回答, 每一层每fan_in个答案合并为一个, 同一层的各组并发
         print("正在循环缩减回答.....")
         while len(answers)>1:
-            temp = []
-            if len(answers)>max_item:
-                num_dataset = int(len(answers)/max_item)
-                length = len(answers)
-                for _ in range(num_dataset):
-                    answer = chain_bin.invoke({
-                            "question": question,
-                            "context_list": answers[:max_item],
-                        })
-                    answers = answers[max_item:]
-                    temp.append(answer)
-                if num_dataset*max_item<length:
-                    diff = length-num_dataset*max_item
-                    answer = chain_bin.invoke({
-                            "question": question,
-                            "context_list": contexts[:diff],
-                        })
-                    temp.append(answer)
+            if budget:
+                # 每个答案最多占一半, 每一组至少合并两个答案
+                groups = self.pack_dataset(prompt_text, question, answers, chat_model, budget, min_per_group=2)
+                if len(groups) >= len(answers):
+                    raise ValueError("answers cannot be merged within the token budget")
             else:
-                answer = chain_bin.invoke({
-                            "question": question,
-                            "context_list": answers,
-                        })
-                temp.append(answer)
-            answers = temp[:]
+                groups = self.chunk_dataset(prompt_text, question, answers, chat_model, max_item=fan_in, min_per_group=2)
+            todo = [n for n, group in enumerate(groups) if len(group) > 1]
+            merged = self.invoke_journaled(chain_bin, [{"question": question, "context_list": groups[n]} for n in todo], kind, journal, resume)
+            # 只剩一个答案的组无需合并, 直接进入下一层
+            answers = [group[0] for group in groups]
+            for n, answer in zip(todo, merged):
+                answers[n] = answer
         return answers[0]
 
 
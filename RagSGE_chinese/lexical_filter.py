@@ -0,0 +1,220 @@
+import json
+import os
+import random
+import re
+import numpy as np
+from scipy import sparse
+
+
+TOKEN_PATTERN = re.compile(r"[一-鿿]+|[A-Za-z0-9]+")
+
+
+# 中文按字切分成相邻两个字的bigram (单独一个字保留为unigram), 英文/数字按单词切分
+def terms(text):
+    result = []
+    for token in TOKEN_PATTERN.findall(text):
+        if token.isascii():
+            result.append(token.lower())
+        elif len(token) == 1:
+            result.append(token)
+        else:
+            result.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return result
+
+
+class Lexical_Filter():
+    '''
+    0-1筛选前的本地词法预筛选 (只使用CPU, 不调用GPT)
+
+    以问题的字bigram为查询, 用BM25给一个问题的全部contexts打分, 分数归一化到0-1 (除以全部查询词都充分出现时的分数)
+    分数 <= low 的contexts直接判为bad, 分数 >= high 的直接判为good, 只有中间的不确定区间交给GPT判断
+    直接判断的contexts中随机抽取audit比例交给GPT复核, 统计与GPT的一致率
+
+    low: 低于(等于)该分数直接判为bad, 默认0.0即与问题没有任何相同的bigram; None代表不直接判为bad
+    high: 高于(等于)该分数直接判为good, 默认None代表不直接判为good
+    audit: 直接判断的contexts中抽查的比例, 默认0.05
+    k1, b: BM25参数
+
+    low/high可以用calibrate_from_results根据之前运行的GPT 0-1结果校准, 并保存/读取 (save/load)
+    '''
+
+    DEFAULT_PATH = "./cache/lexical_filter.json"
+
+    def __init__(self, low=0.0, high=None, audit=0.05, k1=1.5, b=0.75):
+        self.low = low
+        self.high = high
+        self.audit = audit
+        self.k1 = k1
+        self.b = b
+        self.reset()
+
+    def reset(self):
+        self.stats = {"total": 0, "auto_good": 0, "auto_bad": 0, "uncertain": 0, "audited": 0, "agree": 0}
+
+    def scores(self, question, contexts):
+        '''一个问题全部contexts的归一化BM25分数 (numpy数组)'''
+        n = len(contexts)
+        vocab = {term: j for j, term in enumerate(dict.fromkeys(terms(question)))}
+        if n == 0 or not vocab:
+            return np.zeros(n)
+
+        # 稀疏的词频矩阵, 只保留问题中出现的词
+        rows, cols = [], []
+        lengths = np.empty(n)
+        for i, context in enumerate(contexts):
+            context_terms = terms(context)
+            lengths[i] = len(context_terms)
+            for term in context_terms:
+                j = vocab.get(term)
+                if j is not None:
+                    rows.append(i)
+                    cols.append(j)
+        tf = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, len(vocab)))
+        tf.sum_duplicates()
+
+        df = np.bincount(tf.indices, minlength=len(vocab))
+        idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+        avgdl = lengths.mean() or 1.0
+        row_of = np.repeat(np.arange(n), np.diff(tf.indptr))
+        weights = tf.data * (self.k1 + 1) / (tf.data + self.k1 * (1 - self.b + self.b * lengths[row_of] / avgdl)) * idf[tf.indices]
+        scores = np.bincount(row_of, weights=weights, minlength=n)
+
+        # 每个词的得分上限为idf*(k1+1), 归一化后不同问题的分数可以比较
+        return scores / (idf.sum() * (self.k1 + 1))
+
+    def split(self, question, contexts):
+        '''
+        输出:
+        labels: 每个context的预筛选结果 (numpy数组), 1=good, 0=bad, -1=不确定需要GPT判断
+        audit: 需要GPT复核的直接判断的contexts (下标)
+        '''
+        scores = self.scores(question, contexts)
+        labels = np.full(len(contexts), -1, dtype=np.int8)
+        if self.low is not None:
+            labels[scores <= self.low] = 0
+        if self.high is not None:
+            labels[scores >= self.high] = 1
+
+        # 以问题为随机种子, 重复运行时抽查相同的contexts (可以命中GPT缓存)
+        rnd = random.Random(question)
+        audit = [i for i in np.flatnonzero(labels >= 0).tolist() if rnd.random() < self.audit]
+        return labels, audit
+
+    def observe(self, labels, responses):
+        '''
+        记录一个问题的预筛选结果
+        labels: split输出的labels
+        responses: GPT的判断 {下标: True/False}, 包括不确定的和抽查的contexts
+        '''
+        self.stats["total"] += len(labels)
+        self.stats["auto_good"] += int((labels == 1).sum())
+        self.stats["auto_bad"] += int((labels == 0).sum())
+        self.stats["uncertain"] += int((labels < 0).sum())
+        for i, good in responses.items():
+            if labels[i] >= 0:
+                self.stats["audited"] += 1
+                self.stats["agree"] += int(bool(labels[i]) == good)
+
+    def report(self):
+        '''节省的GPT调用比例和抽查一致率'''
+        stats = dict(self.stats)
+        skipped = stats["auto_good"] + stats["auto_bad"] - stats["audited"]
+        stats["skipped"] = skipped
+        stats["skip_rate"] = round(skipped / stats["total"], 3) if stats["total"] else 0.0
+        stats["agreement"] = round(stats["agree"] / stats["audited"], 3) if stats["audited"] else None
+        return stats
+
+    @staticmethod
+    def thresholds(scores, labels, target=0.95, min_support=20):
+        '''
+        根据已知的0-1结果选择阈值
+        scores: 归一化分数 (numpy数组)
+        labels: GPT的0-1结果 (numpy数组, 1=good)
+        target: 直接判断部分需要达到的准确率
+        min_support: 每一侧至少包含多少个样本才设置阈值
+
+        输出: (low, high), 无法达到target的一侧为None
+        '''
+        scores = np.asarray(scores, dtype=float)
+        labels = np.asarray(labels, dtype=float)
+        n = len(scores)
+        if n == 0:
+            return None, None
+        order = np.argsort(scores, kind="stable")
+        s, y = scores[order], labels[order]
+        # 相同分数必须同时判断, 只能在分数变化的位置切分
+        last_of_ties = np.append(s[1:] != s[:-1], True)
+        first_of_ties = np.insert(s[1:] != s[:-1], 0, True)
+
+        count = np.arange(1, n + 1)
+        bad_precision = 1 - np.cumsum(y) / count             # 分数 <= s[i] 中bad的比例
+        ok = last_of_ties & (bad_precision >= target) & (count >= min_support)
+        low = float(s[np.flatnonzero(ok)[-1]]) if ok.any() else None
+
+        count = n - np.arange(n)
+        good_precision = np.cumsum(y[::-1])[::-1] / count    # 分数 >= s[i] 中good的比例
+        ok = first_of_ties & (good_precision >= target) & (count >= min_support)
+        if low is not None:
+            ok &= s > low
+        high = float(s[np.flatnonzero(ok)[0]]) if ok.any() else None
+        return low, high
+
+    def calibrate(self, questions, contexts_list, goods, target=0.95, min_support=20):
+        '''
+        根据之前运行的GPT 0-1结果校准low/high
+        questions/contexts_list: 问题和对应的contexts
+        goods: 每个问题GPT判为good的下标
+        '''
+        all_scores, all_labels = [], []
+        for question, contexts, good in zip(questions, contexts_list, goods):
+            all_scores.append(self.scores(question, contexts))
+            labels = np.zeros(len(contexts))
+            labels[list(good)] = 1
+            all_labels.append(labels)
+        scores = np.concatenate(all_scores) if all_scores else np.zeros(0)
+        labels = np.concatenate(all_labels) if all_labels else np.zeros(0)
+
+        self.low, self.high = self.thresholds(scores, labels, target, min_support)
+        auto = np.zeros(len(scores), dtype=bool)
+        if self.low is not None:
+            auto |= scores <= self.low
+        if self.high is not None:
+            auto |= scores >= self.high
+        predicted = scores >= (self.high if self.high is not None else np.inf)
+        return {
+            "low": self.low,
+            "high": self.high,
+            "samples": len(scores),
+            "skip_rate": round(float(auto.mean()), 3) if len(scores) else 0.0,
+            "agreement": round(float((predicted[auto] == labels[auto].astype(bool)).mean()), 3) if auto.any() else None,
+        }
+
+    def calibrate_from_results(self, folder='./result', target=0.95, min_support=20):
+        '''使用DOC_SORT.run保存的结果 (sorted_indices.jsonl, 快速排序模式) 校准'''
+        from .result_store import Sorted_Results
+
+        questions, contexts_list, goods = [], [], []
+        for res in Sorted_Results(folder):
+            if res.get("good") is None:   # 全部两两排序模式没有0-1结果
+                continue
+            questions.append(res["question"])
+            contexts_list.append(res["contexts"])
+            goods.append(res["good"])
+        return self.calibrate(questions, contexts_list, goods, target, min_support)
+
+    def save(self, path=None):
+        path = path or self.DEFAULT_PATH
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"low": self.low, "high": self.high, "audit": self.audit, "k1": self.k1, "b": self.b}, f, indent=4)
+
+    @classmethod
+    def load(cls, path=None):
+        '''读取保存的阈值, 文件不存在时使用默认阈值'''
+        path = path or cls.DEFAULT_PATH
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(**json.load(f))
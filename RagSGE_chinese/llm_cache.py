@@ -0,0 +1,223 @@
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from .rate_limit import default_governor
+from .metrics import current_stage, default_metrics
+from .token_counter import token_counter
+
+
+class LLM_Cache():
+    '''
+    GPT回答的本地缓存 (SQLite), 以 模型名+完整prompt 的哈希值为key
+    同一个模型对同一个prompt的回答只需要付费一次, 重新运行时直接读取缓存
+
+    path: 缓存文件路径, 默认为./cache/llm_cache.sqlite (可用环境变量 RAGSGE_CACHE_PATH 修改)
+    max_bytes: 缓存最大容量(字节), 超过后删除最久未使用的记录, 默认512MB
+    max_age: 缓存有效期(秒), 超过后记录失效并被删除, 默认30天, None代表永不过期
+    enabled: 是否使用缓存, False代表绕过缓存 (也可设置环境变量 RAGSGE_CACHE=off)
+    '''
+
+    # 每写入多少条记录检查一次容量
+    EVICT_EVERY = 500
+
+    def __init__(self, path=None, max_bytes=512 * 1024 * 1024, max_age=30 * 24 * 3600, enabled=True):
+        self.path = path or os.getenv("RAGSGE_CACHE_PATH", "./cache/llm_cache.sqlite")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled and os.getenv("RAGSGE_CACHE", "on").lower() not in ("0", "off", "false")
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if self.enabled:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            # 多个线程并发调用GPT时共用一个连接, 由self._lock保证串行访问
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+                "size INTEGER, created REAL, accessed REAL)"
+            )
+            self._conn.commit()
+            self.evict()
+
+    @staticmethod
+    def make_key(model, prompt):
+        '''
+        model: 模型名
+        prompt: 渲染后的完整prompt (str), 或者messages列表
+        '''
+        if not isinstance(prompt, str):
+            prompt = json.dumps(prompt, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(f"{model}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if not self.enabled:
+            self.misses += 1
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM llm_cache WHERE key=?", (key,)).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self._conn.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed=? WHERE key=?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, response, model=""):
+        if not self.enabled:
+            return
+
+        now = time.time()
+        size = len(response.encode("utf-8")) + len(key)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            self._conn.commit()
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        '''删除过期记录, 如果总容量超过max_bytes则按最久未使用的顺序删除'''
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if self.max_age is not None:
+                self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.max_age,))
+            if self.max_bytes is not None:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+                if total > self.max_bytes:
+                    # 从最久未使用的记录开始删除, 直到总容量低于max_bytes
+                    rows = self._conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed").fetchall()
+                    stale = []
+                    for key, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM llm_cache WHERE key=?", stale)
+            self._conn.commit()
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self):
+        '''返回缓存命中次数, 未命中次数, 命中率和当前记录数量'''
+        entries = 0
+        if self.enabled:
+            with self._lock:
+                entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": entries,
+        }
+
+
+class Cached_Chain():
+    '''
+    替代 prompt | model | parser 的chain, 调用GPT前先查询LLM_Cache, 未命中时通过Rate_Governor发送请求
+    与LangChain的chain一样使用 .invoke({...}) 调用
+    每次调用都记录到Metrics中, 阶段为当前stage()标记的阶段, 没有标记时为stage
+    '''
+
+    def __init__(self, prompt, model, parser, cache, governor=None, stage=None, metrics=None):
+        self.prompt = prompt
+        self.model = model
+        self.parser = parser
+        self.cache = cache
+        self.governor = governor if governor is not None else default_governor()
+        self.model_name = getattr(model, "model_name", None) or getattr(model, "model", "")
+        self.chain = prompt | model | parser
+        self.stage = stage
+        self.metrics = metrics if metrics is not None else default_metrics()
+
+    def invoke(self, inputs):
+        text = self.prompt.format(**inputs)
+        key = self.cache.make_key(self.model_name, text)
+        current, question = current_stage()
+        stage = current or self.stage
+        if question is None:
+            question = inputs.get("question")
+
+        response = self.cache.get(key)
+        if response is not None:
+            self.metrics.record(self.model_name, cached=True, stage=stage, question=question)
+            return response
+
+        counter = token_counter(self.model_name)
+        start = time.time()
+        begin = time.perf_counter()
+        try:
+            response = self.governor.call(self.model_name, lambda: self.chain.invoke(inputs), prompt=text)
+        except Exception as error:
+            self.metrics.record(self.model_name, time.perf_counter() - begin, counter.count(text), error=error, stage=stage, question=question, start=start)
+            raise
+        self.metrics.record(self.model_name, time.perf_counter() - begin, counter.count(text), counter.count(response), stage=stage, question=question, start=start)
+        self.cache.set(key, response, model=self.model_name)
+        return response
+
+
+# 并发调用chain, 输出顺序与inputs一致
+def invoke_all(chain, inputs, concurrency=1, desc=None):
+    '''
+    chain: 需要调用的chain (Cached_Chain 或 LangChain的chain)
+    inputs: 数组, 每一个元素是chain.invoke的输入
+    concurrency: 最多同时发送的请求数量, 1代表逐个调用
+    desc: (可选) 进度条描述, 默认为None不显示进度条
+
+    输出：
+    responses: 与inputs一一对应的GPT回答
+    '''
+    if concurrency <= 1 or len(inputs) <= 1:
+        iterator = tqdm(inputs, desc=desc) if desc else inputs
+        return [chain.invoke(x) for x in iterator]
+
+    # 相互独立的请求并发发送, 最多同时发送concurrency个; 每个请求继承调用者的stage()标记
+    contexts = [contextvars.copy_context() for _ in inputs]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(inputs))) as executor:
+        responses = executor.map(lambda context, x: context.run(chain.invoke, x), contexts, inputs)
+        if desc:
+            responses = tqdm(responses, total=len(inputs), desc=desc)
+        return list(responses)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+# 全部模块(排序, 标准答案生成, 评分)共用一个缓存
+def default_cache():
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = LLM_Cache()
+        return _default_cache
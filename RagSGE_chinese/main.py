@@ -1,20 +1,41 @@
-from .es_context_sort import DOC_SORT
-from .eval_pipeline import Pipeline
+# 排序/生成/评分模块在调用时才导入, import RagSGE_chinese 和 sort() 不需要加载 ragas/datasets/pandas
+
+# Fetch Contexts from ES
+def fetch(pairs, size=200, batch_size=50, concurrency=4, template="{question}"):
+    from .es_ingest import ES_Ingest
+    ingest = ES_Ingest(size=size, batch_size=batch_size, concurrency=concurrency)
+    question_list, contexts_list = ingest.fetch(pairs, template=template)
+    return question_list, contexts_list
 
 # Sort Context
-def sort(question_list, contexts_list, k=10, top=True, fast=True):
-    compare = DOC_SORT()
-    results = compare.run(question_list=question_list, contexts_list=contexts_list, k=k, top=top, fast=fast)
+def sort(question_list, contexts_list, k=10, top=True, fast=True, concurrency=1, method="binary", resume=False, stream=True, prefilter=False, dedup=False, result_dir='./result', window=10, step=None, passes=None, legacy=False):
+    from .es_context_sort import DOC_SORT
+    compare = DOC_SORT(concurrency=concurrency, prefilter=prefilter, dedup=dedup)
+    results = compare.run(question_list=question_list, contexts_list=contexts_list, k=k, top=top, fast=fast, method=method, resume=resume, stream=stream, result_dir=result_dir, window=window, step=step, passes=passes, legacy=legacy)
     return results
 
 # Generate Ground Truth
-def generate(question_list, contexts_list, chat_model='gpt-4-turbo'):
-    p = Pipeline()
-    ground_truth = p.run(question_list, contexts_list, answer_list=None, ground_truth_list=None, chat_model=chat_model, k=10, fast=True)
+def generate(question_list, contexts_list, chat_model='gpt-4-turbo', concurrency=1, resume=False, dedup=False, budget=None, good_list=None, result_dir='./result'):
+    from .eval_pipeline import Pipeline
+    p = Pipeline(concurrency=concurrency, dedup=dedup, budget=budget)
+    ground_truth = p.run(question_list, contexts_list, answer_list=None, ground_truth_list=None, chat_model=chat_model, k=10, fast=True, resume=resume, good_list=good_list, result_dir=result_dir)
     return ground_truth
 
+# Collect Answers from the QA system
+def collect(pairs, concurrency=8, timeout=120, max_retries=3, resume=False, template="{question}", result_dir='./result'):
+    from .qa_client import QA_Client
+    client = QA_Client(concurrency=concurrency, timeout=timeout, max_retries=max_retries, result_dir=result_dir)
+    answer_list = client.collect(pairs, template=template, resume=resume)
+    return answer_list
+
 # RAGAs Evaluation
-def evaluate(question_list, contexts_list, answer_list, ground_truth_list):
-    p = Pipeline()
-    score = p.run(question_list, contexts_list, answer_list, ground_truth_list, chat_model='gpt-4-turbo', k=10, fast=True)
+def evaluate(question_list, contexts_list, answer_list, ground_truth_list, concurrency=1, batch_size=None, resume=False, overlap=False, workers=2, result_dir='./result'):
+    from .eval_pipeline import Pipeline
+    p = Pipeline(concurrency=concurrency)
+    if overlap:
+        score = [None] * len(question_list)
+        for item in p.stream(question_list, contexts_list, answer_list, ground_truth_list, chat_model='gpt-4-turbo', k=10, fast=True, gt_workers=workers, eval_workers=workers, resume=resume, result_dir=result_dir):
+            score[item["index"]] = item["score"]
+        return score
+    score = p.run(question_list, contexts_list, answer_list, ground_truth_list, chat_model='gpt-4-turbo', k=10, fast=True, batch_size=batch_size, resume=resume, result_dir=result_dir)
     return score
\ No newline at end of file
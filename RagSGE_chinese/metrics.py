@@ -0,0 +1,317 @@
+import contextvars
+import functools
+import inspect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# 当前所在的阶段和问题, 由stage()设置; invoke_all的线程会继承调用者的阶段
+_current = contextvars.ContextVar("ragsge_stage", default=(None, None))
+
+
+@contextmanager
+def stage(name, question=None, metrics=None):
+    '''
+    标记一段代码所属的阶段, 其中的GPT调用都记录在该阶段和问题下, 同时记录该阶段的耗时
+    question为None时沿用外层的问题
+    '''
+    outer_stage, outer_question = _current.get()
+    question = question if question is not None else outer_question
+    token = _current.set((name, question))
+    start = time.time()
+    try:
+        yield
+    finally:
+        _current.reset(token)
+        (metrics or default_metrics()).span(name, question, start, time.time())
+
+
+def staged(name):
+    '''方法装饰器版本的stage(), 问题取自函数的question参数'''
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            question = signature.bind_partial(*args, **kwargs).arguments.get("question")
+            with stage(name, question):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_stage():
+    '''返回当前的 (阶段, 问题)'''
+    return _current.get()
+
+
+class Metrics():
+    '''
+    GPT调用统计: 按 (阶段, 模型) 记录调用次数, 缓存命中, 失败, 重试, 输入/输出token数量和延迟分布
+    按问题记录每个阶段的调用次数和耗时; trace=True时额外记录每一次调用和每一个阶段的时间线
+
+    trace: 是否记录时间线, 默认读取环境变量 RAGSGE_TRACE (on/off)
+    '''
+
+    # 延迟分布的区间上限(秒)
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+    def __init__(self, trace=None):
+        if trace is None:
+            trace = os.getenv("RAGSGE_TRACE", "off").lower() in ("1", "on", "true")
+        self.trace = trace
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.series = {}      # (stage, model) -> 统计
+            self.questions = {}   # question -> stage -> 统计
+            self.events = []
+
+    def _series(self, stage, model):
+        key = (stage or "llm", model or "")
+        if key not in self.series:
+            self.series[key] = {
+                "calls": 0, "cache_hits": 0, "errors": 0, "retries": 0,
+                "prompt_tokens": 0, "completion_tokens": 0,
+                "latency_sum": 0.0, "latency_max": 0.0, "buckets": [0] * len(self.BUCKETS),
+            }
+        return self.series[key]
+
+    def _question(self, question, stage):
+        stages = self.questions.setdefault(question or "", {})
+        if stage not in stages:
+            stages[stage] = {"calls": 0, "cache_hits": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_sum": 0.0, "wall_time": 0.0}
+        return stages[stage]
+
+    def record(self, model, latency=0.0, prompt_tokens=0, completion_tokens=0, cached=False, error=None, stage=None, question=None, start=None):
+        '''
+        记录一次GPT调用
+        cached: 是否直接读取了缓存 (不计入延迟分布)
+        error: 调用失败时的错误
+        stage/question: 默认为当前stage()标记的阶段和问题
+        '''
+        current, current_question = _current.get()
+        stage = stage or current or "llm"
+        question = question if question is not None else current_question
+        with self._lock:
+            series = self._series(stage, model)
+            per_question = self._question(question, stage)
+            series["prompt_tokens"] += prompt_tokens
+            series["completion_tokens"] += completion_tokens
+            per_question["prompt_tokens"] += prompt_tokens
+            per_question["completion_tokens"] += completion_tokens
+            if error is not None:
+                series["errors"] += 1
+            if cached:
+                series["cache_hits"] += 1
+                per_question["cache_hits"] += 1
+            else:
+                series["calls"] += 1
+                series["latency_sum"] += latency
+                series["latency_max"] = max(series["latency_max"], latency)
+                series["buckets"][next(i for i, bound in enumerate(self.BUCKETS) if latency <= bound)] += 1
+                per_question["calls"] += 1
+                per_question["latency_sum"] += latency
+            if self.trace:
+                end = time.time()
+                self.events.append({
+                    "type": "call", "stage": stage, "question": question, "model": model,
+                    "start": start if start is not None else end - latency, "end": end,
+                    "cached": cached, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                    "error": None if error is None else type(error).__name__,
+                })
+
+    def retry(self, model, stage=None):
+        current, _ = _current.get()
+        with self._lock:
+            self._series(stage or current, model)["retries"] += 1
+
+    def span(self, stage, question, start, end):
+        with self._lock:
+            self._question(question, stage)["wall_time"] += end - start
+            if self.trace:
+                self.events.append({"type": "stage", "stage": stage, "question": question, "start": start, "end": end})
+
+    @contextmanager
+    def timed(self, model, prompt_tokens=0):
+        '''
+        记录with中的一次GPT调用, 用法:
+        with metrics.timed(model, prompt_tokens) as call:
+            response = ...
+            call["completion_tokens"] = ...
+        '''
+        call = {"prompt_tokens": prompt_tokens, "completion_tokens": 0}
+        start = time.time()
+        begin = time.perf_counter()
+        try:
+            yield call
+        except BaseException as error:
+            self.record(model, time.perf_counter() - begin, call["prompt_tokens"], 0, error=error, start=start)
+            raise
+        self.record(model, time.perf_counter() - begin, call["prompt_tokens"], call["completion_tokens"], start=start)
+
+    def _quantile(self, buckets, q, maximum):
+        # 由延迟分布估计分位数 (返回所在区间的上限, 不超过最大延迟)
+        total = sum(buckets)
+        if not total:
+            return 0.0
+        count = 0
+        for bound, n in zip(self.BUCKETS, buckets):
+            count += n
+            if count >= q * total:
+                return round(min(bound, maximum), 3)
+        return round(maximum, 3)
+
+    def summary(self):
+        '''JSON格式的统计结果'''
+        with self._lock:
+            stages = {}
+            for (stage, model), s in sorted(self.series.items()):
+                calls = s["calls"]
+                stages.setdefault(stage, {})[model] = {
+                    "calls": calls,
+                    "cache_hits": s["cache_hits"],
+                    "errors": s["errors"],
+                    "retries": s["retries"],
+                    "prompt_tokens": s["prompt_tokens"],
+                    "completion_tokens": s["completion_tokens"],
+                    "latency": {
+                        "sum": round(s["latency_sum"], 3),
+                        "mean": round(s["latency_sum"] / calls, 3) if calls else 0.0,
+                        "max": round(s["latency_max"], 3),
+                        "p50": self._quantile(s["buckets"], 0.5, s["latency_max"]),
+                        "p90": self._quantile(s["buckets"], 0.9, s["latency_max"]),
+                        "p99": self._quantile(s["buckets"], 0.99, s["latency_max"]),
+                        "buckets": {str(bound): n for bound, n in zip(self.BUCKETS, s["buckets"])},
+                    },
+                }
+            questions = {
+                question: {name: {key: round(value, 3) if isinstance(value, float) else value for key, value in data.items()} for name, data in per_stage.items()}
+                for question, per_stage in self.questions.items()
+            }
+        return {"stages": stages, "questions": questions}
+
+    def to_prometheus(self, prefix="ragsge_llm"):
+        '''Prometheus文本格式 (不包含问题标签, 避免标签数量过多)'''
+        def labels(stage, model, **extra):
+            pairs = {"stage": stage, "model": model, **extra}
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs.items()) + "}"
+
+        with self._lock:
+            series = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in self.series.items())
+
+        lines = []
+        counters = [
+            ("calls_total", "calls", "GPT requests sent"),
+            ("cache_hits_total", "cache_hits", "GPT responses read from the cache"),
+            ("errors_total", "errors", "GPT requests that failed after all retries"),
+            ("retries_total", "retries", "GPT requests retried"),
+            ("prompt_tokens_total", "prompt_tokens", "Prompt tokens"),
+            ("completion_tokens_total", "completion_tokens", "Completion tokens"),
+        ]
+        for name, field, help_text in counters:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for (stage, model), s in series:
+                lines.append(f"{prefix}_{name}{labels(stage, model)} {s[field]}")
+
+        name = f"{prefix}_latency_seconds"
+        lines.append(f"# HELP {name} GPT request latency")
+        lines.append(f"# TYPE {name} histogram")
+        for (stage, model), s in series:
+            count = 0
+            for bound, n in zip(self.BUCKETS, s["buckets"]):
+                count += n
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{name}_bucket{labels(stage, model, le=le)} {count}")
+            lines.append(f"{name}_sum{labels(stage, model)} {s['latency_sum']}")
+            lines.append(f"{name}_count{labels(stage, model)} {s['calls']}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, folder='./result'):
+        '''保存 metrics.json, metrics.prom, 以及 trace=True 时的 trace.jsonl'''
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, "metrics.json"), 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        with open(os.path.join(folder, "metrics.prom"), 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        if self.trace:
+            with self._lock:
+                events = sorted(self.events, key=lambda e: e["start"])
+            with open(os.path.join(folder, "trace.jsonl"), 'w', encoding='utf-8') as f:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+# Prometheus标签值中的反斜杠, 引号和换行需要转义
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics_Callback(BaseCallbackHandler):
+    '''
+    LangChain回调, 用于统计不经过Cached_Chain的GPT调用 (例如ragas.evaluate):
+    evaluate(..., callbacks=[Metrics_Callback(stage="ragas")])
+    '''
+
+    def __init__(self, metrics=None, stage="ragas", question=None):
+        self.metrics = metrics or default_metrics()
+        self.stage = stage
+        self.question = question
+        self.runs = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, serialized, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or ((serialized or {}).get("kwargs") or {}).get("model_name", "")
+        with self._lock:
+            self.runs[run_id] = (model, time.time(), time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, serialized, kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, serialized, kwargs)
+
+    def _end(self, run_id, prompt_tokens=0, completion_tokens=0, error=None):
+        with self._lock:
+            run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        model, start, begin = run
+        self.metrics.record(model, time.perf_counter() - begin, prompt_tokens, completion_tokens, error=error,
+                            stage=self.stage, question=self.question, start=start)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self._end(run_id, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+
+_default_metrics = None
+_default_lock = threading.Lock()
+
+# 全部模块共用一个统计
+def default_metrics():
+    global _default_metrics
+    with _default_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics()
+        return _default_metrics
+
+
+# 一次运行 (排序/生成标准答案与评分/获取答案) 开始时调用: 全局共享的统计清空, 之后保存的统计只包含本次运行
+def start_run():
+    metrics = default_metrics()
+    metrics.reset()
+    return metrics
@@ -0,0 +1,137 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 两两比较签名时每批的 行数 x 列数 x num_perm 上限, 控制内存占用
+_PAIR_CHUNK = 1 << 22
+
+
+class Duplicate_Clusters():
+    '''
+    近似重复聚类结果, 每一类选取下标最小的context作为代表, 只有代表需要交给GPT处理
+
+    representatives: 每一类代表的原始下标 (升序)
+    members: 每一类全部成员的原始下标 (升序), 与representatives一一对应
+    位置(position): 代表在representatives中的位置, 即只包含代表的contexts数组中的下标
+    '''
+
+    def __init__(self, labels):
+        # labels[i] = 第i个context所属类别代表的原始下标
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.representatives = np.flatnonzero(self.labels == np.arange(len(self.labels))).tolist()
+        self.position = {rep: p for p, rep in enumerate(self.representatives)}
+        self.members = [[] for _ in self.representatives]
+        for i, rep in enumerate(self.labels.tolist()):
+            self.members[self.position[rep]].append(i)
+
+    @classmethod
+    def identity(cls, length):
+        '''不去重, 每个context单独一类'''
+        return cls(np.arange(length))
+
+    def __len__(self):
+        return len(self.representatives)
+
+    @property
+    def removed(self):
+        '''去重后省去的contexts数量'''
+        return len(self.labels) - len(self.representatives)
+
+    def contexts(self, contexts):
+        '''只包含代表的contexts数组'''
+        return [contexts[i] for i in self.representatives]
+
+    def expand(self, positions):
+        '''代表的位置 -> 全部成员的原始下标, 同一类的成员紧跟在代表之后'''
+        return [i for p in positions for i in self.members[p]]
+
+    def compress(self, indices):
+        '''原始下标 -> 所属类别代表的位置 (去重, 保持第一次出现的顺序)'''
+        return list(dict.fromkeys(self.position[int(self.labels[i])] for i in indices))
+
+
+class Near_Duplicates():
+    '''
+    使用MinHash找出近似重复的contexts (例如转载的同一篇新闻)
+
+    每个context切分为shingle个字的片段, 用num_perm个哈希函数计算MinHash签名,
+    两个签名中相同的比例即Jaccard相似度的估计值, 不低于threshold视为重复
+    按原始顺序依次处理, 与某个已有代表重复的context归入该类 (每个成员都与代表相似, 不会因为传递性合并不相似的contexts)
+
+    threshold: Jaccard相似度阈值, 默认0.8
+    num_perm: 哈希函数数量, 默认128
+    shingle: 片段长度(字), 默认5
+    seed: 随机种子, 决定哈希函数
+    '''
+
+    def __init__(self, threshold=0.8, num_perm=128, shingle=5, seed=0):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle = shingle
+        # multiply-shift哈希 ((a*x+b) mod 2^64) >> 32, a为奇数
+        rnd = np.random.default_rng(seed)
+        self.a = rnd.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rnd.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self.powers = np.uint64(1000003) ** np.arange(shingle, dtype=np.uint64)
+
+    def shingles(self, text):
+        '''text中全部片段的32位哈希值 (去重)'''
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        if len(codes) < self.shingle:
+            codes = np.concatenate([codes, np.zeros(self.shingle - len(codes), dtype=np.uint64)])
+        # 多项式滚动哈希, uint64溢出即mod 2^64
+        hashes = (sliding_window_view(codes, self.shingle) * self.powers).sum(axis=1, dtype=np.uint64)
+        return np.unique((hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF))
+
+    def signatures(self, contexts):
+        '''MinHash签名, 形状为 (len(contexts), num_perm)'''
+        signatures = np.empty((len(contexts), self.num_perm), dtype=np.uint32)
+        for i, context in enumerate(contexts):
+            hashes = self.shingles(context)
+            signatures[i] = ((self.a[:, None] * hashes[None, :] + self.b[:, None]) >> np.uint64(32)).min(axis=1)
+        return signatures
+
+    def similarity(self, signatures):
+        '''全部contexts两两之间的Jaccard相似度估计值'''
+        n = len(signatures)
+        similarity = np.empty((n, n), dtype=np.float32)
+        chunk = max(1, _PAIR_CHUNK // max(1, n * self.num_perm))
+        for start in range(0, n, chunk):
+            block = signatures[start:start + chunk]
+            similarity[start:start + chunk] = (block[:, None, :] == signatures[None, :, :]).mean(axis=2)
+        return similarity
+
+    def cluster(self, contexts):
+        '''输出Duplicate_Clusters'''
+        n = len(contexts)
+        if n < 2:
+            return Duplicate_Clusters.identity(n)
+        similar = self.similarity(self.signatures(contexts)) >= self.threshold
+        labels = np.arange(n)
+        is_representative = np.zeros(n, dtype=bool)
+        for i in range(n):
+            matches = np.flatnonzero(similar[i, :i] & is_representative[:i])
+            if len(matches):
+                labels[i] = matches[0]
+            else:
+                is_representative[i] = True
+        return Duplicate_Clusters(labels)
+
+
+# dedup参数: None/False不去重, True使用默认阈值, 数字为阈值, 也可以直接传入Near_Duplicates
+def make_dedup(dedup):
+    if dedup is None or dedup is False:
+        return None
+    if dedup is True:
+        return Near_Duplicates()
+    if isinstance(dedup, (int, float)):
+        return Near_Duplicates(threshold=float(dedup))
+    return dedup
+
+
+# 按dedup聚类并输出去重结果; dedup为None (不去重) 时每个context单独一类
+def cluster_contexts(dedup, contexts):
+    if dedup is None:
+        return Duplicate_Clusters.identity(len(contexts))
+    clusters = dedup.cluster(contexts)
+    print(f"近似重复: {len(contexts)}个contexts合并为{len(clusters)}类, 省去{clusters.removed}个")
+    return clusters
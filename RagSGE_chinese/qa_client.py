@@ -0,0 +1,133 @@
+'''
+从QA系统批量获取答案 answer: 异步客户端 (aiohttp连接池) 同时发送concurrency个请求, 每个请求有超时时间,
+失败/超时/回答为空时最多重试max_retries次, 每获取一个答案立即写入运行日志
+
+pairs = [(company_name, question_body), ...]
+answer_list = QA_Client().collect(pairs)
+evaluate(question_list, contexts_list, answer_list, ground_truth_list)
+
+QA接口地址读取自环境变量 (或.env) QA_SERVER_URL, 例如 http://127.0.0.1:8001/qa
+接口与原来文档中的相同: GET url?message=问题&company_name=公司, 流式返回多行, 最后一行非空内容为答案
+'''
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from .run_journal import Run_Journal
+from .metrics import default_metrics, start_run
+
+
+class QA_Error(Exception):
+    '''一次请求没有获得答案 (状态码不是200或者回答为空)'''
+
+
+class QA_Client():
+    '''
+    url: QA接口地址, 默认为None读取环境变量QA_SERVER_URL
+    concurrency: 同时进行的请求数量上限, 也是连接池大小, 默认8
+    timeout: 每次请求的超时时间(秒), 包括读取完整个流式回答, 默认120
+    max_retries: 失败/超时/回答为空时的重试次数, 默认3
+    backoff: 第一次重试前等待的秒数, 之后每次翻倍, 默认1
+    journal_path: 运行日志路径, 每获取一个答案立即写入, 默认为None即result_dir/journal_answer.jsonl
+    result_dir: 运行日志和GPT调用统计保存的文件夹, 默认./result
+    '''
+
+    def __init__(self, url=None, concurrency=8, timeout=120, max_retries=3, backoff=1.0, journal_path=None, result_dir='./result'):
+        load_dotenv()
+        self.url = url or os.getenv("QA_SERVER_URL")
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.result_dir = result_dir
+        self.journal_path = journal_path or os.path.join(result_dir, 'journal_answer.jsonl')
+
+    async def ask(self, session, company, question):
+        '''一次请求, 输出最后一行非空内容'''
+        params = {"message": question, "company_name": company}
+        async with session.get(self.url, params=params) as resp:
+            if resp.status != 200:
+                raise QA_Error(f"服务器返回状态码 {resp.status}")
+            text = await resp.text(encoding='utf-8')
+        lines = [line for line in text.splitlines() if line]
+        answer = lines[-1] if lines else ''
+        if answer == '':
+            raise QA_Error("无法获得响应信息")
+        return answer
+
+    async def answer(self, session, semaphore, company, question, key):
+        '''获取一个问题的答案, 失败时重试; 重试max_retries次仍然失败时输出None'''
+        import aiohttp
+
+        metrics = default_metrics()
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                start = time.time()
+                begin = time.perf_counter()
+                try:
+                    answer = await self.ask(session, company, question)
+                except (QA_Error, aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    metrics.record("qa", time.perf_counter() - begin, error=error, stage="answer", question=key, start=start)
+                    reason = str(error) or type(error).__name__
+                    if attempt == self.max_retries:
+                        print(f"错误: {key} 重试{self.max_retries}次后仍然失败 ({reason})")
+                        return None
+                    metrics.retry("qa", stage="answer")
+                    print(f"错误: {key} {reason}, 正在重新获取 ({attempt + 1}/{self.max_retries})......")
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                else:
+                    metrics.record("qa", time.perf_counter() - begin, completion_tokens=len(answer), stage="answer", question=key, start=start)
+                    return answer
+
+    async def acollect(self, pairs, template="{question}", resume=False):
+        '''异步版本的collect'''
+        import aiohttp
+
+        if not self.url:
+            raise ValueError("未设置QA接口地址, 请传入url或设置环境变量QA_SERVER_URL")
+        pairs = list(pairs)
+        keys = [template.format(company=company, question=question) for company, question in pairs]
+        start_run()
+        journal = Run_Journal(self.journal_path)
+        answers = [journal.get("answer", key) if resume else None for key in keys]
+        if resume and any(answer is not None for answer in answers):
+            print(f"{sum(answer is not None for answer in answers)}个问题已获取答案, 从运行日志中恢复")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async def fetch(index):
+            company, question = pairs[index]
+            answer = await self.answer(session, semaphore, company, question, keys[index])
+            if answer is not None:
+                journal.record("answer", keys[index], answer)
+                answers[index] = answer
+
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                await asyncio.gather(*(fetch(i) for i, answer in enumerate(answers) if answer is None))
+        finally:
+            journal.close()
+            default_metrics().save(self.result_dir)
+
+        failed = [keys[i] for i, answer in enumerate(answers) if answer is None]
+        if failed:
+            raise RuntimeError(f"{len(failed)}个问题未能获取答案: {failed[:5]}... 已获取的答案保存在{self.journal_path}中, 使用resume=True重新运行只获取失败的问题")
+        return answers
+
+    def collect(self, pairs, template="{question}", resume=False):
+        '''
+        获取全部问题的答案, 输出answer_list (顺序与pairs相同), 可以直接传入evaluate/Pipeline.run
+        template: 运行日志中问题的格式, 应与传入evaluate的question_list相同, 可以使用{company}和{question}
+        resume: 是否从运行日志中恢复, True则只获取还没有答案的问题
+        '''
+        coro = self.acollect(pairs, template=template, resume=resume)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        # 已经在事件循环中 (例如Jupyter), 在单独的线程中运行
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coro).result()
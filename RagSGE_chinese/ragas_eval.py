@@ -1,13 +1,23 @@
 import requests
+import asyncio
+import copy
 import json
 import os
+import threading
 import pandas as pd
 from tqdm import tqdm
 from datasets import Dataset
 from langchain_openai import ChatOpenAI
 from ragas.metrics.critique import harmfulness
+import ragas
 from ragas import evaluate
 from ragas import adapt
+from ragas.run_config import RunConfig
+from ragas.llms import LangchainLLMWrapper
+from .token_counter import token_counter, budget_k, budget_k_batch
+from .metrics import stage, Metrics_Callback
+from .rate_limit import default_governor
+from .run_journal import content_key
 from ragas.metrics import (
     answer_relevancy,
     faithfulness,
@@ -18,79 +28,208 @@ from ragas.metrics import (
     answer_similarity
 )
 
+_adapted = set()
+_adapt_lock = threading.Lock()
+
+# 将RAGAs的评分prompt翻译成中文, 翻译结果按 ragas版本/模型/语言 保存在cache_dir中
+# 第一次运行时需要调用GPT翻译, 之后直接读取缓存; 同一个进程中只执行一次
+def adapt_metrics(model="gpt-4", language="chinese", cache_dir=None):
+    cache_dir = cache_dir or os.getenv("RAGSGE_RAGAS_CACHE", "./cache/ragas")
+    key = (ragas.__version__, model, language)
+    with _adapt_lock:
+        if key in _adapted:
+            return
+        folder = os.path.join(cache_dir, f"ragas-{ragas.__version__}", model)
+        if os.path.isdir(os.path.join(folder, language)):
+            print("正在读取缓存的RAGAs评分系统.....")
+        else:
+            print("正在初始化RAGAs评分系统, 首次运行等待时间较长.....")
+        openai_model = ChatOpenAI(model_name=model)
+        adapt(metrics=[answer_correctness, faithfulness, answer_relevancy, context_recall, context_precision], language=language, llm=openai_model, cache_dir=folder)
+        _adapted.add(key)
+
+
+class Governed_LLM(LangchainLLMWrapper):
+    '''
+    RAGAs评分使用的GPT, 每个请求都经过Rate_Governor, 与排序/生成标准答案共用RPM/TPM额度和并发数
+    重试由Rate_Governor负责并计数, 关闭ChatOpenAI和RAGAs自己的重试, 避免同一个请求绕过限流器被多层重试放大
+    '''
+
+    def __init__(self, model, governor=None, run_config=None):
+        self.model_name = model
+        self.governor = governor if governor is not None else default_governor()
+        super().__init__(ChatOpenAI(model=model, max_retries=0), run_config)
+
+    def set_run_config(self, run_config):
+        super().set_run_config(copy.copy(run_config))
+        self.run_config.max_retries = 1   # 只尝试一次, 异步调用时RAGAs对任何错误都会重试
+
+    def generate_text(self, prompt, n=1, temperature=1e-8, stop=None, callbacks=None):
+        generate = super().generate_text
+        return self.governor.call(self.model_name, lambda: generate(prompt, n=n, temperature=temperature, stop=stop, callbacks=callbacks), prompt=prompt.to_string())
+
+    # Rate_Governor是阻塞的, 在线程中等待额度, 不阻塞RAGAs的事件循环
+    async def agenerate_text(self, prompt, n=1, temperature=1e-8, stop=None, callbacks=None):
+        return await asyncio.to_thread(self.generate_text, prompt, n, temperature, stop, callbacks)
+
+
 class RAGAs_Eval():
-    def __init__(self):
-        openai_model = ChatOpenAI(model_name="gpt-4")
-        print("正在初始化RAGAs评分系统, 首次运行等待时间较长.....")
-        adapt(metrics=[answer_correctness, faithfulness, answer_relevancy, context_recall, context_precision], language="chinese", llm=openai_model)
+    # model: 翻译评分prompt使用的GPT模型, language: 评分prompt的语言
+    # chat_model: 评分使用的GPT模型, 默认与RAGAs相同为gpt-3.5-turbo-16k
+    # governor: GPT请求限流与重试Rate_Governor, 默认为None使用全局共享的限流器
+    def __init__(self, model="gpt-4", language="chinese", chat_model="gpt-3.5-turbo-16k", governor=None):
+        adapt_metrics(model=model, language=language)
+        self.chat_model = chat_model
+        self.governor = governor if governor is not None else default_governor()
+
+    def llm(self):
+        return Governed_LLM(self.chat_model, self.governor)
+
+    # 运行日志中一个问题分数的 (kind, key): 评分模型和k写入kind, 问题的top-k contexts/答案/标准答案的哈希值写入key,
+    # 答案、标准答案或k变化后resume不会误用旧的分数
+    def score_key(self, question, contexts, answer, ground_truth, k):
+        return f"score/{self.chat_model}/top{k}", content_key(question, [contexts[:k], answer, ground_truth])
 
     # 因为RAGAs系统使用GPT打分, 有最大tokens限制, 需要保证Top-k个contexts没有超过tokens限制。
-    def max_k(self, data, k, max_tokens=13000):
-        while True:
-            # 选取前k个context
-            if k > len(data['contexts']):
-                k = len(data['contexts'])
-            data['contexts'] = data['contexts'][:k]
-            contents = ''
-            for response in data['contexts']:
-                for res in response:
-                    contents+=res
-
-            tokens = len(contents)
+    def max_k(self, data, k, max_tokens=13000, chat_model="gpt-4"):
+        # 按tiktoken计算每个context的token数量, 前缀和+二分查找最大的k
+        counter = token_counter(chat_model)
+        counts = [counter.count(context) for context in data['contexts'][:k]]
+        k = budget_k(counts, k, max_tokens)
+        data['contexts'] = data['contexts'][:k]
 
-            # maximum tokens is 16385, set 13000 as maximum context token limits
-            if tokens<max_tokens:
-                break
+        return data, k
 
-            k-=1
+    # max_k的批量版本, 一次计算全部问题的k
+    def max_k_batch(self, datas, k, max_tokens=13000, chat_model="gpt-4"):
+        counter = token_counter(chat_model)
+        counts_list = [[counter.count(context) for context in data['contexts'][:k]] for data in datas]
+        new_ks = budget_k_batch(counts_list, k, max_tokens)
+        for data, new_k in zip(datas, new_ks):
+            data['contexts'] = data['contexts'][:int(new_k)]
 
-        return data, k
+        return datas, [int(new_k) for new_k in new_ks]
 
-    # 遍历所有result文件夹中的内容，生成一个eval_dataset, 据此打分
-    def top_k_ragas_eval(self, question_list, contexts_list, answer_list, ground_truth_list, k=10):
-        scores = []
-        for index, question in enumerate(question_list):
-            print(f'Question {index+1}/{len(question_list)}')
-            data = {"question": question, "contexts":contexts_list[index], "ground_truth":ground_truth_list[index], 'answer':answer_list[index]}      
+    # 一个问题的RAGAs评分, 最后共输出4个分数
+    # RAGAs在评分时会修改指标对象的llm/embeddings, 结束后再改回None; 每次使用指标的浅拷贝, 多个线程可以同时评分
+    def score_question(self, question, contexts, answer, ground_truth, k=10):
+        data = {"question": question, "contexts":contexts, "ground_truth":ground_truth, 'answer':answer}
 
-            # 验证top-k个contexts是否超过max_tokens = 16385, 并选取前k个context
-            data, new_k = self.max_k(data, k)
+        # 验证top-k个contexts是否超过max_tokens = 16385, 并选取前k个context
+        data, new_k = self.max_k(data, k)
 
-            if new_k!=k:
-                print(f"Top-{k} contexts 超过最大字符限制, 本次结果 '{question}' 自动更改为Top-{new_k}")
+        if new_k!=k:
+            print(f"Top-{k} contexts 超过最大字符限制, 本次结果 '{question}' 自动更改为Top-{new_k}")
 
-            eval_dataset = Dataset.from_pandas(pd.DataFrame([data]))
+        eval_dataset = Dataset.from_pandas(pd.DataFrame([data]))
 
-            # 使用RAGAs评分系统打分，最后共输出4个分数
+        with stage("ragas", question):
             result = evaluate(
                 eval_dataset,
-                metrics=[
-                    answer_relevancy,
-                    faithfulness,
-                    context_recall,
-                    context_precision,
-                ],
+                metrics=[copy.copy(metric) for metric in (answer_relevancy, faithfulness, context_recall, context_precision)],
+                llm=self.llm(),
+                callbacks=[Metrics_Callback(stage="ragas", question=question)],
             )
-            scores.append(result)
+        return result
 
-        return scores
+    # 遍历所有result文件夹中的内容，生成一个eval_dataset, 据此打分
+    # journal: (可选) 运行日志Run_Journal, 每完成一个问题立即写入该问题的分数
+    # 返回值与top_k_ragas_eval_batch相同: scores每个问题的分数 list(dict), result全部问题的分数表 (DataFrame)
+    def top_k_ragas_eval(self, question_list, contexts_list, answer_list, ground_truth_list, k=10, journal=None):
+        rows = []
+        for index, question in enumerate(question_list):
+            print(f'Question {index+1}/{len(question_list)}')
+            result = self.score_question(question, contexts_list[index], answer_list[index], ground_truth_list[index], k)
+            rows.append(result.to_pandas().to_dict('records')[0])
+            if journal is not None:
+                journal.record(*self.score_key(question, contexts_list[index], answer_list[index], ground_truth_list[index], k), rows[-1])
+
+        return [self.score_dict(row) for row in rows], pd.DataFrame(rows)
+
+    # 批量评分: 全部问题合并成几个大的数据集一起打分, 随后拆分回每个问题的分数
+    def top_k_ragas_eval_batch(self, question_list, contexts_list, answer_list, ground_truth_list, k=10, batch_size=100, max_workers=16, journal=None):
+        '''
+        batch_size: 每个数据集包含的问题数量, 一次evaluate调用评估一个数据集
+        max_workers: RAGAs并发打分的最大请求数
+        journal: (可选) 运行日志Run_Journal, 每完成一批立即写入这一批问题的分数
+
+        返回值：
+        scores: 每个问题的分数 list(dict), 例如 {'answer_relevancy': 0.95, 'faithfulness': 1.0, ...}
+        result: 全部问题的分数表 (DataFrame), 用于保存
+        '''
+        metrics = [
+            answer_relevancy,
+            faithfulness,
+            context_recall,
+            context_precision,
+        ]
+        rows = []
+        for index, question in enumerate(question_list):
+            data = {"question": question, "contexts":contexts_list[index], "ground_truth":ground_truth_list[index], 'answer':answer_list[index]}
+            rows.append(data)
+
+        # 验证全部问题的top-k个contexts是否超过max_tokens = 16385, 并选取前k个context
+        rows, new_ks = self.max_k_batch(rows, k)
+        for data, new_k in zip(rows, new_ks):
+            if new_k!=k:
+                print(f"Top-{k} contexts 超过最大字符限制, 本次结果 '{data['question']}' 自动更改为Top-{new_k}")
 
-    # 将每一个问题的分数保存到./result/result.xlsx中
-    def save(self, scores):
         results = []
-        for s in scores:
-            results.append(s.to_pandas())
+        for start in tqdm(range(0, len(rows), batch_size), desc="RAGAs批量评分"):
+            eval_dataset = Dataset.from_pandas(pd.DataFrame(rows[start:start + batch_size]))
+            with stage("ragas_batch"):
+                result = evaluate(eval_dataset, metrics=metrics, llm=self.llm(), run_config=RunConfig(max_workers=max_workers), callbacks=[Metrics_Callback(stage="ragas_batch")])
+            results.append(result.to_pandas())
+            if journal is not None:
+                for index, row in enumerate(results[-1].to_dict('records'), start):
+                    journal.record(*self.score_key(question_list[index], contexts_list[index], answer_list[index], ground_truth_list[index], k), row)
 
         result = pd.concat(results).reset_index(drop=True)
+        scores = [self.score_dict(row) for row in result.to_dict('records')]
+        return scores, result
+
+    # 一个问题的分数表行 (包含问题、答案等列) 中的四个分数, 例如 {'answer_relevancy': 0.95, 'faithfulness': 1.0, ...}
+    @staticmethod
+    def score_dict(row):
+        return {metric.name: row[metric.name] for metric in (answer_relevancy, faithfulness, context_recall, context_precision)}
 
-        save_path = './result'
+    # 将全部问题的分数表保存到result_dir/result.xlsx中 (默认为./result/result.xlsx)
+    def save_frame(self, result, result_dir='./result'):
+        save_path = result_dir
         file_name = 'result.xlsx'
         if not os.path.exists(save_path):
-            os.mkdir(save_path)
+            os.makedirs(save_path)
         
         result.to_excel(os.path.join(save_path, file_name))
 
-    def run(self, question_list, contexts_list, answer_list, ground_truth_list, k=10):
-        scores = self.top_k_ragas_eval(question_list, contexts_list, answer_list, ground_truth_list, k)
-        self.save(scores)
-        return scores
\ No newline at end of file
+    # batch_size: (可选) 默认为None逐个问题评分; 设置后使用批量评分, 每batch_size个问题一起评分
+    # journal: (可选) 运行日志Run_Journal, 记录每个问题的分数
+    # resume: (可选) 默认为False; True则只对日志中没有分数的问题评分, 最后从日志中读取全部问题的分数保存
+    # result_dir: (可选) 分数保存的文件夹, 默认为./result
+    # 返回值: 每个问题的分数 list(dict), 逐个评分、批量评分和从日志恢复都相同
+    def run(self, question_list, contexts_list, answer_list, ground_truth_list, k=10, batch_size=None, max_workers=16, journal=None, resume=False, result_dir='./result'):
+        if resume and journal is not None:
+            return self.resume(question_list, contexts_list, answer_list, ground_truth_list, k, batch_size, max_workers, journal, result_dir)
+        if batch_size:
+            scores, result = self.top_k_ragas_eval_batch(question_list, contexts_list, answer_list, ground_truth_list, k, batch_size=batch_size, max_workers=max_workers, journal=journal)
+        else:
+            scores, result = self.top_k_ragas_eval(question_list, contexts_list, answer_list, ground_truth_list, k, journal=journal)
+        self.save_frame(result, result_dir)
+        return scores
+
+    # 从运行日志恢复: 跳过已有分数的问题, 返回每个问题的分数 list(dict)
+    def resume(self, question_list, contexts_list, answer_list, ground_truth_list, k, batch_size, max_workers, journal, result_dir='./result'):
+        keys = [self.score_key(*row, k) for row in zip(question_list, contexts_list, answer_list, ground_truth_list)]
+        todo = [index for index, key in enumerate(keys) if not journal.has(*key)]
+        print(f"运行日志中已有{len(question_list) - len(todo)}个问题的分数, 剩余{len(todo)}个问题需要评分")
+        if todo:
+            subset = lambda values: [values[index] for index in todo]
+            args = (subset(question_list), subset(contexts_list), subset(answer_list), subset(ground_truth_list), k)
+            if batch_size:
+                self.top_k_ragas_eval_batch(*args, batch_size=batch_size, max_workers=max_workers, journal=journal)
+            else:
+                self.top_k_ragas_eval(*args, journal=journal)
+
+        rows = [journal.get(*key) for key in keys]
+        self.save_frame(pd.DataFrame(rows), result_dir)
+        return [self.score_dict(row) for row in rows]
\ No newline at end of file
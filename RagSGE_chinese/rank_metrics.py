@@ -0,0 +1,187 @@
+'''
+排序结果评价: 把全部问题的排序结果补齐成二维numpy数组, 一次计算全部问题的
+Spearman, Kendall tau, Top-k重复率, NDCG@k, MRR, Recall@k
+
+可以在排序完成后单独运行, 重新评价已保存的sorted_indices结果, 不需要重新排序:
+python -m RagSGE_chinese.rank_metrics ./result -k 10
+'''
+import argparse
+import itertools
+import json
+import os
+import numpy as np
+
+METRICS = ("spearman", "kendall", "sim", "ndcg", "mrr", "recall")
+
+# Kendall tau每批计算的 问题数 x 长度 x 长度 上限, 控制内存占用
+_KENDALL_CHUNK = 1 << 20
+
+
+def pad(lists, fill=-1):
+    '''
+    把长度不同的下标数组补齐成二维数组
+    输出: (二维数组, 每行的实际长度)
+    '''
+    lengths = np.fromiter((len(l) for l in lists), dtype=np.int64, count=len(lists))
+    padded = np.full((len(lists), int(lengths.max(initial=0))), fill, dtype=np.int64)
+    total = int(lengths.sum())
+    if total:
+        padded[np.arange(padded.shape[1]) < lengths[:, None]] = np.fromiter(itertools.chain.from_iterable(lists), dtype=np.int64, count=total)
+    return padded, lengths
+
+
+def _positions(padded, lengths, size):
+    # positions[q, item] = item在第q行中的位置, 不存在为-1
+    positions = np.full((len(padded), size), -1, dtype=np.int64)
+    valid = np.arange(padded.shape[1]) < lengths[:, None]
+    rows = np.repeat(np.arange(len(padded)), lengths)
+    positions[rows, padded[valid]] = np.nonzero(valid)[1]
+    return positions
+
+
+def rank_metrics(rankings, references=None, k=10, top=True, relevant=None):
+    '''
+    rankings: 每个问题系统排序的下标数组 (GPT排序好的indices)
+    references: 每个问题需要对比的下标数组, 默认为None即按下标升序排列 (原始ES的顺序)
+    k: Top-k, 超过某个问题排序长度时取该问题的长度
+    top: True=Top-k重复率对比数组最前面的k个数, False=对比数组最后面的k个数
+    relevant: 每个问题相关的下标 (例如人工标注), 用于NDCG/MRR/Recall, 默认为None即references的前k个
+
+    输出: 字典, 每个指标为长度等于问题数量的numpy数组 (无法计算时为nan), 以及
+    k: 每个问题实际使用的k
+    overlap: 每个问题Top-k重复的下标 (按系统排序的顺序)
+
+    Spearman和Kendall只计算两个数组中都出现的下标; NDCG/MRR/Recall始终评价排序最前面的部分
+    '''
+    if references is None:
+        references = [sorted(ranking) for ranking in rankings]
+    ranks, rank_lengths = pad(rankings)
+    refs, ref_lengths = pad(references)
+    num, width = ranks.shape
+    size = int(max(ranks.max(initial=-1), refs.max(initial=-1))) + 1
+    rows = np.arange(num)[:, None]
+    columns = np.arange(width)[None, :]
+    valid = columns < rank_lengths[:, None]
+    items = np.where(valid, ranks, 0)
+
+    # 系统排序中每个下标在对比数组中的位置
+    ref_pos = np.where(valid, _positions(refs, ref_lengths, max(size, 1))[rows, items], -1)
+    common = ref_pos >= 0
+    n = common.sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Spearman: 只保留共同的下标, 分别在两个数组中重新排名
+        sys_rank = np.cumsum(common, axis=1) - 1
+        ref_rank = np.argsort(np.argsort(np.where(common, ref_pos, size + width), axis=1, kind="stable"), axis=1, kind="stable")
+        d = np.where(common, sys_rank - ref_rank, 0)
+        spearman = np.where(n >= 2, 1 - 6 * (d ** 2).sum(axis=1) / (n * (n ** 2 - 1)), np.nan)
+
+        # Kendall tau: 共同的下标按系统排序排列后, 在对比数组中的排名的逆序对数量即不一致的对数
+        # 补齐的位置填入相同的最大值, 不会产生逆序对
+        compact = np.full((num, width), width, dtype=np.int32)
+        compact[np.nonzero(common)[0], sys_rank[common]] = ref_rank[common]
+        discordant = np.zeros(num)
+        chunk = max(1, _KENDALL_CHUNK // max(1, width * width))
+        upper = np.triu(np.ones((width, width), dtype=bool), 1)
+        for start in range(0, num, chunk):
+            block = compact[start:start + chunk]
+            discordant[start:start + chunk] = np.count_nonzero((block[:, None, :] < block[:, :, None]) & upper, axis=(1, 2))
+        total_pairs = n * (n - 1) / 2
+        kendall = np.where(n >= 2, (total_pairs - 2 * discordant) / total_pairs, np.nan)
+
+        # Top-k重复率
+        ks = np.minimum(k, rank_lengths)
+        if top:
+            in_system = columns < ks[:, None]
+            in_reference = common & (ref_pos < ks[:, None])
+        else:
+            in_system = valid & (columns >= (rank_lengths - ks)[:, None])
+            in_reference = common & (ref_pos >= (ref_lengths - ks)[:, None])
+        hits = in_system & in_reference
+        sim = np.where(ks > 0, hits.sum(axis=1) / ks, 0.0)
+        overlap = [ranks[q][hits[q]].tolist() for q in range(num)]
+
+        # NDCG@k / MRR / Recall@k
+        if relevant is None:
+            is_relevant = common & (ref_pos < ks[:, None])
+            num_relevant = np.minimum(ks, ref_lengths)
+        else:
+            labels, label_lengths = pad(relevant)
+            label_pos = _positions(labels, label_lengths, max(size, int(labels.max(initial=-1)) + 1, 1))
+            is_relevant = valid & (label_pos[rows, items] >= 0)
+            num_relevant = np.array([len(set(r)) for r in relevant], dtype=np.int64)
+        head = is_relevant & (columns < ks[:, None])
+        discount = 1 / np.log2(np.arange(width + 2) + 2)
+        ideal = np.concatenate([[0.0], np.cumsum(discount)])[np.minimum(ks, num_relevant)]
+        ndcg = np.where(ideal > 0, (head * discount[:width]).sum(axis=1) / ideal, np.nan)
+        first = np.where(is_relevant.any(axis=1), is_relevant.argmax(axis=1), -1) if width else np.full(num, -1)
+        mrr = np.where(first >= 0, 1 / (first + 1), 0.0)
+        recall = np.where(num_relevant > 0, head.sum(axis=1) / num_relevant, np.nan)
+
+    return {"spearman": spearman, "kendall": kendall, "sim": sim, "ndcg": ndcg, "mrr": mrr, "recall": recall, "k": ks, "overlap": overlap}
+
+
+def _records(results):
+    # 读取保存的结果, 不还原contexts内容 (只需要contexts的数量)
+    from .result_store import Sorted_Results
+
+    if isinstance(results, Sorted_Results):
+        return results.iter_raw()
+    if isinstance(results, str):
+        if os.path.exists(os.path.join(results, "sorted_indices.jsonl")):
+            return Sorted_Results(results).iter_raw()
+        path = os.path.join(results, "sorted_indices.json") if os.path.isdir(results) else results
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return results
+
+
+def score_results(results='./result', k=10, top=True, relevant=None, digits=3):
+    '''
+    重新评价DOC_SORT.run保存的排序结果
+    results: 结果文件夹 (sorted_indices.jsonl或sorted_indices.json), json文件路径, Sorted_Results, 或结果数组
+    relevant: 每个问题相关的下标, 见rank_metrics
+
+    与run相同, 快速排序模式对比good数组, 全部两两排序模式对比原始顺序
+    输出: (每个问题的评价结果, 全部问题的平均值)
+    '''
+    questions, rankings, references = [], [], []
+    for res in _records(results):
+        questions.append(res["question"])
+        rankings.append(res["sorted"])
+        references.append(res["good"] if res.get("good") is not None else range(len(res["contexts"])))
+
+    metrics = rank_metrics(rankings, references, k=k, top=top, relevant=relevant)
+    scores = []
+    for q, question in enumerate(questions):
+        score = {"question": question, "k": int(metrics["k"][q])}
+        for name in METRICS:
+            value = float(metrics[name][q])
+            score[name] = None if np.isnan(value) else round(value, digits)
+        score["overlap"] = metrics["overlap"][q]
+        scores.append(score)
+
+    mean = {}
+    for name in METRICS:
+        values = metrics[name][~np.isnan(metrics[name])] if len(questions) else np.zeros(0)
+        mean[name] = round(float(values.mean()), digits) if len(values) else None
+    return scores, mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重新评价保存的排序结果")
+    parser.add_argument("results", nargs="?", default="./result", help="结果文件夹或sorted_indices.json路径")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--bottom", action="store_true", help="Top-k重复率对比数组最后面的k个数")
+    parser.add_argument("--output", default=None, help="保存每个问题的评价结果 (json)")
+    args = parser.parse_args()
+
+    scores, mean = score_results(args.results, k=args.k, top=not args.bottom)
+    print(f"{len(scores)} questions: {json.dumps(mean, ensure_ascii=False)}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"mean": mean, "questions": scores}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
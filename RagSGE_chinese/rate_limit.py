@@ -0,0 +1,194 @@
+import random
+import threading
+import time
+import openai
+from .token_counter import token_counter
+from .metrics import default_metrics
+
+
+# 各模型默认的每分钟请求数(RPM)和每分钟token数(TPM)上限, 可以通过Rate_Governor.configure修改
+DEFAULT_LIMITS = {
+    "gpt-3.5-turbo": (3500, 160000),
+    "gpt-4": (500, 10000),
+    "gpt-4-turbo": (500, 30000),
+    "gpt-4o": (500, 30000),
+}
+
+# 可以重试的错误: 限流(429), 超时, 连接失败, 服务器错误(5xx)
+RETRY_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    TimeoutError,
+)
+
+
+class Token_Bucket():
+    '''令牌桶, 每分钟补充per_minute个令牌, 用于限制RPM或TPM'''
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        # 单次请求超过桶容量时最多等待一个完整的桶
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Rate_Governor():
+    '''
+    全部GPT调用的统一出口: 控制RPM/TPM, 自适应并发数(AIMD), 出错后随机退避重试
+
+    max_concurrency: 最大并发请求数
+    min_concurrency: 遇到限流后并发数最低降到多少
+    max_retries: 每个请求最多重试次数
+    base_delay: 第一次重试的等待时间(秒), 之后每次翻倍
+    max_delay: 单次最长等待时间(秒)
+    completion_tokens: 估算TPM时为每个请求预留的输出token数量
+    metrics: 记录重试次数的Metrics, 默认为None使用全局共享的统计
+    '''
+
+    def __init__(self, max_concurrency=16, min_concurrency=1, max_retries=6, base_delay=1.0, max_delay=60.0, completion_tokens=256, metrics=None):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_tokens = completion_tokens
+        self.limit = float(max_concurrency)   # 当前允许的并发数, 成功时缓慢增加, 限流时减半
+        self.active = 0
+        self.retries = 0
+        self.metrics = metrics if metrics is not None else default_metrics()
+        self.condition = threading.Condition()
+        self.buckets = {}
+        self.limits = {}   # configure设置的上限, 未设置的模型使用DEFAULT_LIMITS
+        self.shares = 1    # 同一个账号的额度由几个进程共用, 见split
+        self.buckets_lock = threading.Lock()
+
+    def configure(self, model, rpm=None, tpm=None):
+        '''设置某个模型的RPM/TPM上限 (整个账号的上限, split之后每个进程只使用其中的1/shares)'''
+        default_rpm, default_tpm = self._default_limits(model)
+        with self.buckets_lock:
+            self.limits[model] = (rpm or default_rpm, tpm or default_tpm)
+            self.buckets[model] = self._new_buckets(model)
+
+    def split(self, shares):
+        '''
+        分片运行时多个进程/机器共用同一个账号的额度, 每个进程的RPM/TPM上限降为1/shares
+        避免N个分片同时以完整额度发送请求, 全部被限流后反复退避重试
+        '''
+        with self.buckets_lock:
+            self.shares = max(1, int(shares))
+            for model in list(self.buckets):
+                self.buckets[model] = self._new_buckets(model)
+
+    def _new_buckets(self, model):
+        rpm, tpm = self.limits.get(model) or self._default_limits(model)
+        return Token_Bucket(max(1, rpm // self.shares)), Token_Bucket(max(1, tpm // self.shares))
+
+    @staticmethod
+    def _default_limits(model):
+        # 模型名可能带有版本后缀, 例如gpt-4-turbo-2024-04-09, 取最长匹配的前缀
+        for name in sorted(DEFAULT_LIMITS, key=len, reverse=True):
+            if model.startswith(name):
+                return DEFAULT_LIMITS[name]
+        return DEFAULT_LIMITS["gpt-3.5-turbo"]
+
+    def _buckets(self, model):
+        with self.buckets_lock:
+            if model not in self.buckets:
+                self.buckets[model] = self._new_buckets(model)
+            return self.buckets[model]
+
+    def estimate_tokens(self, model, prompt):
+        return token_counter(model).count(prompt) + self.completion_tokens
+
+    def _enter(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    # throttled: True=被限流, 并发数减半; False=成功, 并发数缓慢增加; None=不调整
+    def _leave(self, throttled=None):
+        with self.condition:
+            self.active -= 1
+            if throttled:   # 乘性减少
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+            elif throttled is not None:   # 加性增加, 大约每limit个成功请求并发数+1
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def _delay(self, attempt, error):
+        # 优先使用服务器返回的retry-after, 否则指数退避+随机抖动
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = self.base_delay * (2 ** attempt)
+        return min(self.max_delay, delay) * random.uniform(0.5, 1.5)
+
+    def call(self, model, fn, prompt="", tokens=None):
+        '''
+        model: 模型名, 用于选择RPM/TPM令牌桶
+        fn: 不带参数的函数, 真正发送GPT请求
+        prompt: 请求的完整文本, 用于估算token数量
+        tokens: (可选) 已知的输入token数量, 提供时不再对prompt编码
+
+        返回值: fn()的返回值, 重试max_retries次后仍然失败则抛出最后一次的错误
+        '''
+        requests_bucket, tokens_bucket = self._buckets(model)
+        if tokens is None:
+            tokens = self.estimate_tokens(model, prompt)
+        else:
+            tokens += self.completion_tokens
+
+        for attempt in range(self.max_retries + 1):
+            requests_bucket.acquire(1)
+            tokens_bucket.acquire(tokens)
+            self._enter()
+            try:
+                result = fn()
+            except RETRY_ERRORS as error:
+                self._leave(throttled=True if isinstance(error, openai.RateLimitError) else None)
+                if attempt == self.max_retries:
+                    raise
+                with self.condition:
+                    self.retries += 1
+                self.metrics.retry(model)
+                delay = self._delay(attempt, error)
+                print(f"\n GPT请求失败, {delay:.1f}秒后重试 ({attempt + 1}/{self.max_retries}): {type(error).__name__}")
+                time.sleep(delay)
+            except BaseException:
+                self._leave()
+                raise
+            else:
+                self._leave(throttled=False)
+                return result
+
+
+_default_governor = None
+_default_lock = threading.Lock()
+
+# 全部模块共用一个限流器, 保证同一个进程内的GPT请求总量不超过上限
+def default_governor():
+    global _default_governor
+    with _default_lock:
+        if _default_governor is None:
+            _default_governor = Rate_Governor()
+        return _default_governor
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+from .compactjsonencoder import CompactJSONEncoder
+
+
+# context内容的哈希值, 相同的context只保存一次
+def context_id(context):
+    return hashlib.sha1(context.encode("utf-8")).hexdigest()[:16]
+
+
+class Result_Writer():
+    '''
+    逐个问题写入排序结果, 内存占用与问题数量无关
+
+    folder下生成两个文件:
+    sorted_indices.jsonl: 每行一个问题的结果, "contexts"字段为context哈希值的列表
+    contexts.jsonl: 每行一个context {"id": 哈希值, "text": 内容}, 不同问题中重复的context只保存一次
+
+    使用方式与list相同: writer.append(res), 写完后writer.close(), 通过Sorted_Results读取
+    '''
+
+    def __init__(self, folder='./result', records_name='sorted_indices.jsonl', contexts_name='contexts.jsonl'):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.records_path = os.path.join(folder, records_name)
+        self.contexts_path = os.path.join(folder, contexts_name)
+        self.seen = set()
+        self.count = 0
+        self._records = open(self.records_path, 'w', encoding='utf-8')
+        self._contexts = open(self.contexts_path, 'w', encoding='utf-8')
+
+    def append(self, res):
+        ids = []
+        for context in res["contexts"]:
+            cid = context_id(context)
+            if cid not in self.seen:
+                self.seen.add(cid)
+                self._contexts.write(json.dumps({"id": cid, "text": context}, ensure_ascii=False) + "\n")
+            ids.append(cid)
+
+        record = dict(res)
+        record["contexts"] = ids
+        self._records.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # 每个问题写完立即落盘, 中途中断时已完成的问题不会丢失
+        self._contexts.flush()
+        self._records.flush()
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._records.close()
+        self._contexts.close()
+
+    def reader(self):
+        return Sorted_Results(os.path.dirname(self.records_path), os.path.basename(self.records_path), os.path.basename(self.contexts_path))
+
+
+class Sorted_Results():
+    '''
+    读取Result_Writer保存的结果, 按需还原成与sorted_indices.json相同的结构 (包含完整contexts)
+    只在内存中保存每一行在文件中的位置, 访问某个问题时才读取并还原该问题
+
+    使用方式与list相同: len(results), results[i], for res in results
+    '''
+
+    def __init__(self, folder='./result', records_name='sorted_indices.jsonl', contexts_name='contexts.jsonl'):
+        self.records_path = os.path.join(folder, records_name)
+        self.contexts_path = os.path.join(folder, contexts_name)
+        self.offsets = self._offsets(self.records_path)
+        self.context_offsets = {}
+        with open(self.contexts_path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    # 只解析行首的id, 不解析context内容
+                    self.context_offsets[json.loads(line[:line.index(b',')] + b'}')["id"]] = offset
+                offset += len(line)
+
+    @staticmethod
+    def _offsets(path):
+        offsets = []
+        with open(path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    offsets.append(offset)
+                offset += len(line)
+        return offsets
+
+    def context(self, cid):
+        with open(self.contexts_path, 'rb') as f:
+            f.seek(self.context_offsets[cid])
+            return json.loads(f.readline())["text"]
+
+    def raw(self, index):
+        '''第index个问题的结果, contexts为哈希值列表'''
+        with open(self.records_path, 'rb') as f:
+            f.seek(self.offsets[index])
+            return json.loads(f.readline())
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        record = self.raw(index)
+        with open(self.contexts_path, 'rb') as f:
+            texts = []
+            for cid in record["contexts"]:
+                f.seek(self.context_offsets[cid])
+                texts.append(json.loads(f.readline())["text"])
+        record["contexts"] = texts
+        return record
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def iter_raw(self):
+        '''顺序读取全部问题的结果, contexts为哈希值列表 (不读取contexts.jsonl)'''
+        with open(self.records_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def to_list(self):
+        '''一次性还原全部结果, 与旧版sorted_indices.json的内容相同'''
+        return list(self)
+
+
+def write_json(path, records):
+    '''
+    逐个问题写入sorted_indices.json, 不需要把全部问题的contexts同时读入内存
+    records: 每个问题的结果 (dict) 的可迭代对象, 例如Sorted_Results; 输出与json.dump(list(records), cls=CompactJSONEncoder)相同
+    '''
+    encoder = CompactJSONEncoder(ensure_ascii=False)
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    # 先写临时文件再替换, 中途中断时不会留下不完整的文件
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        count = 0
+        for record in records:
+            f.write("[\n" if count == 0 else ",\n")
+            f.write(encoder._indent(1))
+            # 第二层的缩进与整个列表一起编码时相同
+            for chunk in encoder._iterencode(record, 1):
+                f.write(chunk)
+            count += 1
+        f.write("\n]" if count else "[]")
+    os.replace(path + ".tmp", path)
+    return count
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import threading
+
+
+class Run_Journal():
+    '''
+    只追加写入的运行日志 (JSONL), 每完成一个单元 (例如一个问题的0-1筛选结果, 排序结果, 标准答案, 分数) 就立即写入一行
+    程序中途崩溃或被Ctrl-C中断后, 使用resume=True重新运行即可跳过已经完成的单元, 不会重复付费调用GPT
+
+    每一行格式: {"kind": 单元类型, "key": 单元名称(一般为问题), "data": 结果}
+    同一个(kind, key)出现多次时以最后一次为准
+
+    path: 日志文件路径
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._tail = None   # 最后一行没有写完整时, 完整部分的字节数; 第一次写入前截掉不完整的部分
+
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b"\n"):   # 崩溃时最后一行可能没有写完整, 忽略
+                        self._tail = offset
+                        break
+                    offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        continue
+                    self.records[(record["kind"], record["key"])] = record["data"]
+
+    def has(self, kind, key):
+        return (kind, key) in self.records
+
+    def get(self, kind, key, default=None):
+        return self.records.get((kind, key), default)
+
+    def record(self, kind, key, data):
+        '''写入一个完成的单元, 写入后立即落盘'''
+        line = json.dumps({"kind": kind, "key": key, "data": data}, ensure_ascii=False, default=_to_json)
+        with self._lock:
+            if self._file is None:
+                folder = os.path.dirname(self.path)
+                if folder and not os.path.exists(folder):
+                    os.makedirs(folder)
+                if self._tail is not None:
+                    # 否则新的一行会接在不完整的一行后面, 两行都无法读取
+                    with open(self.path, 'r+b') as f:
+                        f.truncate(self._tail)
+                    self._tail = None
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.records[(kind, key)] = json.loads(line)["data"]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# 运行日志中一个单元的key: 问题+输入内容的哈希值, 输入 (例如contexts, 答案) 变化后resume不会误用旧的结果
+def content_key(question, content):
+    digest = hashlib.sha1(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    return f"{question}#{digest}"
+
+
+# numpy数组/数字等无法直接保存为json的对象
+def _to_json(o):
+    if hasattr(o, "tolist"):
+        return o.tolist()
+    return str(o)
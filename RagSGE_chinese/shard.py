@@ -0,0 +1,284 @@
+'''
+分片运行: 按问题内容的哈希值把全部问题确定地分成num_shards份, 每一份可以在单独的进程或机器上独立运行,
+全部分片完成后用merge合并成与单进程运行相同的 result_dir/sorted_indices.json 和 result_dir/result.xlsx
+
+同一个问题无论问题列表的顺序如何、在哪台机器上运行, 总是分到同一个分片; 每个分片的结果、运行日志和GPT调用统计
+保存在单独的文件夹 result_dir/shards/{task}-{shard}-of-{num_shards} 中, 分片之间互不影响, 可以分别使用resume恢复
+
+from RagSGE_chinese.shard import run_shard, merge
+run_shard("sort", question_list, contexts_list, shard=0, num_shards=8)      # 第0个分片, 其余7个分片在其他进程/机器上运行
+merge("sort")                                                               # 全部分片完成后合并, 检查没有遗漏或重复的问题
+
+命令行 (输入文件为json: {"question_list": [...], "contexts_list": [...], "answer_list": [...], "ground_truth_list": [...]}):
+python -m RagSGE_chinese.shard run sort --input data.json --shard 0 --num-shards 8 --concurrency 4
+python -m RagSGE_chinese.shard merge sort
+'''
+import argparse
+import glob
+import hashlib
+import json
+import os
+from .result_store import Sorted_Results, write_json
+
+TASKS = ("sort", "generate", "evaluate")
+MANIFEST = "shard.json"
+
+
+# 问题所在的分片: 问题内容的sha1哈希值对num_shards取余, 与Python内置hash不同, 在不同进程/机器上结果相同
+def shard_of(question, num_shards):
+    return int(hashlib.sha1(question.encode("utf-8")).hexdigest()[:16], 16) % num_shards
+
+
+# 第shard个分片包含的问题在question_list中的下标 (升序)
+def shard_indices(question_list, shard, num_shards):
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"shard应在0到{num_shards - 1}之间, 实际为{shard}")
+    return [index for index, question in enumerate(question_list) if shard_of(question, num_shards) == shard]
+
+
+# 全部问题列表的哈希值, 合并时用于检查各个分片使用的是同一份问题列表
+def digest(question_list):
+    h = hashlib.sha1()
+    for question in question_list:
+        h.update(question.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def shard_dir(task, shard, num_shards, result_dir='./result'):
+    return os.path.join(result_dir, "shards", f"{task}-{shard:03d}-of-{num_shards:03d}")
+
+
+def _write_json(path, data):
+    # 先写临时文件再替换, 中途中断时不会留下不完整的文件
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def run_shard(task, question_list, contexts_list, shard, num_shards, answer_list=None, ground_truth_list=None, result_dir='./result', share_quota=True, **options):
+    '''
+    运行一个分片, 输入与sort/generate/evaluate相同 (全部问题, 不需要预先拆分):
+    task: "sort"=排序, "generate"=生成标准答案, "evaluate"=RAGAs评分 (需要answer_list)
+    shard/num_shards: 运行第shard个分片 (从0开始), 共num_shards个分片
+    result_dir: 结果文件夹, 分片的结果保存在 result_dir/shards/ 下, 合并后保存在result_dir中
+    share_quota: 是否将GPT的RPM/TPM上限平分给num_shards个分片 (默认为True), 全部分片共用同一个账号时使用
+    options: 传给sort/generate/evaluate的其他参数, 例如concurrency, fast, method, resume, batch_size
+
+    返回值: 与sort/generate/evaluate相同, 只包含本分片的问题 (顺序与它们在question_list中的顺序相同)
+    '''
+    from . import main
+
+    if task not in TASKS:
+        raise ValueError(f"task应为{TASKS}之一, 实际为{task}")
+    if task == "evaluate" and answer_list is None:
+        raise ValueError("evaluate需要answer_list")
+    indices = shard_indices(question_list, shard, num_shards)
+    pick = lambda values: None if values is None else [values[index] for index in indices]
+    folder = shard_dir(task, shard, num_shards, result_dir)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    # 先写入清单 (finished=False), 合并时据此检查分片是否完成、结果是否与清单一致
+    manifest = {
+        "task": task, "shard": shard, "num_shards": num_shards, "total": len(question_list), "digest": digest(question_list),
+        "finished": False, "indices": indices, "questions": pick(question_list),
+    }
+    _write_json(os.path.join(folder, MANIFEST), manifest)
+    print(f"分片 {shard}/{num_shards}: 共{len(question_list)}个问题, 本分片{len(indices)}个, 结果保存在{folder}中")
+
+    if share_quota and num_shards > 1:
+        from .rate_limit import default_governor
+        default_governor().split(num_shards)
+
+    if not indices:
+        results = []
+    elif task == "sort":
+        results = main.sort(pick(question_list), pick(contexts_list), result_dir=folder, **options)
+    elif task == "generate":
+        results = main.generate(pick(question_list), pick(contexts_list), result_dir=folder, **options)
+        _write_json(os.path.join(folder, "ground_truths.json"), results)
+    else:
+        results = main.evaluate(pick(question_list), pick(contexts_list), pick(answer_list), pick(ground_truth_list), result_dir=folder, **options)
+
+    manifest["finished"] = True
+    _write_json(os.path.join(folder, MANIFEST), manifest)
+    return results
+
+
+class Shard_Error(Exception):
+    '''分片不完整、结果与清单不一致, 或者合并后有遗漏/重复的问题'''
+
+
+def load_shards(task, result_dir='./result'):
+    '''
+    读取全部分片的清单并检查:
+    每个分片都已完成, 分片数量一致且0..num_shards-1都存在, 使用的是同一份问题列表,
+    全部分片的问题下标合起来正好是0..total-1, 没有遗漏或重复
+    返回值: 按分片编号排序的 [(文件夹, 清单), ...]
+    '''
+    shards = {}
+    for path in sorted(glob.glob(os.path.join(result_dir, "shards", f"{task}-*-of-*", MANIFEST))):
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        shards.setdefault((manifest["num_shards"], manifest["digest"]), {})[manifest["shard"]] = (os.path.dirname(path), manifest)
+    if not shards:
+        raise Shard_Error(f"{os.path.join(result_dir, 'shards')}中没有{task}的分片结果")
+    if len(shards) > 1:
+        runs = ", ".join(f"num_shards={n} ({len(found)}个分片)" for (n, _), found in shards.items())
+        raise Shard_Error(f"{task}的分片来自不同的运行 (分片数量或问题列表不同): {runs}, 请删除旧的分片文件夹后重新合并")
+
+    (num_shards, _), found = next(iter(shards.items()))
+    missing = [shard for shard in range(num_shards) if shard not in found]
+    if missing:
+        raise Shard_Error(f"缺少分片 {missing} (共{num_shards}个分片)")
+    unfinished = [shard for shard in range(num_shards) if not found[shard][1]["finished"]]
+    if unfinished:
+        raise Shard_Error(f"分片 {unfinished} 还没有运行完成, 可以使用resume=True重新运行这些分片")
+
+    total = found[0][1]["total"]
+    owner = [None] * total
+    for shard in range(num_shards):
+        for index in found[shard][1]["indices"]:
+            if not 0 <= index < total:
+                raise Shard_Error(f"分片{shard}中的下标{index}超出问题数量{total}")
+            if owner[index] is not None:
+                raise Shard_Error(f"问题{index}重复出现在分片{owner[index]}和分片{shard}中")
+            owner[index] = shard
+    missing = [index for index, shard in enumerate(owner) if shard is None]
+    if missing:
+        raise Shard_Error(f"{len(missing)}个问题不在任何分片中: {missing[:10]}")
+    return [found[shard] for shard in range(num_shards)]
+
+
+def _check(shard, manifest, questions):
+    # 分片的结果必须与清单中的问题逐个对应, 数量不同说明有问题缺失(中断)或重复
+    expected = manifest["questions"]
+    if len(questions) != len(expected):
+        raise Shard_Error(f"分片{shard}的清单中有{len(expected)}个问题, 结果中有{len(questions)}个")
+    for position, (question, want) in enumerate(zip(questions, expected)):
+        if question != want:
+            raise Shard_Error(f"分片{shard}的第{position}个结果为'{question}', 应为'{want}'")
+
+
+def _order(shards):
+    # 合并后第i个问题在哪个分片的第几个: [(分片编号, 分片内位置), ...]
+    order = [None] * shards[0][1]["total"]
+    for shard, (_, manifest) in enumerate(shards):
+        for position, index in enumerate(manifest["indices"]):
+            order[index] = (shard, position)
+    return order
+
+
+def _sorted_results(folder):
+    # 分片使用stream=True时结果为sorted_indices.jsonl, 否则为sorted_indices.json
+    if os.path.exists(os.path.join(folder, "sorted_indices.jsonl")):
+        return Sorted_Results(folder)
+    if os.path.exists(os.path.join(folder, "sorted_indices.json")):
+        with open(os.path.join(folder, "sorted_indices.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return []
+
+
+def merge_sort(result_dir='./result'):
+    '''合并排序的分片, 输出result_dir/sorted_indices.json, 与单进程运行时相同'''
+    shards = load_shards("sort", result_dir)
+    results = []
+    for shard, (folder, manifest) in enumerate(shards):
+        results.append(_sorted_results(folder))
+        raw = results[-1].iter_raw() if hasattr(results[-1], "iter_raw") else results[-1]
+        _check(shard, manifest, [res["question"] for res in raw])
+
+    path = os.path.join(result_dir, "sorted_indices.json")
+    order = _order(shards)
+    write_json(path, (results[shard][position] for shard, position in order))
+    print(f"合并{len(shards)}个分片共{len(order)}个问题, 结果已保存至{path}中")
+    return path
+
+
+def merge_generate(result_dir='./result'):
+    '''合并生成标准答案的分片, 输出result_dir/ground_truths.json (顺序与question_list相同)'''
+    shards = load_shards("generate", result_dir)
+    ground_truths = []
+    for shard, (folder, manifest) in enumerate(shards):
+        path = os.path.join(folder, "ground_truths.json")
+        if manifest["indices"]:
+            with open(path, 'r', encoding='utf-8') as f:
+                ground_truths.append(json.load(f))
+        else:
+            ground_truths.append([])
+        if len(ground_truths[-1]) != len(manifest["indices"]):
+            raise Shard_Error(f"分片{shard}的清单中有{len(manifest['indices'])}个问题, 结果中有{len(ground_truths[-1])}个")
+
+    path = os.path.join(result_dir, "ground_truths.json")
+    _write_json(path, [ground_truths[shard][position] for shard, position in _order(shards)])
+    print(f"合并{len(shards)}个分片, 标准答案已保存至{path}中")
+    return path
+
+
+def merge_evaluate(result_dir='./result'):
+    '''合并RAGAs评分的分片, 输出result_dir/result.xlsx, 与单进程运行时相同 (按question_list的顺序)'''
+    import pandas as pd
+
+    shards = load_shards("evaluate", result_dir)
+    frames = []
+    for shard, (folder, manifest) in enumerate(shards):
+        if not manifest["indices"]:
+            continue
+        frame = pd.read_excel(os.path.join(folder, "result.xlsx"), index_col=0)
+        if "question" in frame:
+            _check(shard, manifest, frame["question"].tolist())
+        elif len(frame) != len(manifest["indices"]):
+            raise Shard_Error(f"分片{shard}的清单中有{len(manifest['indices'])}个问题, 结果中有{len(frame)}个")
+        frames.append(frame.set_axis(manifest["indices"], axis=0))
+
+    result = pd.concat(frames).sort_index().reset_index(drop=True)
+    path = os.path.join(result_dir, "result.xlsx")
+    result.to_excel(path)
+    print(f"合并{len(shards)}个分片共{len(result)}个问题, 分数结果已保存至{path}中")
+    return path
+
+
+def merge(task, result_dir='./result'):
+    '''全部分片完成后合并结果; 分片缺失/未完成、问题遗漏或重复时抛出Shard_Error, 不写入结果'''
+    if task not in TASKS:
+        raise ValueError(f"task应为{TASKS}之一, 实际为{task}")
+    return {"sort": merge_sort, "generate": merge_generate, "evaluate": merge_evaluate}[task](result_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m RagSGE_chinese.shard", description="分片运行排序/生成标准答案/RAGAs评分, 并合并分片结果")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="运行一个分片")
+    run.add_argument("task", choices=TASKS)
+    run.add_argument("--input", required=True, help="json文件: question_list, contexts_list, (可选) answer_list, ground_truth_list")
+    run.add_argument("--shard", type=int, required=True)
+    run.add_argument("--num-shards", type=int, required=True)
+    run.add_argument("--result-dir", default="./result")
+    run.add_argument("--no-share-quota", action="store_true", help="每个分片使用完整的RPM/TPM上限 (各分片使用不同的账号时)")
+    run.add_argument("--concurrency", type=int, default=1)
+    run.add_argument("--resume", action="store_true")
+    run.add_argument("--options", default="{}", help='传给sort/generate/evaluate的其他参数 (json), 例如 \'{"method": "topk", "k": 10}\'')
+
+    merger = commands.add_parser("merge", help="合并全部分片的结果")
+    merger.add_argument("task", choices=TASKS)
+    merger.add_argument("--result-dir", default="./result")
+
+    args = parser.parse_args(argv)
+    if args.command == "merge":
+        merge(args.task, args.result_dir)
+        return
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    options = dict(json.loads(args.options), concurrency=args.concurrency, resume=args.resume)
+    run_shard(
+        args.task, data["question_list"], data["contexts_list"], args.shard, args.num_shards,
+        answer_list=data.get("answer_list"), ground_truth_list=data.get("ground_truth_list"),
+        result_dir=args.result_dir, share_quota=not args.no_share_quota, **options,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import accumulate
+import numpy as np
+import tiktoken
+
+
+# 同一个模型只加载一次tokenizer
+@lru_cache(maxsize=None)
+def get_encoder(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:   # 未知模型名使用GPT-3.5/GPT-4的编码
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class Token_Counter():
+    '''
+    一个模型的token计数器, 记住最近计算过的文本的token数量, 相同文本不会重复编码
+    按文本的哈希值记录, 不保存文本本身 (完整的prompt可能很长)
+
+    model: 模型名
+    memo_size: 最多记住多少条文本, 超过后丢弃最久没有用到的 (LRU)
+    '''
+
+    def __init__(self, model, memo_size=4096):
+        self.model = model
+        self.encoder = get_encoder(model)
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+
+    def encode(self, text):
+        return self.encoder.encode(text)
+
+    def decode(self, tokens):
+        return self.encoder.decode(tokens)
+
+    def count(self, text):
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self.lock:
+            n = self.memo.get(key)
+            if n is not None:
+                self.memo.move_to_end(key)
+                return n
+        n = len(self.encoder.encode(text))
+        with self.lock:
+            self.memo[key] = n
+            if len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+        return n
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+# 全部模块共用每个模型的计数器
+def token_counter(model):
+    with _counters_lock:
+        if model not in _counters:
+            _counters[model] = Token_Counter(model)
+        return _counters[model]
+
+
+class Message_Budget():
+    '''
+    GPT输入的messages列表, 同时记录全部messages的token总数
+    append/pop时只计算变化的那一条message, 不需要重新编码全部messages
+
+    counter: Token_Counter
+    messages: (可选) 初始messages列表
+    '''
+
+    def __init__(self, counter, messages=None):
+        self.counter = counter
+        self.messages = []
+        self.counts = []
+        self.total = 0
+        for message in messages or []:
+            self.append(message)
+
+    def append(self, message):
+        n = self.counter.count(message["content"])
+        self.messages.append(message)
+        self.counts.append(n)
+        self.total += n
+
+    def pop(self, index=-1):
+        self.total -= self.counts.pop(index)
+        return self.messages.pop(index)
+
+    def __len__(self):
+        return len(self.messages)
+
+
+# 选取最大的k, 使前k个contexts的token总数小于max_tokens (前缀和+二分查找)
+def budget_k(counts, k, max_tokens):
+    '''
+    counts: 一个问题全部contexts的token数量 list(int)
+    k: 最多选取的contexts数量
+    max_tokens: token总数上限 (不包含)
+
+    返回值: 满足 sum(counts[:new_k]) < max_tokens 的最大new_k (不超过k)
+    '''
+    prefix = list(accumulate(counts[:k]))
+    return bisect_left(prefix, max_tokens)
+
+
+# budget_k的批量版本, 一次计算全部问题
+def budget_k_batch(counts_list, k, max_tokens):
+    '''
+    counts_list: 二维数组, counts_list[i]为第i个问题全部contexts的token数量
+    k: 最多选取的contexts数量
+    max_tokens: token总数上限 (不包含)
+
+    返回值: 每个问题的new_k (numpy数组)
+    '''
+    lengths = np.array([min(k, len(counts)) for counts in counts_list], dtype=np.int64)
+    width = int(lengths.max()) if len(lengths) else 0
+    matrix = np.zeros((len(counts_list), width), dtype=np.int64)
+    for i, counts in enumerate(counts_list):
+        matrix[i, :lengths[i]] = counts[:lengths[i]]
+
+    # token数量非负, 前缀和单调不减, 小于max_tokens的前缀个数即为new_k; 补齐的0不能超过原长度
+    prefix = np.cumsum(matrix, axis=1)
+    return np.minimum((prefix < max_tokens).sum(axis=1), lengths)
+
+
+# 每个模型的上下文窗口 (输入+输出的token总数), 按模型名前缀匹配, 越长的前缀越优先
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4o": 128000,
+}
+
+
+def context_window(model, default=8192):
+    matches = [prefix for prefix in CONTEXT_WINDOWS if model.startswith(prefix)]
+    return CONTEXT_WINDOWS[max(matches, key=len)] if matches else default
+
+
+# 按token数量把多个文本装入尽量少的组, 每组token总数不超过capacity (first-fit-decreasing)
+def first_fit_decreasing(counts, capacity):
+    '''
+    counts: 每个文本的token数量 list(int), 单个文本不能超过capacity
+    capacity: 每组token总数上限 (包含)
+
+    返回值: 分组结果 list(list(int)), 每组为文本的下标 (组内按下标升序)
+    按token数量从大到小依次放入第一个放得下的组, 组数不超过最优解的 11/9 + 1 倍
+    相同的输入总是得到相同的分组
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    if len(counts) and counts.max() > capacity:
+        raise ValueError(f"a text has {int(counts.max())} tokens, more than the capacity {capacity}")
+    order = np.argsort(-counts, kind="stable")
+    remaining = np.empty(len(counts), dtype=np.int64)
+    groups = []
+    for i in order.tolist():
+        fits = np.flatnonzero(remaining[:len(groups)] >= counts[i])
+        if len(fits):
+            g = fits[0]
+        else:
+            g = len(groups)
+            groups.append([])
+            remaining[g] = capacity
+        groups[g].append(i)
+        remaining[g] -= counts[i]
+    return [sorted(group) for group in groups]
@@ -0,0 +1,92 @@
+'''
+CompactJSONEncoder 性能测试: 新版 (边编码边计算宽度, iterencode为生成器) 与旧版实现对比
+
+模拟DOC_SORT.run保存的sorted_indices.json: 每个问题200个中文contexts, 以及good/bad/sorted等下标数组
+同时检查新旧两个版本的输出完全相同
+
+运行: python benchmarks/bench_compactjson.py --questions 200 --contexts 200
+'''
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from RagSGE_chinese.compactjsonencoder import CompactJSONEncoder
+from legacy_compactjsonencoder import CompactJSONEncoder as LegacyCompactJSONEncoder
+
+
+CHARS = "东方航空公司主营业务收入利润子公司风险偿债资金来源营业同比增长下降每股收益责任编辑热门推荐，。；：“”0123456789%"
+
+# 生成与DOC_SORT.run输出结构相同的数据
+def make_results(questions, contexts, seed=0):
+    rnd = random.Random(seed)
+    results = []
+    for q in range(questions):
+        texts = ["".join(rnd.choice(CHARS) for _ in range(rnd.randint(100, 600))) + "\n责任编辑：刘万里SF014" for _ in range(contexts)]
+        indices = list(range(contexts))
+        good = sorted(rnd.sample(indices, contexts // 2))
+        bad = [i for i in indices if i not in set(good)]
+        ranked = good[:]
+        rnd.shuffle(ranked)
+        results.append({
+            "question": f"问题{q}: 东方航空公司主营业务",
+            "contexts": texts,
+            "good": good,
+            "bad": bad,
+            "sorted": ranked,
+            "unordered": None,
+            "spearman": round(rnd.uniform(-1, 1), 3),
+            "sim": round(rnd.random(), 3),
+            "overlap": ranked[:rnd.randint(0, 10)],
+        })
+    return results
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def dump_to_file(cls, results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, cls=cls)
+    return os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--contexts", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = make_results(args.questions, args.contexts)
+    print(f"{args.questions} questions x {args.contexts} contexts")
+
+    legacy_time, legacy = timed(lambda: json.dumps(results, ensure_ascii=False, cls=LegacyCompactJSONEncoder), args.repeat)
+    new_time, new = timed(lambda: json.dumps(results, ensure_ascii=False, cls=CompactJSONEncoder), args.repeat)
+    assert legacy == new, "CompactJSONEncoder output differs from the legacy encoder"
+    print(f"json.dumps  legacy {legacy_time:8.3f}s   new {new_time:8.3f}s   x{legacy_time / new_time:.1f}   ({len(new.encode('utf-8')) / 1e6:.1f} MB, identical)")
+
+    with tempfile.TemporaryDirectory() as folder:
+        legacy_path = os.path.join(folder, "legacy.json")
+        new_path = os.path.join(folder, "new.json")
+        legacy_time, _ = timed(lambda: dump_to_file(LegacyCompactJSONEncoder, results, legacy_path), args.repeat)
+        new_time, _ = timed(lambda: dump_to_file(CompactJSONEncoder, results, new_path), args.repeat)
+        with open(legacy_path, 'rb') as a, open(new_path, 'rb') as b:
+            assert a.read() == b.read(), "json.dump output differs from the legacy encoder"
+    print(f"json.dump   legacy {legacy_time:8.3f}s   new {new_time:8.3f}s   x{legacy_time / new_time:.1f}   (identical)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+'''
+从ES获取contexts的离线性能测试, 所有请求发送到本地的fake_es_server
+
+对比两种方式获取全部问题的top-N contexts:
+    sequential: 原来文档中的方式, 同步客户端逐个问题调用es.search
+    msearch:    ES_Ingest, 异步客户端, 每个msearch请求batch_size个问题, 同时concurrency个请求
+统计总耗时, 客户端CPU时间, 请求次数, 返回的字节数, 并检查两种方式取回的contexts完全相同
+模拟服务器在单独的进程中运行, 生成返回结果的CPU时间也计入总耗时 (真实的ES在多个节点上并行执行查询)
+
+运行:
+python benchmarks/bench_es_ingest.py --questions 1000 --size 200 --latency 0.05
+python benchmarks/bench_es_ingest.py --questions 1000 --sequential 100   # 逐个查询只运行前100个问题, 按比例估算总耗时
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from fake_es_server import Fake_ES_Server
+from RagSGE_chinese.es_ingest import ES_Ingest
+
+
+def make_pairs(questions, companies=20):
+    names = ["东方航空", "中国国航", "南方航空", "海南航空", "春秋航空"]
+    subjects = ["主营业务是什么", "子公司有哪些", "偿债风险如何", "每股收益是多少", "营业收入同比增长多少"]
+    return [(f"{names[q % len(names)]}{q % companies}", f"问题{q}: {subjects[q % len(subjects)]}") for q in range(questions)]
+
+
+def sequential(url, pairs, size):
+    from elasticsearch import Elasticsearch
+
+    es = Elasticsearch([url])
+    ingest = ES_Ingest(hosts=url, size=size)
+    contexts_list = []
+    for company, question in pairs:
+        response = es.search(index=ingest.index, _source_excludes=ingest.excludes, size=size, query=ingest.query(company, question))
+        contexts_list.append(ingest.contexts(response))
+    es.close()
+    return contexts_list
+
+
+def serve(options, urls):
+    # 服务器在单独的进程中运行, 不与客户端争用GIL
+    pairs = make_pairs(options.pop("questions"))
+    server = Fake_ES_Server(**options)
+    for company, _ in pairs:
+        server.documents(company)   # 提前生成文档, 不计入耗时
+    urls.put(server.url)
+    server.httpd.serve_forever()
+
+
+def call(url, path, method="GET"):
+    request = urllib.request.Request(url + path, data=b"" if method == "POST" else None, method=method)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def run(url, name, fn):
+    call(url, "/_reset_fake", "POST")
+    start, cpu = time.perf_counter(), time.process_time()
+    contexts_list = fn()
+    seconds = time.perf_counter() - start
+    stats = call(url, "/_stats_fake")
+    stats["client_cpu"] = round(time.process_time() - cpu, 3)
+    print(f"{name:>10}: {seconds:7.2f}s  client_cpu={stats['client_cpu']:.2f}s  requests={stats.get('requests', 0)}  queries={stats.get('queries', 0)}  MB={stats.get('bytes', 0) / 2 ** 20:.1f}")
+    return seconds, contexts_list, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--query-cost", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sequential", type=int, default=None, help="逐个查询只运行前N个问题 (默认全部), 0为不运行")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    pairs = make_pairs(args.questions)
+    report = {"questions": args.questions, "size": args.size, "latency": args.latency, "batch_size": args.batch_size, "concurrency": args.concurrency}
+    urls = multiprocessing.Queue()
+    options = {"latency": args.latency, "query_cost": args.query_cost, "docs": max(args.size, 1), "questions": args.questions}
+    process = multiprocessing.Process(target=serve, args=(options, urls), daemon=True)
+    process.start()
+    url = urls.get()
+    try:
+        ingest = ES_Ingest(hosts=url, size=args.size, batch_size=args.batch_size, concurrency=args.concurrency)
+        seconds, fetched, stats = run(url, "msearch", lambda: ingest.fetch(pairs)[1])
+        report["msearch"] = {"seconds": round(seconds, 3), **stats}
+
+        count = len(pairs) if args.sequential is None else min(args.sequential, len(pairs))
+        if count:
+            seconds, expected, stats = run(url, "sequential", lambda: sequential(url, pairs[:count], args.size))
+            estimate = seconds * len(pairs) / count
+            if count < len(pairs):
+                print(f"{'':>10}  估算全部{len(pairs)}个问题: {estimate:.1f}s")
+            print(f"{'':>10}  加速 {estimate / report['msearch']['seconds']:.1f}x, 结果一致: {fetched[:count] == expected}")
+            report["sequential"] = {"seconds": round(seconds, 3), "questions": count, "estimate": round(estimate, 3), **stats}
+            report["identical"] = fetched[:count] == expected
+    finally:
+        process.terminate()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+'''
+sort/generate/evaluate 离线性能测试, 所有GPT请求发送到本地的fake_openai_server, 不需要付费
+
+每一种模式统计: 总耗时, GPT调用次数 (按prompt类型), token数量 (服务器按字符估算), 失败/重试次数,
+每个问题的调用次数和两两比较次数, 以及与隐藏的标准排序相比的结果质量
+结果保存为JSON, 便于对比不同版本的性能
+
+运行:
+python benchmarks/bench_pipeline.py --questions 3 --contexts 60 --latency 0.02 --concurrency 8
+python benchmarks/bench_pipeline.py --stages sort --methods binary,network --failure-rate 0.05 --output bench.json
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from fake_openai_server import Fake_OpenAI_Server, hidden_order, hidden_relevance, doc_ids
+
+CHARS = "东方航空公司主营业务收入利润子公司风险偿债资金来源营业同比增长下降每股收益航线客运货运机队战略，。；："
+
+
+def make_dataset(questions, contexts, seed=0):
+    rnd = random.Random(seed)
+    question_list = [f"问题{q}: 东方航空公司的主营业务是什么" for q in range(questions)]
+    contexts_list = []
+    for q in range(questions):
+        contexts_list.append([
+            f"【Q{q:03d}-D{i:04d}】" + "".join(rnd.choice(CHARS) for _ in range(rnd.randint(100, 400)))
+            for i in range(contexts)
+        ])
+    return question_list, contexts_list
+
+
+def spearman(values):
+    # 按排序结果排列的相关性与理想顺序(从高到低)的spearman系数, 1代表完全正确
+    from scipy.stats import spearmanr
+    if len(values) < 2:
+        return 1.0
+    return float(-spearmanr(range(len(values)), values).correlation)
+
+
+class Bench():
+    def __init__(self, server, governor, seed):
+        self.server = server
+        self.governor = governor
+        self.seed = seed
+        self.runs = []
+
+    def measure(self, stage, mode, questions, fn):
+        from RagSGE_chinese.llm_cache import LLM_Cache
+
+        print(f"\n===== {stage} {mode} =====")
+        self.server.reset_stats()
+        retries = self.governor.retries
+        cache = LLM_Cache(enabled=False)   # 每种模式都实际发送请求, 不读取缓存
+        start = time.perf_counter()
+        record = {"stage": stage, "mode": mode}
+        try:
+            quality = fn(cache)
+        except Exception as error:
+            quality = None
+            record["error"] = f"{type(error).__name__}: {error}"
+        record["wall_time"] = round(time.perf_counter() - start, 3)
+
+        stats = self.server.stats()
+        kinds = stats.get("kinds", {})
+        record.update({
+            "llm_calls": stats.get("chat_calls", 0),
+            "embedding_calls": stats.get("embedding_calls", 0),
+            "prompt_tokens": stats.get("prompt_tokens", 0),
+            "completion_tokens": stats.get("completion_tokens", 0),
+            "failures": stats.get("failures", 0),
+            "retries": self.governor.retries - retries,
+            "calls_by_kind": kinds,
+            "calls_per_question": round(stats.get("chat_calls", 0) / questions, 2),
+            "comparisons_per_question": round((kinds.get("compare", 0) + kinds.get("listwise", 0)) / questions, 2),
+            "quality": quality,
+        })
+        self.runs.append(record)
+        return record
+
+    # ---------- sort ----------
+    def sort(self, question_list, contexts_list, fast, method, k, concurrency):
+        from RagSGE_chinese.es_context_sort import DOC_SORT
+
+        def fn(cache):
+            doc_sort = DOC_SORT(concurrency=concurrency, cache=cache, graph_dir=None, governor=self.governor)
+            results = doc_sort.run(question_list, contexts_list, k=k, top=True, fast=fast, method=method)
+            rho, precision = [], []
+            for res, contexts in zip(results, contexts_list):
+                ids = [doc_ids(context)[0] for context in contexts]
+                truth = hidden_order(ids, self.seed)
+                ranked = res["sorted"]
+                if res.get("unordered"):   # topk只保证前k个的顺序
+                    ranked = ranked[:k]
+                rho.append(spearman([hidden_relevance(ids[i], self.seed) for i in ranked]))
+                precision.append(len(set(res["sorted"][:k]) & set(truth[:k])) / k)
+            return {"spearman": round(sum(rho) / len(rho), 3), f"precision@{k}": round(sum(precision) / len(precision), 3)}
+
+        mode = {"fast": fast, "method": method, "concurrency": concurrency}
+        return self.measure("sort", mode, len(question_list), fn)
+
+    # ---------- generate ----------
+    def generate(self, question_list, contexts_list, fast, max_item, concurrency):
+        from RagSGE_chinese.gen_gt import Gen_GT
+
+        ground_truths = []
+
+        def fn(cache):
+            gen = Gen_GT(cache=cache, governor=self.governor, concurrency=concurrency)
+            recall = []
+            for question, contexts in zip(question_list, contexts_list):
+                if fast:
+                    ground_truth = gen.generate_gt_fast(question, contexts, chat_model="gpt-4-turbo", max_item=max_item)
+                else:
+                    ground_truth = gen.generate_gt(question, contexts, chat_model="gpt-4-turbo")
+                ground_truths.append(ground_truth)
+                relevant = {i for i in (doc_ids(c)[0] for c in contexts) if self.server.relevant(i)}
+                recall.append(len(relevant & set(doc_ids(ground_truth))) / len(relevant) if relevant else 1.0)
+            return {"relevant_recall": round(sum(recall) / len(recall), 3)}
+
+        mode = {"fast": fast, "max_item": max_item if fast else None, "concurrency": concurrency}
+        self.measure("generate", mode, len(question_list), fn)
+        return ground_truths
+
+    # ---------- evaluate ----------
+    def evaluate(self, question_list, contexts_list, answer_list, ground_truth_list, batch_size, k):
+        from RagSGE_chinese.ragas_eval import RAGAs_Eval
+
+        if not hasattr(self, "ragas"):
+            def init(cache):
+                self.ragas = RAGAs_Eval()
+            self.measure("evaluate_init", {}, len(question_list), init)
+
+        def fn(cache):
+            self.ragas.run(question_list, contexts_list, answer_list, ground_truth_list, k=k, batch_size=batch_size)
+            return None
+
+        mode = {"batch_size": batch_size, "k": k}
+        return self.measure("evaluate", mode, len(question_list), fn)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--contexts", type=int, default=60)
+    parser.add_argument("--stages", default="sort,generate,evaluate")
+    parser.add_argument("--methods", default="binary,network,topk,listwise", help="sort的精排方法")
+    parser.add_argument("--sort-modes", default="fast,full", help="fast=先0-1筛选, full=全部两两排序")
+    parser.add_argument("--max-items", default="10,20", help="generate快速版每组contexts数量")
+    parser.add_argument("--generate-slow", action="store_true", help="同时测试generate慢速版 (每个context单独调用)")
+    parser.add_argument("--batch-sizes", default="0,100", help="evaluate的batch_size, 0代表逐个问题评分")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--noise", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join(HERE, "results", f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    stages = args.stages.split(",")
+
+    server = Fake_OpenAI_Server(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate, noise=args.noise, seed=args.seed).start()
+    # 所有OpenAI客户端 (openai, langchain_openai, ragas) 都发送到本地服务器
+    os.environ["OPENAI_API_KEY"] = "fake"
+    os.environ["OPENAI_BASE_URL"] = server.url
+    os.environ["OPENAI_API_BASE"] = server.url
+
+    from RagSGE_chinese.rate_limit import Rate_Governor, DEFAULT_LIMITS
+
+    governor = Rate_Governor(max_concurrency=max(16, args.concurrency), base_delay=0.05, max_delay=0.5)
+    for model in list(DEFAULT_LIMITS) + ["gpt-3.5-turbo-16k"]:
+        governor.configure(model, rpm=10 ** 6, tpm=10 ** 9)   # 只测试服务器延迟, 不受RPM/TPM限制
+
+    question_list, contexts_list = make_dataset(args.questions, args.contexts, args.seed)
+    bench = Bench(server, governor, args.seed)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)   # ./result, ./cache, ./gt 写入临时文件夹
+        try:
+            if "sort" in stages:
+                for sort_mode in args.sort_modes.split(","):
+                    for method in args.methods.split(","):
+                        bench.sort(question_list, contexts_list, sort_mode == "fast", method, args.k, args.concurrency)
+
+            ground_truths = None
+            if "generate" in stages or "evaluate" in stages:
+                for max_item in [int(m) for m in args.max_items.split(",")]:
+                    ground_truths = bench.generate(question_list, contexts_list, True, max_item, args.concurrency) or ground_truths
+                if args.generate_slow:
+                    bench.generate(question_list, contexts_list, False, None, args.concurrency)
+
+            if "evaluate" in stages:
+                answer_list = ground_truths if ground_truths and len(ground_truths) == len(question_list) else ["不知道"] * len(question_list)
+                for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+                    bench.evaluate(question_list, contexts_list, answer_list, answer_list, batch_size or None, args.k)
+        finally:
+            os.chdir(cwd)
+            server.stop()
+
+    report = {
+        "config": vars(args),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "runs": bench.runs,
+    }
+    folder = os.path.dirname(output)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'stage':<14}{'mode':<58}{'time(s)':>9}{'calls':>8}{'cmp/q':>8}{'tokens':>10}  quality")
+    for run in bench.runs:
+        mode = json.dumps(run["mode"], ensure_ascii=False)
+        tokens = run["prompt_tokens"] + run["completion_tokens"]
+        quality = run.get("error") or json.dumps(run["quality"], ensure_ascii=False)
+        print(f"{run['stage']:<14}{mode:<58}{run['wall_time']:>9.2f}{run['llm_calls']:>8}{run['comparisons_per_question']:>8}{tokens:>10}  {quality}")
+    print(f"\n结果已保存至{output}")
+
+
+if __name__ == "__main__":
+    main()
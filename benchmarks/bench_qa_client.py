@@ -0,0 +1,100 @@
+'''
+获取答案answer的离线性能测试, 所有请求发送到本地的fake_qa_server
+
+对比两种方式获取全部问题的答案:
+    sequential: 原来文档中的方式, requests.Session逐个问题请求, 回答为空或失败时重新请求
+    concurrent: QA_Client, 异步客户端同时concurrency个请求, 有超时时间和重试次数上限
+统计总耗时, 请求次数, 失败次数, 并检查两种方式取回的答案完全相同
+
+运行:
+python benchmarks/bench_qa_client.py --questions 200 --latency 0.5 --concurrency 16
+python benchmarks/bench_qa_client.py --questions 200 --failure-rate 0.05 --empty-rate 0.05 --hang-rate 0.02 --timeout 3 --sequential 0
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from fake_qa_server import Fake_QA_Server, make_answer
+from RagSGE_chinese.qa_client import QA_Client
+
+
+def make_pairs(questions):
+    names = ["东方航空", "中国国航", "南方航空", "海南航空", "春秋航空"]
+    subjects = ["主营业务是什么", "子公司有哪些", "偿债风险如何", "每股收益是多少", "营业收入同比增长多少"]
+    return [(names[q % len(names)], f"问题{q}: {subjects[q % len(subjects)]}") for q in range(questions)]
+
+
+def sequential(url, pairs):
+    import requests
+
+    answers = []
+    s = requests.Session()
+    for company, question in pairs:
+        response = ''
+        while response == '':
+            with s.get(url, params={"message": question, "company_name": company}, stream=True) as resp:
+                if resp.status_code == 200:
+                    for line in resp.iter_lines():
+                        if line:
+                            response = line.decode('utf-8')
+        answers.append(response)
+    s.close()
+    return answers
+
+
+def run(server, name, fn):
+    server.reset_stats()
+    start = time.perf_counter()
+    answers = fn()
+    seconds = time.perf_counter() - start
+    stats = server.stats()
+    print(f"{name:>10}: {seconds:7.2f}s  requests={stats.get('requests', 0)}  failure={stats.get('failure', 0)}  empty={stats.get('empty', 0)}  hang={stats.get('hang', 0)}")
+    return seconds, answers, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--sequential", type=int, default=None, help="逐个请求只运行前N个问题 (默认全部), 0为不运行")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    pairs = make_pairs(args.questions)
+    expected = [make_answer(company, question) for company, question in pairs]
+    report = {"questions": args.questions, "latency": args.latency, "concurrency": args.concurrency}
+    server = Fake_QA_Server(latency=args.latency, failure_rate=args.failure_rate, empty_rate=args.empty_rate, hang_rate=args.hang_rate, hang=args.timeout * 2)
+    with server, tempfile.TemporaryDirectory() as folder:
+        client = QA_Client(url=server.url, concurrency=args.concurrency, timeout=args.timeout, max_retries=args.max_retries, backoff=0.1, result_dir=folder)
+        seconds, answers, stats = run(server, "concurrent", lambda: client.collect(pairs))
+        report["concurrent"] = {"seconds": round(seconds, 3), "correct": answers == expected, **stats}
+        print(f"{'':>10}  答案正确: {answers == expected}")
+
+        count = len(pairs) if args.sequential is None else min(args.sequential, len(pairs))
+        if count:
+            seconds, answers, stats = run(server, "sequential", lambda: sequential(server.url, pairs[:count]))
+            estimate = seconds * len(pairs) / count
+            if count < len(pairs):
+                print(f"{'':>10}  估算全部{len(pairs)}个问题: {estimate:.1f}s")
+            print(f"{'':>10}  加速 {estimate / report['concurrent']['seconds']:.1f}x, 答案正确: {answers == expected[:count]}")
+            report["sequential"] = {"seconds": round(seconds, 3), "questions": count, "estimate": round(estimate, 3), **stats}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
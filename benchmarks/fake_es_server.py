@@ -0,0 +1,336 @@
+'''
+本地模拟的Elasticsearch服务器 (只使用标准库), 用于离线测试从ES获取contexts的速度, 不需要连接真实的ES
+
+支持的接口 (足够elasticsearch-py 8.x客户端使用):
+GET  /                       集群信息
+POST /{index}/_search        单个查询 (原来逐个问题调用es.search的方式)
+POST /_msearch               批量查询, NDJSON格式, 每个查询一行header一行body
+POST /{index}/_msearch
+                             支持_source includes/excludes和filter_path参数 (只支持完整的字段路径)
+GET  /_stats_fake            请求次数/查询次数/返回字节数统计
+POST /_reset_fake            清空统计
+
+每个公司有docs个文档, 内容为 "【编号】内容", 编号只由公司和文档序号决定 (与fake_openai_server的编号格式相同,
+取回的contexts可以直接交给fake_openai_server排序和生成标准答案)
+查询结果为由公司和问题确定的伪随机排列, 每个文档带有content_embedding/keywords_embedding向量字段, 用于检查_source excludes
+
+运行: python benchmarks/fake_es_server.py --port 9200 --latency 0.05
+然后设置环境变量 ES_SERVER_ADDRESS=http://127.0.0.1:9200 即可
+'''
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CHARS = "东方航空公司主营业务收入利润子公司风险偿债资金来源营业同比增长下降每股收益航线客运货运机队战略，。；："
+HEADERS = {"X-Elastic-Product": "Elasticsearch", "Content-Type": "application/vnd.elasticsearch+json;compatible-with=8"}
+RAW_PATTERN = re.compile(r'"\\u0000(\d+)\\u0000"')
+
+
+class _Raw():
+    # 已经序列化的JSON片段 (文档的_source), 返回结果时直接拼接, 不重复序列化
+    def __init__(self, text):
+        self.text = text
+
+
+def encode(data):
+    '''序列化返回结果, _Raw片段原样插入'''
+    raws = []
+
+    def default(value):
+        raws.append(value.text)
+        return f"\x00{len(raws) - 1}\x00"
+
+    text = json.dumps(data, ensure_ascii=False, default=default)
+    return RAW_PATTERN.sub(lambda match: raws[int(match.group(1))], text).encode("utf-8")
+
+
+def company_code(company):
+    '''公司名 -> 编号前缀 (编号中只能有字母数字)'''
+    return "C" + hashlib.sha256(company.encode("utf-8")).hexdigest()[:6]
+
+
+class Fake_ES_Server():
+    '''
+    host/port: 监听地址, port=0代表随机选择空闲端口
+    latency: 每个请求的基础延迟(秒), 模拟网络往返和ES的固定开销
+    query_cost: 每个查询额外增加的延迟(秒), msearch中的查询并行执行, 只增加最慢的一个
+    docs: 每个公司的文档数量
+    length: 每个文档的字数
+    dims: 向量字段的维度
+    seed: 随机种子, 决定文档内容和查询分数
+    '''
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, query_cost=0.0, docs=300, length=300, dims=768, seed=0):
+        self.latency = latency
+        self.query_cost = query_cost
+        self.docs = docs
+        self.length = length
+        self.dims = dims
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.sources = {}
+        self.reset_stats()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self._send(200, {})
+
+            def do_GET(self):
+                path = urlparse(self.path).path.rstrip("/")
+                if path == "":
+                    self._send(200, {"name": "fake-es", "cluster_name": "fake", "version": {"number": "8.8.2", "build_flavor": "default"}, "tagline": "You Know, for Search"})
+                elif path.endswith("/_stats_fake"):
+                    self._send(200, server.stats())
+                else:
+                    self.do_POST()
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                path = url.path.rstrip("/")
+                params = parse_qs(url.query)
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if path.endswith("/_reset_fake"):
+                    server.reset_stats()
+                    self._send(200, {"ok": True})
+                    return
+                try:
+                    if path.endswith("/_msearch"):
+                        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+                        result = server.msearch(lines[0::2], lines[1::2], params)
+                    elif path.endswith("/_search"):
+                        result = server.search(json.loads(body or b"{}"), params)
+                    else:
+                        self._send(404, {"error": {"type": "not_found"}, "status": 404})
+                        return
+                except (ValueError, KeyError) as e:
+                    self._send(400, {"error": {"type": "parsing_exception", "reason": str(e)}, "status": 400})
+                    return
+                self._send(200, result)
+
+            def _send(self, status, data):
+                payload = encode(data)
+                server.count("bytes", len(payload))
+                self.send_response(status)
+                for name, value in HEADERS.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                try:
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass   # 客户端已经取消请求
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # ---------- 统计 ----------
+    def reset_stats(self):
+        with self.lock:
+            self._stats = defaultdict(int)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self.lock:
+            return dict(self._stats)
+
+    # ---------- 文档 ----------
+    def documents(self, company):
+        '''公司的全部文档 (确定的, 生成后缓存)'''
+        with self.lock:
+            if company in self.cache:
+                return self.cache[company]
+        code = company_code(company)
+        rnd = random.Random(f"{self.seed}-{company}")
+        documents = []
+        for i in range(self.docs):
+            doc_id = f"{code}-D{i:04d}"
+            documents.append({
+                "_id": doc_id,
+                "metadata": {"content": f"【{doc_id}】" + "".join(rnd.choice(CHARS) for _ in range(self.length))},
+                "collection_info": {"collect_id": company},
+                "content_embedding": [round(rnd.random(), 6) for _ in range(self.dims)],
+                "keywords_embedding": [round(rnd.random(), 6) for _ in range(self.dims)],
+            })
+        with self.lock:
+            self.cache[company] = documents
+        return documents
+
+    @staticmethod
+    def parse(body):
+        '''从查询中取出 (公司, 问题); 只支持ES_Ingest/文档中使用的bool查询'''
+        query = body["query"]["bool"]
+        company = query["must"][0]["match_phrase"]["collection_info.collect_id"]
+        match = query.get("should", [{}])[0].get("match", {}).get("metadata.content", "")
+        return company, match.get("query", "") if isinstance(match, dict) else match
+
+    @staticmethod
+    def source_filter(body, params):
+        '''_source的includes/excludes (请求体或_source_includes/_source_excludes参数)'''
+        source = body.get("_source", {})
+        includes = list(source.get("includes", [])) if isinstance(source, dict) else []
+        excludes = list(source.get("excludes", [])) if isinstance(source, dict) else []
+        for value in params.get("_source_includes", []):
+            includes.extend(value.split(","))
+        for value in params.get("_source_excludes", []):
+            excludes.extend(value.split(","))
+        return includes, set(excludes)
+
+    @staticmethod
+    def select(source, includes, excludes):
+        # 只支持完整的字段路径, 例如 "metadata.content"
+        if includes:
+            selected = {}
+            for path in includes:
+                keys = path.split(".")
+                value = source
+                for key in keys:
+                    value = value.get(key) if isinstance(value, dict) else None
+                if value is None:
+                    continue
+                node = selected
+                for key in keys[:-1]:
+                    node = node.setdefault(key, {})
+                node[keys[-1]] = value
+            source = selected
+        return {key: value for key, value in source.items() if key not in excludes}
+
+    @staticmethod
+    def filter_path(data, paths):
+        '''filter_path参数: 只保留指定路径的字段, 路径中的数组自动展开'''
+        if not paths:
+            return data
+        # 路径整理成树, None代表保留整个字段
+        tree = {}
+        for path in (p for value in paths for p in value.split(",")):
+            node = tree
+            keys = path.split(".")
+            for key in keys[:-1]:
+                node = node.setdefault(key, {})
+                if node is None:
+                    break
+            else:
+                node[keys[-1]] = None
+
+        def keep(value, tree):
+            if tree is None:
+                return value
+            if isinstance(value, list):
+                return [item for item in (keep(item, tree) for item in value) if item is not None]
+            if not isinstance(value, dict):
+                return None
+            result = {}
+            for key, subtree in tree.items():
+                if key in value:
+                    item = keep(value[key], subtree)
+                    if item is not None and item != {}:
+                        result[key] = item
+            return result
+
+        return keep(data, tree) or {}
+
+    def hits(self, body, params):
+        company, question = self.parse(body)
+        size = int(body.get("size", params.get("size", [10])[0]))
+        includes, excludes = self.source_filter(body, params)
+        documents = self.documents(company)
+        # 由问题确定的文档排列, 分数依次递减
+        order = random.Random(f"{self.seed}-{company}-{question}").sample(range(len(documents)), min(size, len(documents)))
+        hits = []
+        for rank, index in enumerate(order):
+            doc = documents[index]
+            score = 1 - rank / len(documents)
+            key = (doc["_id"], tuple(includes), tuple(sorted(excludes)))
+            source = self.sources.get(key)
+            if source is None:
+                source = _Raw(json.dumps(self.select({k: v for k, v in doc.items() if k != "_id"}, includes, excludes), ensure_ascii=False))
+                self.sources[key] = source
+            hits.append({"_index": "company-news", "_id": doc["_id"], "_score": round(score * 10, 4), "_source": source})
+        return {
+            "took": 1,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "max_score": hits[0]["_score"] if hits else None, "hits": hits},
+        }
+
+    def search(self, body, params):
+        self.count("requests")
+        self.count("queries")
+        time.sleep(self.latency + self.query_cost)
+        return self.filter_path(self.hits(body, params), params.get("filter_path"))
+
+    def msearch(self, headers, bodies, params):
+        self.count("requests")
+        self.count("queries", len(bodies))
+        time.sleep(self.latency + (self.query_cost if bodies else 0.0))
+        responses = []
+        for body in bodies:
+            try:
+                response = self.hits(body, params)
+                response["status"] = 200
+            except (ValueError, KeyError, IndexError) as e:
+                response = {"error": {"type": "parsing_exception", "reason": str(e)}, "status": 400}
+            responses.append(response)
+        return self.filter_path({"took": 1, "responses": responses}, params.get("filter_path"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--query-cost", type=float, default=0.0)
+    parser.add_argument("--docs", type=int, default=300)
+    parser.add_argument("--length", type=int, default=300)
+    parser.add_argument("--dims", type=int, default=768)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = Fake_ES_Server(args.host, args.port, args.latency, args.query_cost, args.docs, args.length, args.dims, args.seed)
+    print(f"fake Elasticsearch server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
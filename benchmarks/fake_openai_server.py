@@ -0,0 +1,308 @@
+'''
+本地模拟的OpenAI兼容服务器 (只使用标准库), 用于离线测试sort/generate/evaluate的速度, 不需要付费调用GPT
+
+支持的接口:
+POST /v1/chat/completions   根据prompt类型给出确定的回答
+POST /v1/embeddings         根据输入内容的哈希值生成确定的向量
+GET  /stats                 调用次数/token数量/失败次数统计 (按prompt类型分类)
+POST /reset                 清空统计
+
+每个context需要带有编号, 格式为 "【编号】内容", 例如 "【Q001-D0007】东方航空..."
+每个编号的相关性由hidden_relevance(编号, seed)决定, 客户端无法从prompt中得知, 服务器据此回答:
+    0-1筛选: 相关性高于threshold回答"1", 否则回答"0"
+    两两比较: 相关性高的背景胜出 (noise概率随机翻转, 翻转结果同样是确定的)
+    列表排序: 按相关性从高到低输出编号排列
+    标准答案: 列出文档中全部相关的编号, 没有相关编号时回答"不知道"
+    RAGAs: 返回prompt中第一个示例的输出 (格式正确, 分数没有意义); 翻译prompt原样返回输入
+
+运行: python benchmarks/fake_openai_server.py --port 8000 --latency 0.2 --failure-rate 0.05
+然后设置环境变量 OPENAI_BASE_URL=http://127.0.0.1:8000/v1 即可
+'''
+import argparse
+import ast
+import hashlib
+import json
+import random
+import re
+import struct
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ID_PATTERN = re.compile(r"【([0-9A-Za-z\-_]+)】")
+
+
+def _uniform(*parts):
+    # 由parts确定的[0, 1)之间的伪随机数
+    digest = hashlib.sha256("\x00".join(str(p) for p in parts).encode("utf-8")).digest()
+    return struct.unpack(">Q", digest[:8])[0] / 2 ** 64
+
+
+def hidden_relevance(doc_id, seed=0):
+    '''编号为doc_id的context的相关性 (0-1), 越大越相关'''
+    return _uniform("relevance", seed, doc_id)
+
+
+def hidden_order(doc_ids, seed=0):
+    '''按隐藏的相关性从高到低排列的下标, 用于评价排序结果'''
+    return sorted(range(len(doc_ids)), key=lambda i: hidden_relevance(doc_ids[i], seed), reverse=True)
+
+
+def doc_ids(text):
+    return ID_PATTERN.findall(text)
+
+
+class Fake_OpenAI_Server():
+    '''
+    host/port: 监听地址, port=0代表随机选择空闲端口
+    latency: 每个请求的基础延迟(秒)
+    jitter: 在latency基础上随机增加 0~jitter 秒
+    failure_rate: 请求失败的概率, 失败时一半返回429(限流), 一半返回500
+    threshold: 相关性高于threshold的context为相关 (0-1筛选和标准答案)
+    noise: 两两比较时回答错误的概率
+    seed: 随机种子, 决定隐藏的相关性和失败序列
+    '''
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, failure_rate=0.0, threshold=0.5, noise=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.threshold = threshold
+        self.noise = noise
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/stats"):
+                    self._send(200, server.stats())
+                else:
+                    self._send(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = self.path.rstrip("/")
+                if path.endswith("/reset"):
+                    server.reset_stats()
+                    self._send(200, {"ok": True})
+                    return
+                try:
+                    request = json.loads(body or b"{}")
+                except json.JSONDecodeError:
+                    self._send(400, {"error": {"message": "invalid json"}})
+                    return
+
+                server.wait()
+                failure = server.failure()
+                if failure is not None:
+                    server.count("failures")
+                    headers = {"retry-after": "0"} if failure == 429 else {}
+                    self._send(failure, {"error": {"message": "fake failure", "type": "server_error", "code": failure}}, headers)
+                    return
+
+                if path.endswith("/chat/completions"):
+                    self._send(200, server.chat(request))
+                elif path.endswith("/embeddings"):
+                    self._send(200, server.embeddings(request))
+                else:
+                    self._send(404, {"error": {"message": "not found"}})
+
+            def _send(self, status, data, headers=None):
+                payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # ---------- 统计 ----------
+    def reset_stats(self):
+        with self.lock:
+            self._stats = defaultdict(int)
+            self._kinds = defaultdict(int)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self.lock:
+            data = dict(self._stats)
+            data["kinds"] = dict(self._kinds)
+        return data
+
+    def wait(self):
+        delay = self.latency + (self.random.random() * self.jitter if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def failure(self):
+        if self.failure_rate <= 0:
+            return None
+        with self.lock:
+            roll = self.random.random()
+        if roll >= self.failure_rate:
+            return None
+        return 429 if roll < self.failure_rate / 2 else 500
+
+    # ---------- 回答 ----------
+    def relevant(self, doc_id):
+        return hidden_relevance(doc_id, self.seed) > self.threshold
+
+    def chat(self, request):
+        messages = request.get("messages", [])
+        prompt = "\n".join(m.get("content") or "" for m in messages if isinstance(m.get("content"), str))
+        kind, answer = self.answer(prompt)
+
+        # token数量按字符估算 (中文约1个字符1个token), 只用于对比不同模式
+        prompt_tokens = len(prompt)
+        completion_tokens = len(answer)
+        with self.lock:
+            self._stats["chat_calls"] += 1
+            self._stats["prompt_tokens"] += prompt_tokens
+            self._stats["completion_tokens"] += completion_tokens
+            self._kinds[kind] += 1
+            number = self._stats["chat_calls"]
+
+        return {
+            "id": f"chatcmpl-fake-{number}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def answer(self, prompt):
+        '''返回 (prompt类型, 回答)'''
+        if "请判断使用下面文档中内容是否可以回答问题" in prompt:
+            ids = doc_ids(prompt.split("文档:", 1)[-1])
+            return "screen", "1" if ids and self.relevant(ids[0]) else "0"
+
+        if "有两个给定的背景" in prompt:
+            first = doc_ids(prompt.split("背景1:", 1)[-1].split("背景2:", 1)[0])
+            second = doc_ids(prompt.split("背景2:", 1)[-1])
+            if not first or not second:
+                return "compare", "1"
+            a, b = first[0], second[0]
+            first_high = hidden_relevance(a, self.seed) >= hidden_relevance(b, self.seed)
+            if self.noise and _uniform("noise", self.seed, *sorted((a, b))) < self.noise:
+                first_high = not first_high
+            return "compare", "1" if first_high else "2"
+
+        if "下面给出了" in prompt and "编号的排列" in prompt:
+            blocks = re.findall(r"\[(\d+)\]\s*【([0-9A-Za-z\-_]+)】", prompt)
+            blocks.sort(key=lambda block: hidden_relevance(block[1], self.seed), reverse=True)
+            return "listwise", " > ".join(f"[{number}]" for number, _ in blocks)
+
+        if "请根据给定的文档回答问题" in prompt or "请根据以下给定的背景资料" in prompt:
+            # 合并时输入的是之前的答案, 答案中保留了相关的编号
+            kind = "gt_merge" if "请根据以下给定的背景资料" in prompt or "答案: 相关资料" in prompt else "gt_map"
+            found = sorted({doc_id for doc_id in doc_ids(prompt) if self.relevant(doc_id)})
+            if not found:
+                return kind, "不知道"
+            return kind, "答案: 相关资料" + "".join(f"【{doc_id}】" for doc_id in found)
+
+        if prompt.startswith("Language translation") or prompt.startswith("Translate values in given json"):
+            return "ragas_translate", self.translate(prompt)
+
+        if "Your actual task:" in prompt:
+            return "ragas", self.ragas(prompt)
+
+        return "other", "1"
+
+    @staticmethod
+    def translate(prompt):
+        # 不翻译, 原样返回输入
+        task = prompt.rsplit("Your actual task:", 1)[-1]
+        text = task.split("input:", 1)[-1].rsplit("output:", 1)[0].strip()
+        if prompt.startswith("Translate values in given json"):
+            try:
+                value = ast.literal_eval(text)
+            except (ValueError, SyntaxError):
+                return text
+            return "```" + json.dumps(value, ensure_ascii=False) + "```"
+        return text
+
+    @staticmethod
+    def ragas(prompt):
+        # 最后一行是需要输出的字段名, 例如 "statements:", 返回第一个示例中该字段的内容
+        examples, task = prompt.rsplit("Your actual task:", 1)
+        key = task.strip().splitlines()[-1].strip()
+        for line in examples.split("Examples:", 1)[-1].splitlines():
+            if line.startswith(key):
+                return line[len(key):].strip()
+        return "```{}```"
+
+    def embeddings(self, request):
+        inputs = request.get("input", [])
+        if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = []
+        for index, item in enumerate(inputs):
+            digest = hashlib.sha256(json.dumps(item, ensure_ascii=False).encode("utf-8")).digest()
+            vector = [b / 255.0 - 0.5 for b in digest]
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        self.count("embedding_calls")
+        self.count("embedding_inputs", len(inputs))
+        return {"object": "list", "data": data, "model": request.get("model", ""), "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--noise", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = Fake_OpenAI_Server(args.host, args.port, args.latency, args.jitter, args.failure_rate, args.threshold, args.noise, args.seed)
+    print(f"fake OpenAI server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
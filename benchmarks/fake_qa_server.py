@@ -0,0 +1,189 @@
+'''
+本地模拟的QA服务器 (只使用标准库), 用于离线测试获取答案answer的速度和重试逻辑, 不需要连接真实的QA系统
+
+支持的接口:
+GET  /qa?message=问题&company_name=公司    流式返回答案, 每一行是到目前为止的答案, 最后一行为完整答案
+GET  /stats                                请求次数/失败次数统计
+POST /reset                                清空统计
+
+每个问题的答案只由公司和问题决定; 失败率按请求随机决定:
+    failure_rate: 返回500
+    empty_rate: 返回200但是没有内容
+    hang_rate: 在返回完整答案之前停止hang秒, 用于测试超时
+
+运行: python benchmarks/fake_qa_server.py --port 8001 --latency 1.0 --failure-rate 0.05
+然后设置环境变量 QA_SERVER_URL=http://127.0.0.1:8001/qa 即可
+'''
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_answer(company, question):
+    '''公司和问题对应的答案 (确定的)'''
+    return f"{company}: 关于“{question}”, 根据公司公告, 相关信息如下。"
+
+
+class Fake_QA_Server():
+    '''
+    host/port: 监听地址, port=0代表随机选择空闲端口
+    latency: 每个请求返回完整答案所需的时间(秒), 平均分配到每一行
+    lines: 每个答案分成几行返回
+    failure_rate/empty_rate/hang_rate: 见上方说明
+    hang: 停止的秒数
+    seed: 随机种子, 决定失败序列
+    '''
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, lines=4, failure_rate=0.0, empty_rate=0.0, hang_rate=0.0, hang=30.0, seed=0):
+        self.latency = latency
+        self.lines = max(1, lines)
+        self.failure_rate = failure_rate
+        self.empty_rate = empty_rate
+        self.hang_rate = hang_rate
+        self.hang = hang
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = url.path.rstrip("/")
+                if path.endswith("/stats"):
+                    self._send(200, json.dumps(server.stats()).encode("utf-8"), "application/json")
+                elif path.endswith("/qa"):
+                    params = parse_qs(url.query)
+                    self._stream(params.get("company_name", [""])[0], params.get("message", [""])[0])
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if urlparse(self.path).path.rstrip("/").endswith("/reset"):
+                    server.reset_stats()
+                    self._send(200, b'{"ok": true}', "application/json")
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+            def _send(self, status, payload, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, company, question):
+                outcome = server.outcome()
+                server.count("requests")
+                server.count(outcome)
+                if outcome == "failure":
+                    time.sleep(server.latency / server.lines)
+                    self._send(500, "内部错误".encode("utf-8"), "text/plain; charset=utf-8")
+                    return
+                if outcome == "empty":
+                    time.sleep(server.latency)
+                    self._send(200, b"", "text/plain; charset=utf-8")
+                    return
+
+                answer = make_answer(company, question)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for i in range(1, server.lines + 1):
+                        time.sleep(server.latency / server.lines)
+                        if outcome == "hang" and i == server.lines:
+                            time.sleep(server.hang)
+                        self._chunk((answer[:len(answer) * i // server.lines] + "\n").encode("utf-8"))
+                    self._chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass   # 客户端超时后断开
+
+            def _chunk(self, data):
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/qa"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # ---------- 统计 ----------
+    def reset_stats(self):
+        with self.lock:
+            self._stats = defaultdict(int)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self.lock:
+            return dict(self._stats)
+
+    def outcome(self):
+        '''本次请求的结果: ok/failure/empty/hang'''
+        with self.lock:
+            roll = self.random.random()
+        for name, rate in (("failure", self.failure_rate), ("empty", self.empty_rate), ("hang", self.hang_rate)):
+            if roll < rate:
+                return name
+            roll -= rate
+        return "ok"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--lines", type=int, default=4)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--hang", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = Fake_QA_Server(args.host, args.port, args.latency, args.lines, args.failure_rate, args.empty_rate, args.hang_rate, args.hang, args.seed)
+    print(f"fake QA server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ setup(
         'langchain-openai',
         'python-dotenv',
         'elasticsearch==8.8.2',
+        'aiohttp',
         'tqdm',
         'scipy',
         'tiktoken',
@@ -0,0 +1,17 @@
+from RagSGE_chinese import token_counter
+
+
+class Char_Encoder():
+    '''每个字符一个token, 不需要下载tiktoken的编码文件'''
+
+    def encode(self, text):
+        return list(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+# 测试中全部Token_Counter使用Char_Encoder, 并清空共享的计数器
+def use_char_tokens(monkeypatch):
+    monkeypatch.setattr(token_counter, "get_encoder", lambda model: Char_Encoder())
+    monkeypatch.setattr(token_counter, "_counters", {})
@@ -0,0 +1,23 @@
+from RagSGE_chinese.es_context_sort import DOC_SORT
+from RagSGE_chinese.llm_cache import LLM_Cache
+
+
+class Stub_Sort(DOC_SORT):
+    '''不调用GPT的DOC_SORT: 包含"好"的context为good, 按context的长度从长到短排序, 记录调用次数 (需要设置OPENAI_API_KEY)'''
+
+    def __init__(self, model="gpt-3.5-turbo", **options):
+        super().__init__(GPT_model_name=model, cache=LLM_Cache(enabled=False), graph_dir=None, **options)
+        self.calls = {"sort_01": 0, "rank": 0}
+
+    def sort_01(self, contexts, question):
+        self.calls["sort_01"] += 1
+        good = [i for i, context in enumerate(contexts) if "好" in context]
+        return good, [i for i in range(len(contexts)) if i not in good]
+
+    def rank(self, contexts, question, indices=None, method="binary", k=10, top=True, window=10, step=None, passes=None):
+        self.calls["rank"] += 1
+        indices = list(range(len(contexts))) if indices is None else list(indices)
+        return sorted(indices, key=lambda i: -len(contexts[i])), 0
+
+    def report_graph(self, question, comparisons):
+        pass
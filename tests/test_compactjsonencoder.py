@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import random
+import sys
+import pytest
+from RagSGE_chinese.compactjsonencoder import CompactJSONEncoder
+from RagSGE_chinese.result_store import write_json
+
+# 重构前的编码器与性能测试共用benchmarks/legacy_compactjsonencoder.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from legacy_compactjsonencoder import CompactJSONEncoder as Legacy_Encoder
+
+
+def sorted_record(rnd, n):
+    # 与sorted_indices.json中一个问题的结果相同的结构
+    indices = list(range(n))
+    rnd.shuffle(indices)
+    good = sorted(indices[: n // 2])
+    return {
+        "question": f"问题{n}: 公司的\"主营业务\"是什么?",
+        "contexts": [f"背景{i} " + "文本\n" * rnd.randint(0, 5) for i in range(n)],
+        "good": good,
+        "bad": sorted(indices[n // 2:]),
+        "sorted": good[::-1],
+        "unordered": None,
+        "spearman": round(rnd.uniform(-1, 1), 3),
+        "sim": 0.5,
+        "overlap": good[:3],
+    }
+
+
+CASES = [
+    [],
+    {},
+    [[]],
+    [{}],
+    [1, 2.5, -0.0, 1e-7, 1e20, True, False, None, "a"],
+    {"a": [1, 2, [3, 4]], "b": {"c": None, "d": (5, 6)}, None: 1, 2: "二"},
+    list(range(200)),
+    list(range(201)),   # 超过MAX_ITEMS
+    ["长" * 1500],       # 超过MAX_WIDTH
+    ["x" * 1397],
+    ["x" * 1398],
+    {"nested": [{"deep": [[1, 2], [3, {"e": "中文\t "}]]}]},
+    "标量字符串",
+    3.14,
+    42,
+]
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+@pytest.mark.parametrize("case", range(len(CASES)))
+def test_same_bytes_as_legacy(case, ensure_ascii):
+    o = CASES[case]
+    assert json.dumps(o, cls=CompactJSONEncoder, ensure_ascii=ensure_ascii) == json.dumps(o, cls=Legacy_Encoder, ensure_ascii=ensure_ascii)
+
+
+@pytest.mark.parametrize("indent", [2, 4, "\t"])
+def test_same_bytes_as_legacy_indent_and_sort_keys(indent):
+    o = {"b": [1, {"z": 1, "a": [2, 3]}], "a": {"y": [[1], [2]], "x": "中"}}
+    for sort_keys in (False, True):
+        new = json.dumps(o, cls=CompactJSONEncoder, indent=indent, sort_keys=sort_keys, ensure_ascii=False)
+        old = json.dumps(o, cls=Legacy_Encoder, indent=indent, sort_keys=sort_keys, ensure_ascii=False)
+        assert new == old
+
+
+def test_json_dump_matches_legacy():
+    rnd = random.Random(0)
+    results = [sorted_record(rnd, n) for n in (0, 1, 7, 40, 250)]
+    new, old = io.StringIO(), io.StringIO()
+    json.dump(results, new, ensure_ascii=False, cls=CompactJSONEncoder)
+    json.dump(results, old, ensure_ascii=False, cls=Legacy_Encoder)
+    assert new.getvalue() == old.getvalue()
+
+
+@pytest.mark.parametrize("count", [0, 1, 5])
+def test_write_json_matches_legacy_dump(tmp_path, count):
+    rnd = random.Random(count)
+    results = [sorted_record(rnd, rnd.randint(0, 60)) for _ in range(count)]
+    path = str(tmp_path / "sorted_indices.json")
+
+    assert write_json(path, iter(results)) == count
+
+    with open(path, 'r', encoding='utf-8') as f:
+        written = f.read()
+    assert written == json.dumps(results, ensure_ascii=False, cls=Legacy_Encoder)
+    assert json.loads(written) == json.loads(json.dumps(results))
@@ -0,0 +1,88 @@
+import os
+import pytest
+from RagSGE_chinese.compare_graph import Compare_Graph
+from RagSGE_chinese.es_context_sort import DOC_SORT
+from RagSGE_chinese.llm_cache import LLM_Cache
+
+
+class Length_Sort(DOC_SORT):
+    '''不调用GPT的DOC_SORT: 两两比较时较长的context更重要, 记录实际"询问GPT"的次数'''
+
+    def __init__(self, graph_dir, model="gpt-3.5-turbo"):
+        super().__init__(GPT_model_name=model, cache=LLM_Cache(path=os.path.join(graph_dir, "llm_cache.db")), graph_dir=graph_dir)
+        self.asked = 0
+
+    def invoke_all(self, chain, inputs, desc=None):
+        self.asked += len(inputs)
+        return ["1" if len(x["context1"]) > len(x["context2"]) else "2" for x in inputs]
+
+
+@pytest.fixture(autouse=True)
+def openai_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+
+
+def test_transitive_answers_without_asking():
+    graph = Compare_Graph("q")
+    a, b, c, d = "a", "b", "c", "d"
+    graph.add(a, b, True)
+    graph.add(c, b, False)   # b比c重要
+
+    assert graph.query(a, b) is True and graph.query(b, a) is False
+    assert graph.query(a, c) is True and graph.query(c, a) is False
+    assert graph.query(a, d) is None
+    assert graph.query(d, d) is True
+
+
+def test_self_loop_and_contradiction():
+    graph = Compare_Graph("q")
+    graph.add("a", "a", True)
+    assert graph.direct == {}
+
+    graph.add("a", "b", True)
+    graph.add("a", "b", False)   # GPT前后回答矛盾, 以最新一次为准
+    assert graph.query("a", "b") is False
+    assert graph.query("b", "a") is True
+
+
+def test_cycle_is_not_inferred():
+    graph = Compare_Graph("q")
+    graph.add("a", "b", True)
+    graph.add("b", "c", True)
+    graph.add("c", "d", True)
+    graph.add("d", "a", True)
+    assert graph.query("a", "c") is None
+
+
+def test_save_and_load_keyed_by_model(tmp_path):
+    graph = Compare_Graph("q", model="gpt-4")
+    graph.add("a", "b", True)
+    graph.add("b", "c", True)
+    graph.save(str(tmp_path))
+
+    loaded = Compare_Graph.load(str(tmp_path), "q", "gpt-4")
+    assert loaded.query("a", "c") is True
+    assert Compare_Graph.load(str(tmp_path), "q", "gpt-3.5-turbo").direct == {}
+    assert Compare_Graph.load(None, "q", "gpt-4").direct == {}
+
+
+def test_graph_released_after_report_and_reused_from_disk(tmp_path):
+    contexts = ["一" * n for n in (3, 7, 1, 5, 2, 6, 4)]
+    sorter = Length_Sort(str(tmp_path))
+
+    indices, comparisons = sorter.binary_insert_sort(contexts, "问题")
+    sorter.report_graph("问题", comparisons)
+    assert indices == sorted(range(len(contexts)), key=lambda i: -len(contexts[i]))
+    assert sorter.graphs == {}
+    first = sorter.asked
+
+    # 第二次排序从保存的比较图推断, 不再询问GPT
+    indices, comparisons = sorter.binary_insert_sort(contexts, "问题")
+    sorter.report_graph("问题", comparisons)
+    assert sorter.asked == first and comparisons == 0
+    assert sorter.graphs == {}
+
+    # 其他模型不复用这个比较图
+    other = Length_Sort(str(tmp_path), model="gpt-4")
+    other.binary_insert_sort(contexts, "问题")
+    assert other.asked == first
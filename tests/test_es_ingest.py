@@ -0,0 +1,51 @@
+import os
+import sys
+import pytest
+pytest.importorskip("elasticsearch")
+from RagSGE_chinese.es_ingest import ES_Ingest
+
+# 与性能测试共用本地模拟的ES服务器
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from fake_es_server import Fake_ES_Server
+
+PAIRS = [(f"公司{i % 3}", f"问题{i}") for i in range(23)]
+
+
+@pytest.fixture(scope="module")
+def server():
+    with Fake_ES_Server(docs=40, length=20, dims=4) as server:
+        yield server
+
+
+def expected(server, ingest, company, question):
+    # 逐个问题查询时ES返回的contexts顺序
+    body = ingest.searches([(company, question)])[1]
+    contents = {doc["_id"]: doc["metadata"]["content"] for doc in server.documents(company)}
+    return [contents[hit["_id"]] for hit in server.hits(body, {})["hits"]["hits"]]
+
+
+def test_fetch_batches_in_input_order(server):
+    server.reset_stats()
+    ingest = ES_Ingest(hosts=server.url, size=10, batch_size=5, concurrency=3)
+    question_list, contexts_list = ingest.fetch(PAIRS, template="{company}{question}")
+
+    assert question_list == [company + question for company, question in PAIRS]
+    assert contexts_list == [expected(server, ingest, company, question) for company, question in PAIRS]
+    assert all(len(contexts) == 10 for contexts in contexts_list)
+    stats = server.stats()
+    assert (stats["requests"], stats["queries"]) == (5, 23)
+
+
+def test_stream_yields_batches_and_stops_early(server):
+    ingest = ES_Ingest(hosts=server.url, size=3, batch_size=4, concurrency=2)
+    batches = ingest.stream(PAIRS)
+    questions, contexts = next(batches)
+    assert questions == [question for _, question in PAIRS[:4]] and len(contexts) == 4
+    batches.close()   # 提前停止时后台线程和请求都结束
+
+
+def test_missing_host(monkeypatch):
+    monkeypatch.delenv("ES_SERVER_ADDRESS", raising=False)
+    monkeypatch.setattr("RagSGE_chinese.es_ingest.load_dotenv", lambda: None)
+    with pytest.raises(ValueError, match="ES_SERVER_ADDRESS"):
+        ES_Ingest().fetch(PAIRS[:1])
@@ -0,0 +1,37 @@
+import random
+import pytest
+from RagSGE_chinese.token_counter import first_fit_decreasing
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_groups_never_exceed_capacity(seed):
+    rnd = random.Random(seed)
+    capacity = rnd.randint(1, 5000)
+    counts = [rnd.randint(0, capacity) for _ in range(rnd.randint(0, 300))]
+
+    groups = first_fit_decreasing(counts, capacity)
+
+    assert all(sum(counts[i] for i in group) <= capacity for group in groups)
+    assert sorted(i for group in groups for i in group) == list(range(len(counts)))
+    assert all(group == sorted(group) and group for group in groups)
+    # first-fit: 后面每一组中最小的文本都放不进前面任何一组
+    used = [sum(counts[i] for i in group) for group in groups]
+    for g, group in enumerate(groups):
+        smallest = min(counts[i] for i in group)
+        assert all(capacity - used[h] < smallest for h in range(g))
+
+
+def test_exact_fit_and_deterministic():
+    counts = [5, 5, 5, 5, 10, 10]
+    groups = first_fit_decreasing(counts, 10)
+    assert sorted(map(sorted, groups)) == [[0, 1], [2, 3], [4], [5]]
+    assert first_fit_decreasing(counts, 10) == groups
+
+
+def test_item_over_capacity_raises():
+    with pytest.raises(ValueError):
+        first_fit_decreasing([3, 11], 10)
+
+
+def test_empty():
+    assert first_fit_decreasing([], 10) == []
@@ -0,0 +1,82 @@
+import re
+import threading
+import time
+import pytest
+from langchain_core.runnables import RunnableLambda
+from RagSGE_chinese import gen_gt
+from RagSGE_chinese.gen_gt import Gen_GT
+from RagSGE_chinese.llm_cache import LLM_Cache
+from RagSGE_chinese.run_journal import Run_Journal
+from char_tokens import use_char_tokens
+
+
+class Fake_Chat():
+    '''把prompt中出现的背景编号合并成答案; 只有无关背景时回答不知道'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prompts = []
+        self.running = 0
+        self.peak = 0
+
+    def __call__(self, prompt):
+        text = prompt.to_string()
+        with self.lock:
+            self.prompts.append(text)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        numbers = sorted(set(int(n) for n in re.findall(r"背景(\d+)", text)))
+        if not numbers:
+            return "不知道"
+        return "答案: " + " ".join(f"背景{n}" for n in numbers)
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    use_char_tokens(monkeypatch)
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    chat = Fake_Chat()
+    monkeypatch.setattr(gen_gt, "ChatOpenAI", lambda **options: RunnableLambda(chat))
+    return chat
+
+
+CONTEXTS = [f"背景{i}" for i in range(50)] + ["无关的内容"] * 5
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_map_then_tree_reduce(chat, concurrency):
+    gen = Gen_GT(cache=LLM_Cache(enabled=False), concurrency=concurrency)
+    answer = gen.generate_gt_fast("问题", CONTEXTS, max_item=5, fan_in=3)
+
+    assert answer == "答案: " + " ".join(f"背景{i}" for i in range(50))
+    # 11组初始答案, 去掉"不知道"后逐层每3个合并
+    groups = 11
+    answers = len([p for p in chat.prompts[:groups] if "背景" in p])
+    merges = 0
+    while answers > 1:
+        merges += answers // 3 + (1 if answers % 3 > 1 else 0)
+        answers = -(-answers // 3)
+    assert len(chat.prompts) == groups + merges
+    assert (chat.peak > 1) == (concurrency > 1)
+
+
+def test_same_question_same_groups(chat):
+    gen = Gen_GT(cache=LLM_Cache(enabled=False))
+    gen.generate_gt_fast("问题", CONTEXTS, max_item=5)
+    first = list(chat.prompts)
+    chat.prompts.clear()
+    gen.generate_gt_fast("问题", CONTEXTS, max_item=5)
+    assert chat.prompts == first
+
+
+def test_resume_reuses_journaled_groups(chat, tmp_path):
+    gen = Gen_GT(cache=LLM_Cache(enabled=False), concurrency=4)
+    journal = Run_Journal(str(tmp_path / "journal.jsonl"))
+    answer = gen.generate_gt_fast("问题", CONTEXTS, max_item=5, journal=journal)
+    chat.prompts.clear()
+    assert gen.generate_gt_fast("问题", CONTEXTS, max_item=5, journal=journal, resume=True) == answer
+    assert chat.prompts == []
+    journal.close()
@@ -0,0 +1,68 @@
+import random
+import threading
+import time
+import pytest
+from RagSGE_chinese.llm_cache import LLM_Cache, invoke_all
+from RagSGE_chinese.metrics import current_stage, stage
+
+
+class Slow_Chain():
+    '''随机延迟后返回结果, 记录同时进行的调用数量'''
+
+    def __init__(self, answer, seed=0):
+        self.answer = answer
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.stages = []
+
+    def invoke(self, x):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            delay = 0.005 + self.random.random() * 0.02
+        self.stages.append(current_stage())
+        time.sleep(delay)
+        with self.lock:
+            self.running -= 1
+        return self.answer(x)
+
+
+@pytest.mark.parametrize("concurrency", [1, 3, 8])
+def test_invoke_all_keeps_input_order_and_bounds_concurrency(concurrency):
+    chain = Slow_Chain(lambda x: x * 2)
+    assert invoke_all(chain, list(range(30)), concurrency=concurrency) == [x * 2 for x in range(30)]
+    assert 1 <= chain.peak <= concurrency
+    if concurrency > 1:
+        assert chain.peak > 1
+
+
+def test_invoke_all_inherits_stage():
+    chain = Slow_Chain(lambda x: x)
+    with stage("sort_01", "问题"):
+        invoke_all(chain, list(range(6)), concurrency=3)
+    assert set(chain.stages) == {("sort_01", "问题")}
+
+
+def test_invoke_all_raises_first_error():
+    def answer(x):
+        if x == 4:
+            raise ValueError("GPT出错")
+        return x
+
+    with pytest.raises(ValueError, match="GPT出错"):
+        invoke_all(Slow_Chain(answer), list(range(8)), concurrency=4)
+
+
+def test_sort_01_concurrent_keeps_order(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    from RagSGE_chinese.es_context_sort import DOC_SORT
+    contexts = [f"背景{i}" + ("有答案" if i % 3 == 0 else "") for i in range(20)]
+    sorter = DOC_SORT(concurrency=5, cache=LLM_Cache(enabled=False), graph_dir=None)
+    sorter.chain_01 = Slow_Chain(lambda x: "1" if "有答案" in x["context"] else "0")
+
+    good, bad = sorter.sort_01(contexts, "问题")
+    assert good == [i for i in range(20) if i % 3 == 0]
+    assert bad == [i for i in range(20) if i % 3 != 0]
+    assert sorter.chain_01.peak > 1
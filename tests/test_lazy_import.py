@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("ragas", "datasets", "pandas", "scipy", "langchain", "langchain_openai")
+
+
+def loaded_after(statement):
+    code = f"import sys, json\n{statement}\nprint(json.dumps(sorted(m for m in {HEAVY!r} if m in sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_package_loads_no_heavy_modules():
+    assert loaded_after("import RagSGE_chinese") == []
+
+
+def test_import_pipeline_does_not_load_ragas():
+    loaded = loaded_after("import RagSGE_chinese.eval_pipeline")
+    assert "ragas" not in loaded and "datasets" not in loaded and "pandas" not in loaded
+
+
+def test_adapt_metrics_once_per_process(monkeypatch, tmp_path):
+    pytest.importorskip("ragas")
+    from RagSGE_chinese import ragas_eval
+    calls = []
+    monkeypatch.setattr(ragas_eval, "ChatOpenAI", lambda **options: None)
+    monkeypatch.setattr(ragas_eval, "adapt", lambda metrics, language, llm, cache_dir: calls.append((language, cache_dir)))
+    monkeypatch.setattr(ragas_eval, "_adapted", set())
+
+    ragas_eval.adapt_metrics(model="gpt-4", cache_dir=str(tmp_path))
+    ragas_eval.adapt_metrics(model="gpt-4", cache_dir=str(tmp_path))
+    ragas_eval.adapt_metrics(model="gpt-4o", cache_dir=str(tmp_path))
+
+    version = ragas_eval.ragas.__version__
+    assert calls == [
+        ("chinese", os.path.join(str(tmp_path), f"ragas-{version}", "gpt-4")),
+        ("chinese", os.path.join(str(tmp_path), f"ragas-{version}", "gpt-4o")),
+    ]
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from RagSGE_chinese.lexical_filter import Lexical_Filter, terms
+
+QUESTION = "东方航空的主营业务是什么"
+CONTEXTS = [
+    "东方航空的主营业务是国内和国际航空客运、货运及邮运业务",
+    "今天北京天气晴朗",
+    "东方航空发布了年度报告",
+    "",
+]
+
+
+def test_terms_bigrams_and_words():
+    assert terms("东方航空 A320 飞机") == ["东方", "方航", "航空", "a320", "飞机"]
+    assert terms("东 GDP") == ["东", "gdp"]
+
+
+def test_scores_rank_relevant_contexts_first():
+    scores = Lexical_Filter().scores(QUESTION, CONTEXTS)
+    assert scores[0] > scores[2] > scores[1] == scores[3] == 0
+    assert np.all((0 <= scores) & (scores <= 1))
+    assert Lexical_Filter().scores("", CONTEXTS).tolist() == [0, 0, 0, 0]
+    assert len(Lexical_Filter().scores(QUESTION, [])) == 0
+
+
+def test_split_labels_and_deterministic_audit():
+    lexical = Lexical_Filter(low=0.0, high=0.1, audit=1.0)
+    labels, audit = lexical.split(QUESTION, CONTEXTS)
+    assert labels.tolist() == [1, 0, -1, 0]
+    assert audit == [0, 1, 3]
+    assert Lexical_Filter(audit=0.0).split(QUESTION, CONTEXTS)[1] == []
+
+
+def test_observe_and_report():
+    lexical = Lexical_Filter()
+    labels = np.array([1, 0, -1, 0], dtype=np.int8)
+    lexical.observe(labels, {0: True, 1: True, 2: False})
+    assert lexical.report() == {"total": 4, "auto_good": 1, "auto_bad": 2, "uncertain": 1, "audited": 2, "agree": 1,
+                                "skipped": 1, "skip_rate": 0.25, "agreement": 0.5}
+
+
+def test_thresholds_reach_target_precision():
+    scores = np.linspace(0, 1, 200)
+    labels = (scores > 0.5).astype(float)
+    assert Lexical_Filter.thresholds(scores, labels, target=1.0) == (scores[99], scores[100])
+
+    # 允许5%的错误时阈值向另一侧移动, 直接判断的部分仍然达到target
+    low, high = Lexical_Filter.thresholds(scores, labels, target=0.95, min_support=20)
+    assert low > scores[99] and high > low
+    assert 1 - labels[scores <= low].mean() >= 0.95
+    assert labels[scores >= high].mean() >= 0.95
+    assert Lexical_Filter.thresholds(scores, np.full(200, 0.5), target=0.95) == (None, None)
+    assert Lexical_Filter.thresholds([], []) == (None, None)
+
+
+def test_sort_01_uses_prefilter(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    from RagSGE_chinese.es_context_sort import DOC_SORT
+    from RagSGE_chinese.llm_cache import LLM_Cache
+
+    class Chain():
+        def __init__(self):
+            self.asked = []
+
+        def invoke(self, x):
+            self.asked.append(x["context"])
+            return "1"
+
+    sorter = DOC_SORT(cache=LLM_Cache(enabled=False), graph_dir=None, prefilter=Lexical_Filter(low=0.0, high=0.1, audit=0.0))
+    sorter.chain_01 = Chain()
+    good, bad = sorter.sort_01(CONTEXTS, QUESTION)
+    assert sorter.chain_01.asked == [CONTEXTS[2]]   # 只有不确定的context询问GPT
+    assert (good, bad) == ([0, 2], [1, 3])
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "lexical.json")
+    Lexical_Filter(low=0.1, high=0.7, audit=0.2).save(path)
+    lexical = Lexical_Filter.load(path)
+    assert (lexical.low, lexical.high, lexical.audit) == (0.1, 0.7, 0.2)
+    assert Lexical_Filter.load(str(tmp_path / "missing.json")).low == 0.0
@@ -0,0 +1,75 @@
+import random
+import re
+import pytest
+from RagSGE_chinese.es_context_sort import DOC_SORT
+
+
+class Oracle_Chain():
+    '''按contexts中的分数给出正确排列的"GPT", broken=True时输出格式错误的排列'''
+
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.calls = 0
+
+    def invoke(self, inputs):
+        self.calls += 1
+        lines = re.findall(r"\[(\d+)\] 分数(\d+)", inputs["contexts"])
+        assert len(lines) == inputs["num"]
+        if self.broken:
+            return "[1] > [1]"
+        ranked = sorted(lines, key=lambda line: -int(line[1]))
+        return "当然, 排序为 " + " > ".join(f"[{number}]" for number, _ in ranked)
+
+
+class Oracle_Sort(DOC_SORT):
+    '''不调用GPT的DOC_SORT: 列表排序使用Oracle_Chain, 两两比较按分数'''
+
+    def __init__(self, scores, broken=False):
+        self.scores = scores
+        self.chain_list = Oracle_Chain(broken)
+
+    def compare_pairs(self, contexts, question, pairs):
+        return [self.scores[i] > self.scores[j] for i, j in pairs], len(pairs)
+
+
+def make(n, seed):
+    scores = list(range(n))
+    random.Random(seed).shuffle(scores)
+    return scores, [f"分数{s}" for s in scores], sorted(range(n), key=lambda i: -scores[i])
+
+
+@pytest.mark.parametrize("n, k, window", [(200, 10, 10), (50, 5, 8), (30, 30, 10), (13, 3, 4)])
+@pytest.mark.parametrize("top", [True, False])
+def test_listwise_sort_exact_top_k(n, k, window, top):
+    scores, contexts, expected = make(n, n * k)
+    sorter = Oracle_Sort(scores)
+    indices, comparisons = sorter.listwise_sort(contexts, "q", window=window, k=k, top=top)
+
+    assert sorted(indices) == list(range(n))
+    if top:
+        assert indices[:k] == expected[:k]
+    else:
+        assert indices[n - k:] == expected[n - k:]
+    assert comparisons == sorter.chain_list.calls
+
+
+def test_listwise_sort_full_when_window_covers_everything():
+    scores, contexts, expected = make(8, 0)
+    sorter = Oracle_Sort(scores)
+    assert sorter.listwise_sort(contexts, "q", window=10) == (expected, 1)
+
+
+def test_listwise_sort_falls_back_to_pairwise():
+    scores, contexts, expected = make(6, 1)
+    sorter = Oracle_Sort(scores, broken=True)
+    indices, comparisons = sorter.listwise_sort(contexts, "q", window=10)
+    assert indices == expected
+    assert comparisons > 1
+
+
+def test_parse_permutation():
+    sorter = Oracle_Sort([])
+    assert sorter.parse_permutation("[2] > [3] > [1]", 3) == [1, 2, 0]
+    assert sorter.parse_permutation("2024年的资料 [2] > [1] > [2]", 2) == [1, 0]
+    assert sorter.parse_permutation("[2] > [4] > [1]", 3) is None
+    assert sorter.parse_permutation("[2] > [1]", 3) is None
@@ -0,0 +1,90 @@
+import pytest
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+from RagSGE_chinese import llm_cache
+from RagSGE_chinese.llm_cache import Cached_Chain, LLM_Cache
+from RagSGE_chinese.metrics import Metrics
+from RagSGE_chinese.rate_limit import Rate_Governor
+from char_tokens import use_char_tokens
+
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_cache.time, "time", clock.time)
+    return clock
+
+
+def test_get_set_and_stats(tmp_path):
+    cache = LLM_Cache(path=str(tmp_path / "cache.sqlite"))
+    key = cache.make_key("gpt-4", "你好")
+    assert key != cache.make_key("gpt-3.5-turbo", "你好")
+    assert cache.make_key("gpt-4", [{"a": 1, "b": 2}]) == cache.make_key("gpt-4", [{"b": 2, "a": 1}])
+
+    assert cache.get(key) is None
+    cache.set(key, "回答", model="gpt-4")
+    assert cache.get(key) == "回答"
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1}
+
+    # 重新打开同一个文件, 回答仍然存在
+    assert LLM_Cache(path=str(tmp_path / "cache.sqlite")).get(key) == "回答"
+
+
+def test_expired_records_are_dropped(tmp_path, clock):
+    cache = LLM_Cache(path=str(tmp_path / "cache.sqlite"), max_age=60)
+    cache.set("old", "旧回答")
+    clock.now += 61
+    assert cache.get("old") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_evict_least_recently_used(tmp_path, clock):
+    cache = LLM_Cache(path=str(tmp_path / "cache.sqlite"), max_bytes=3 * (10 + 1), max_age=None)
+    for key in ["k1", "k2", "k3"]:
+        clock.now += 1
+        cache.set(key, "x" * 9)   # 每条记录 9 + 2 字节
+    clock.now += 1
+    cache.get("k1")              # k1变为最近使用
+    clock.now += 1
+    cache.set("k4", "x" * 9)
+    cache.evict()
+
+    assert cache.get("k2") is None
+    assert [cache.get(key) for key in ("k1", "k3", "k4")] == ["x" * 9] * 3
+
+
+def test_disabled_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("RAGSGE_CACHE", "off")
+    cache = LLM_Cache(path=str(tmp_path / "cache.sqlite"))
+    cache.set("k", "回答")
+    assert cache.get("k") is None
+    assert not (tmp_path / "cache.sqlite").exists()
+
+
+def test_cached_chain_calls_gpt_once(tmp_path, monkeypatch):
+    use_char_tokens(monkeypatch)
+    calls = []
+
+    def model(prompt):
+        calls.append(prompt.to_string())
+        return "回答"
+
+    metrics = Metrics(trace=False)
+    chain = Cached_Chain(ChatPromptTemplate.from_template("问题: {question}"), RunnableLambda(model), StrOutputParser(),
+                         LLM_Cache(path=str(tmp_path / "cache.sqlite")), Rate_Governor(), stage="sort_01", metrics=metrics)
+
+    assert chain.invoke({"question": "一"}) == "回答"
+    assert chain.invoke({"question": "一"}) == "回答"
+    assert chain.invoke({"question": "二"}) == "回答"
+    assert len(calls) == 2
+    series = metrics.summary()["stages"]["sort_01"][""]
+    assert (series["calls"], series["cache_hits"]) == (2, 1)
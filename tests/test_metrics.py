@@ -0,0 +1,61 @@
+import json
+from RagSGE_chinese.metrics import Metrics, default_metrics, stage, staged, start_run
+
+
+def test_record_summary_by_stage_model_and_question():
+    metrics = Metrics(trace=False)
+    with stage("sort_01", "问题一"):
+        metrics.record("gpt-4", latency=0.3, prompt_tokens=10, completion_tokens=2)
+        metrics.record("gpt-4", cached=True, prompt_tokens=5)
+        metrics.retry("gpt-4")
+    metrics.record("gpt-4", latency=2.0, error=ValueError("x"), stage="ragas")
+
+    summary = metrics.summary()
+    series = summary["stages"]["sort_01"]["gpt-4"]
+    assert (series["calls"], series["cache_hits"], series["retries"], series["errors"]) == (1, 1, 1, 0)
+    assert (series["prompt_tokens"], series["completion_tokens"]) == (15, 2)
+    assert series["latency"]["p50"] == 0.3 and series["latency"]["buckets"]["0.5"] == 1
+    assert summary["stages"]["ragas"]["gpt-4"]["errors"] == 1
+    assert summary["questions"]["问题一"]["sort_01"]["calls"] == 1
+    json.dumps(summary)
+
+
+def test_prometheus_histogram_is_cumulative():
+    metrics = Metrics(trace=False)
+    for latency in (0.05, 0.3, 0.3, 100.0):
+        metrics.record('gpt"4', latency=latency, stage="rank")
+    text = metrics.to_prometheus()
+    assert 'ragsge_llm_calls_total{stage="rank",model="gpt\\"4"} 4' in text
+    assert 'ragsge_llm_latency_seconds_bucket{stage="rank",model="gpt\\"4",le="0.5"} 3' in text
+    assert 'ragsge_llm_latency_seconds_bucket{stage="rank",model="gpt\\"4",le="+Inf"} 4' in text
+
+
+def test_staged_uses_question_argument():
+    class Worker():
+        @staged("generate_gt_fast")
+        def run(self, question):
+            default_metrics().record("gpt-4", latency=0.1)
+
+    start_run()
+    Worker().run(question="问题")
+    summary = default_metrics().summary()
+    assert summary["stages"]["generate_gt_fast"]["gpt-4"]["calls"] == 1
+    assert summary["questions"]["问题"]["generate_gt_fast"]["calls"] == 1
+
+
+def test_trace_saved_as_jsonl(tmp_path):
+    metrics = Metrics(trace=True)
+    with stage("rank", "问题", metrics=metrics):
+        metrics.record("gpt-4", latency=0.1)
+    metrics.save(str(tmp_path))
+
+    assert {p.name for p in tmp_path.iterdir()} == {"metrics.json", "metrics.prom", "trace.jsonl"}
+    events = [json.loads(line) for line in open(tmp_path / "trace.jsonl", encoding="utf-8")]
+    assert [event["type"] for event in events] == ["call", "stage"]
+
+
+def test_start_run_clears_shared_metrics():
+    default_metrics().record("gpt-4", latency=0.1, stage="old")
+    metrics = start_run()
+    assert metrics is default_metrics()
+    assert metrics.summary() == {"stages": {}, "questions": {}}
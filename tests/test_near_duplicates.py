@@ -0,0 +1,54 @@
+import pytest
+from RagSGE_chinese.near_duplicates import Duplicate_Clusters, Near_Duplicates, cluster_contexts, make_dedup
+
+NEWS = "上海证券交易所今日发布公告称, 公司第三季度营业收入同比增长百分之十二, 净利润创历史新高。"
+OTHER = "北京市气象台发布暴雨蓝色预警信号, 预计今天夜间到明天白天有大到暴雨, 请注意防范。"
+THIRD = "研究人员在实验中发现一种新的催化剂, 可以在常温下高效分解塑料, 相关论文已发表。"
+
+
+def test_cluster_keeps_first_as_representative():
+    contexts = [NEWS, OTHER, NEWS + "(转载)", THIRD, OTHER]
+    clusters = Near_Duplicates().cluster(contexts)
+
+    assert clusters.representatives == [0, 1, 3]
+    assert clusters.members == [[0, 2], [1, 4], [3]]
+    assert clusters.removed == 2
+    assert clusters.contexts(contexts) == [NEWS, OTHER, THIRD]
+
+
+def test_expand_and_compress_round_trip():
+    clusters = Duplicate_Clusters([0, 1, 0, 3, 1])
+    assert clusters.expand([2, 0]) == [3, 0, 2]
+    assert clusters.compress([4, 2, 0, 3]) == [1, 0, 2]
+    identity = Duplicate_Clusters.identity(3)
+    assert (len(identity), identity.removed, identity.expand([2, 1])) == (3, 0, [2, 1])
+
+
+def test_short_and_empty_contexts():
+    assert len(Near_Duplicates().cluster([])) == 0
+    assert Near_Duplicates().cluster(["好", "好", "坏"]).members == [[0, 1], [2]]
+
+
+def test_threshold_and_make_dedup():
+    assert make_dedup(None) is None and make_dedup(False) is None
+    assert make_dedup(True).threshold == 0.8
+    assert make_dedup(0.5).threshold == 0.5
+    dedup = Near_Duplicates(threshold=0.9)
+    assert make_dedup(dedup) is dedup
+    # 阈值为1时只合并内容相同的contexts
+    assert Near_Duplicates(threshold=1.0).cluster([NEWS, NEWS + "。", NEWS]).members == [[0, 2], [1]]
+
+
+def test_cluster_contexts_shared_by_sort_and_gt(capsys, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    from RagSGE_chinese.es_context_sort import DOC_SORT
+    from RagSGE_chinese.gen_gt import Gen_GT
+    from RagSGE_chinese.llm_cache import LLM_Cache
+
+    contexts = [NEWS, OTHER, NEWS]
+    assert cluster_contexts(None, contexts).members == [[0], [1], [2]]
+    sorter = DOC_SORT(cache=LLM_Cache(enabled=False), graph_dir=None, dedup=True)
+    assert sorter.near_duplicates(contexts).members == [[0, 2], [1]]
+    gen = Gen_GT(cache=LLM_Cache(enabled=False), dedup=True)
+    assert gen.unique_contexts(contexts, good=[2, 1]) == ([NEWS, OTHER], [0, 1])
+    assert capsys.readouterr().out.count("近似重复: 3个contexts合并为2类, 省去1个") == 2
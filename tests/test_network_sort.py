@@ -0,0 +1,56 @@
+import random
+import pytest
+from RagSGE_chinese.es_context_sort import DOC_SORT
+
+
+class Fake_Sort(DOC_SORT):
+    '''不调用GPT的DOC_SORT: 按contexts的分数比较, 分数越高越重要'''
+
+    def __init__(self, scores, consistent=True, seed=0):
+        self.scores = scores
+        self.consistent = consistent
+        self.random = random.Random(seed)
+        self.rounds = 0
+
+    def compare_pairs(self, contexts, question, pairs):
+        self.rounds += 1
+        if self.consistent:
+            results = [self.scores[i] > self.scores[j] for i, j in pairs]
+        else:   # 前后矛盾的GPT
+            results = [self.random.random() < 0.5 for _ in pairs]
+        return results, len(pairs)
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 5, 8, 13, 32, 50, 200])
+def test_network_sort_orders_by_importance(n):
+    scores = list(range(n))
+    random.Random(n).shuffle(scores)
+    sorter = Fake_Sort(scores)
+
+    indices, comparisons = sorter.network_sort(contexts=[str(s) for s in scores], question="q")
+
+    assert indices == sorted(range(n), key=lambda i: -scores[i])
+    assert sorter.rounds == len(sorter.network_rounds(n))
+    assert comparisons == sum(len(pairs) for pairs in sorter.network_rounds(n))
+
+
+def test_network_sort_subset_of_indices():
+    scores = [5, 1, 9, 3, 7, 0, 8]
+    good = [0, 2, 3, 6]
+    indices, _ = Fake_Sort(scores).network_sort(contexts=[str(s) for s in scores], question="q", indices=list(good))
+    assert indices == [2, 6, 0, 3]
+
+
+def test_network_rounds_pairs_are_disjoint():
+    # 同一轮中每个位置最多出现一次, 比较才能并发发送
+    for n in range(1, 70):
+        for pairs in DOC_SORT.network_rounds(n):
+            positions = [p for pair in pairs for p in pair]
+            assert len(positions) == len(set(positions))
+            assert all(0 <= a < b < n for a, b in pairs)
+
+
+@pytest.mark.parametrize("n", [7, 64, 100])
+def test_network_sort_inconsistent_answers_still_permutation(n):
+    indices, _ = Fake_Sort(list(range(n)), consistent=False, seed=n).network_sort(contexts=[str(i) for i in range(n)], question="q")
+    assert sorted(indices) == list(range(n))
@@ -0,0 +1,105 @@
+import threading
+import time
+import pytest
+from RagSGE_chinese.eval_pipeline import Pipeline
+from RagSGE_chinese.llm_cache import LLM_Cache
+
+NAMES = ["answer_relevancy", "faithfulness", "context_recall", "context_precision"]
+
+
+class Fake_Result():
+    def __init__(self, row):
+        self.row = row
+
+    def to_pandas(self):
+        import pandas as pd
+        return pd.DataFrame([self.row])
+
+
+class Fake_Eval():
+    '''不调用RAGAs的评分: 分数为答案的长度'''
+
+    def __init__(self, events):
+        self.events = events
+        self.saved = None
+
+    def score_key(self, question, contexts, answer, ground_truth, k):
+        return "score", f"{question}/{ground_truth}"
+
+    def score_question(self, question, contexts, answer, ground_truth, k=10):
+        time.sleep(0.02)
+        self.events.append(("score", question))
+        return Fake_Result({"question": question, **{name: len(answer) for name in NAMES}})
+
+    @staticmethod
+    def score_dict(row):
+        return {name: row[name] for name in NAMES}
+
+    def save_frame(self, result, result_dir='./result'):
+        self.saved = result
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path):
+    pytest.importorskip("pandas")
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.chdir(tmp_path)
+    events = []
+    lock = threading.Lock()
+    p = Pipeline(cache=LLM_Cache(enabled=False))
+
+    def generate_gt_fast(question, contexts, **options):
+        time.sleep(0.05)
+        with lock:
+            events.append(("gt", question))
+        return f"标准答案{question}"
+
+    monkeypatch.setattr(p.gt, "generate_gt_fast", generate_gt_fast)
+    p.eval = Fake_Eval(events)
+    return p, events
+
+
+QUESTIONS = [f"问题{i}" for i in range(6)]
+CONTEXTS = [["背景"]] * 6
+ANSWERS = ["答" * (i + 1) for i in range(6)]
+
+
+def test_stream_scores_before_all_ground_truths(pipeline, tmp_path):
+    p, events = pipeline
+    items = []
+    for item in p.stream(QUESTIONS, CONTEXTS, ANSWERS, gt_workers=1, eval_workers=1, result_dir=str(tmp_path)):
+        items.append(item)
+
+    assert sorted(item["index"] for item in items) == list(range(6))
+    for item in items:
+        assert item["ground_truth"] == f"标准答案{item['question']}"
+        assert item["score"] == {name: item["index"] + 1 for name in NAMES}
+    # 第一个问题的评分在最后一个标准答案生成之前完成
+    assert events.index(("score", QUESTIONS[0])) < events.index(("gt", QUESTIONS[-1]))
+    assert list(p.eval.saved["question"]) == QUESTIONS
+
+
+def test_stream_resume_reuses_journal(pipeline, tmp_path):
+    p, events = pipeline
+    list(p.stream(QUESTIONS, CONTEXTS, ANSWERS, result_dir=str(tmp_path)))
+    events.clear()
+    items = list(p.stream(QUESTIONS, CONTEXTS, ANSWERS, resume=True, result_dir=str(tmp_path)))
+    assert events == [] and len(items) == 6
+
+
+def test_stream_ground_truth_only(pipeline, tmp_path):
+    p, events = pipeline
+    items = list(p.stream(QUESTIONS[:2], CONTEXTS[:2], result_dir=str(tmp_path)))
+    assert sorted((item["index"], item["score"]) for item in items) == [(0, None), (1, None)]
+    assert (tmp_path / "gt" / "GT_问题0.json").exists()
+
+
+def test_stream_error_stops_all_stages(pipeline, tmp_path):
+    p, events = pipeline
+
+    def fail(*args, **options):
+        raise RuntimeError("评分失败")
+
+    p.eval.score_question = fail
+    with pytest.raises(RuntimeError, match="评分失败"):
+        list(p.stream(QUESTIONS, CONTEXTS, ANSWERS, result_dir=str(tmp_path)))
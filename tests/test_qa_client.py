@@ -0,0 +1,52 @@
+import os
+import sys
+import pytest
+pytest.importorskip("aiohttp")
+from RagSGE_chinese.qa_client import QA_Client
+
+# 与性能测试共用本地模拟的QA服务器
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from fake_qa_server import Fake_QA_Server, make_answer
+
+PAIRS = [(f"公司{i % 4}", f"问题{i}") for i in range(30)]
+ANSWERS = [make_answer(company, question) for company, question in PAIRS]
+
+
+def test_collect_in_input_order_with_retries(tmp_path):
+    with Fake_QA_Server(latency=0.02, failure_rate=0.2, empty_rate=0.1, seed=1) as server:
+        client = QA_Client(url=server.url, concurrency=6, max_retries=6, backoff=0.01, result_dir=str(tmp_path))
+        assert client.collect(PAIRS) == ANSWERS
+        stats = server.stats()
+    assert stats["ok"] == len(PAIRS)
+    assert stats["requests"] == len(PAIRS) + stats.get("failure", 0) + stats.get("empty", 0)
+    assert stats.get("failure", 0) > 0
+    assert (tmp_path / "metrics.json").exists()
+
+
+def test_resume_only_failed(tmp_path):
+    with Fake_QA_Server(latency=0.0, failure_rate=0.3, seed=2) as server:
+        client = QA_Client(url=server.url, concurrency=8, max_retries=0, backoff=0.01, result_dir=str(tmp_path))
+        with pytest.raises(RuntimeError, match="resume=True"):
+            client.collect(PAIRS)
+        failed = server.stats()["failure"]
+    assert failed > 0
+
+    # 换一个正常的服务器续跑, 只应重新请求失败的问题
+    with Fake_QA_Server(latency=0.0) as server:
+        client = QA_Client(url=server.url, concurrency=8, max_retries=0, backoff=0.01, result_dir=str(tmp_path))
+        assert client.collect(PAIRS, resume=True) == ANSWERS
+        assert server.stats()["requests"] == failed
+
+
+def test_timeout(tmp_path):
+    with Fake_QA_Server(latency=0.0, hang_rate=1.0, hang=1.0) as server:
+        client = QA_Client(url=server.url, timeout=0.2, max_retries=0, result_dir=str(tmp_path))
+        with pytest.raises(RuntimeError, match="2个问题未能获取答案"):
+            client.collect(PAIRS[:2])
+
+
+def test_missing_url(monkeypatch):
+    monkeypatch.delenv("QA_SERVER_URL", raising=False)
+    monkeypatch.setattr("RagSGE_chinese.qa_client.load_dotenv", lambda: None)
+    with pytest.raises(ValueError, match="QA_SERVER_URL"):
+        QA_Client().collect(PAIRS[:1])
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+pytest.importorskip("ragas")
+from RagSGE_chinese import ragas_eval
+from RagSGE_chinese.ragas_eval import RAGAs_Eval
+from RagSGE_chinese.run_journal import Run_Journal
+
+NAMES = ["answer_relevancy", "faithfulness", "context_recall", "context_precision"]
+
+
+class Fake_Result():
+    def __init__(self, frame):
+        self.frame = frame
+
+    def to_pandas(self):
+        return self.frame
+
+
+def fake_evaluate(dataset, metrics=None, **options):
+    # 分数由答案的长度决定, 每一行都带有问题等列, 与RAGAs的分数表相同
+    frame = dataset.to_pandas()
+    for n, name in enumerate(NAMES):
+        frame[name] = [len(answer) / (n + 1) for answer in frame["answer"]]
+    return Fake_Result(frame)
+
+
+@pytest.fixture
+def evaluator(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(ragas_eval, "evaluate", fake_evaluate)
+    monkeypatch.setattr(ragas_eval, "adapt_metrics", lambda **options: None)
+    evaluator = RAGAs_Eval()
+    monkeypatch.setattr(evaluator, "max_k", lambda data, k: (data, k))
+    monkeypatch.setattr(evaluator, "max_k_batch", lambda datas, k: (datas, [k] * len(datas)))
+    return evaluator
+
+
+ARGS = (["问题一", "问题二", "问题三"], [["背景"]] * 3, ["答", "答案", "回答问题"], ["标准答案"] * 3)
+EXPECTED = [{name: len(answer) / (n + 1) for n, name in enumerate(NAMES)} for answer in ARGS[2]]
+
+
+@pytest.mark.parametrize("batch_size", [None, 2])
+def test_run_returns_dicts_on_every_path(evaluator, tmp_path, batch_size):
+    journal = Run_Journal(str(tmp_path / "journal.jsonl"))
+    scores = evaluator.run(*ARGS, k=1, batch_size=batch_size, journal=journal, result_dir=str(tmp_path))
+    assert scores == EXPECTED
+    assert list(pd.read_excel(tmp_path / "result.xlsx")["question"]) == ARGS[0]
+
+    # 从运行日志恢复, 不再评分, 返回值相同
+    evaluator.score_question = None
+    evaluator.top_k_ragas_eval_batch = None
+    assert evaluator.run(*ARGS, k=1, batch_size=batch_size, journal=journal, resume=True, result_dir=str(tmp_path)) == EXPECTED
+    journal.close()
@@ -0,0 +1,87 @@
+import math
+import random
+import numpy as np
+import pytest
+from RagSGE_chinese.es_context_sort import DOC_SORT
+from RagSGE_chinese.rank_metrics import pad, rank_metrics, score_results
+from RagSGE_chinese.result_store import Result_Writer
+
+stats = pytest.importorskip("scipy.stats")
+
+
+def loop_metrics(ranking, reference, k, relevant):
+    # 逐个问题的直接实现, 用于对比
+    k = min(k, len(ranking))
+    relevant = set(reference[:k]) if relevant is None else set(relevant)
+    gains = [1 if item in relevant else 0 for item in ranking[:k]]
+    dcg = sum(g / math.log2(i + 2) for i, g in enumerate(gains))
+    ideal = sum(1 / math.log2(i + 2) for i in range(min(k, len(relevant))))
+    first = next((i for i, item in enumerate(ranking) if item in relevant), None)
+    return {
+        "sim": len(set(ranking[:k]) & set(reference[:k])) / k if k else 0.0,
+        "ndcg": dcg / ideal if ideal else math.nan,
+        "mrr": 1 / (first + 1) if first is not None else 0.0,
+        "recall": sum(gains) / len(relevant) if relevant else math.nan,
+    }
+
+
+@pytest.mark.parametrize("labelled", [False, True])
+def test_matches_scipy_and_loop(labelled):
+    rnd = random.Random(labelled)
+    rankings, references, relevant = [], [], []
+    for _ in range(40):
+        n = rnd.randint(2, 30)
+        reference = list(range(n))
+        ranking = reference[:]
+        rnd.shuffle(ranking)
+        rankings.append(ranking)
+        references.append(reference)
+        relevant.append(rnd.sample(range(n), rnd.randint(0, n)))
+    metrics = rank_metrics(rankings, references, k=5, relevant=relevant if labelled else None)
+
+    for q, (ranking, reference) in enumerate(zip(rankings, references)):
+        assert metrics["spearman"][q] == pytest.approx(stats.spearmanr(ranking, reference)[0])
+        assert metrics["kendall"][q] == pytest.approx(stats.kendalltau(ranking, reference)[0])
+        expected = loop_metrics(ranking, reference, 5, relevant[q] if labelled else None)
+        for name, value in expected.items():
+            assert metrics[name][q] == pytest.approx(value, nan_ok=True), name
+
+
+def test_bottom_k_and_partial_overlap():
+    metrics = rank_metrics([[3, 0, 1, 2, 4]], [[0, 2, 4]], k=2, top=False)
+    # 只有共同的下标 0, 2, 4 参与相关系数: 系统顺序 0, 2, 4 与对比数组相同
+    assert metrics["spearman"][0] == pytest.approx(1.0)
+    assert metrics["overlap"][0] == [2, 4]
+    assert metrics["sim"][0] == 1.0
+
+    sorter = DOC_SORT.__new__(DOC_SORT)
+    assert sorter.top_k_similarity([4, 2, 0, 1, 3], k=2, top=False) == (0.5, [3])
+    assert rank_metrics([[4, 2, 0, 1, 3]], k=2, top=False)["overlap"][0] == [3]
+
+
+def test_empty_and_single():
+    metrics = rank_metrics([[], [7]], k=3)
+    assert np.isnan(metrics["spearman"]).all()
+    assert metrics["k"].tolist() == [0, 1]
+    padded, lengths = pad([[1, 2], [], [3]])
+    assert padded.tolist() == [[1, 2], [-1, -1], [3, -1]] and lengths.tolist() == [2, 0, 1]
+
+
+def test_spearman_score_fast_path_matches_scipy():
+    sorter = DOC_SORT.__new__(DOC_SORT)
+    ranking = [3, 0, 4, 1, 2]
+    assert sorter.spearman_score(ranking) == round(stats.spearmanr(ranking, sorted(ranking))[0], 3)
+    assert sorter.spearman_score([2, 9, 4], [9, 2, 4]) == round(stats.spearmanr([2, 9, 4], [9, 2, 4])[0], 3)
+
+
+def test_score_results_from_folder(tmp_path):
+    writer = Result_Writer(str(tmp_path))
+    writer.append({"question": "快速", "contexts": ["a", "b", "c", "d"], "good": [0, 1, 3], "bad": [2], "sorted": [3, 1, 0]})
+    writer.append({"question": "全部", "contexts": ["a", "b", "c"], "good": None, "bad": None, "sorted": [0, 1, 2]})
+    writer.close()
+
+    scores, mean = score_results(str(tmp_path), k=2)
+    assert [score["question"] for score in scores] == ["快速", "全部"]
+    assert scores[0]["spearman"] == -1.0 and scores[1]["spearman"] == 1.0
+    assert scores[0]["overlap"] == [1] and scores[1]["sim"] == 1.0
+    assert mean["spearman"] == 0.0
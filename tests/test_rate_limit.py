@@ -0,0 +1,106 @@
+import httpx
+import openai
+import pytest
+from RagSGE_chinese.metrics import Metrics
+from RagSGE_chinese.rate_limit import Rate_Governor, Token_Bucket
+
+
+def rate_limit_error():
+    request = httpx.Request("POST", "http://localhost/v1/chat/completions")
+    return openai.RateLimitError("rate limited", response=httpx.Response(429, request=request), body=None)
+
+
+def governor(**options):
+    options = {"max_concurrency": 8, "base_delay": 0.001, "max_delay": 0.001, "metrics": Metrics(trace=False), **options}
+    g = Rate_Governor(**options)
+    g.configure("gpt-4", rpm=10**6, tpm=10**9)
+    return g
+
+
+def failing(errors, result="ok"):
+    errors = list(errors)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn, calls
+
+
+def test_retries_until_success_and_counts():
+    g = governor()
+    fn, calls = failing([TimeoutError(), TimeoutError()])
+    assert g.call("gpt-4", fn, tokens=1) == "ok"
+    assert len(calls) == 3
+    assert g.retries == 2
+    assert g.metrics.summary()["stages"]["llm"]["gpt-4"]["retries"] == 2
+
+
+def test_gives_up_after_max_retries():
+    g = governor(max_retries=2)
+    fn, calls = failing([TimeoutError()] * 5)
+    with pytest.raises(TimeoutError):
+        g.call("gpt-4", fn, tokens=1)
+    assert len(calls) == 3
+    assert g.retries == 2
+
+
+def test_other_errors_are_not_retried():
+    g = governor()
+    fn, calls = failing([ValueError("bad request")])
+    with pytest.raises(ValueError):
+        g.call("gpt-4", fn, tokens=1)
+    assert len(calls) == 1 and g.active == 0
+
+
+def test_aimd_halves_on_rate_limit_and_grows_on_success():
+    g = governor(max_concurrency=8, min_concurrency=1)
+    fn, _ = failing([rate_limit_error(), rate_limit_error()])
+    g.call("gpt-4", fn, tokens=1)
+    assert g.limit == pytest.approx(8 / 2 / 2 + 1 / 2)   # 两次限流减半, 成功一次 +1/limit
+    for _ in range(200):
+        g.call("gpt-4", lambda: None, tokens=1)
+    assert g.limit == 8   # 不超过max_concurrency
+    assert g.active == 0
+
+
+def test_limit_never_below_min_concurrency():
+    g = governor(max_concurrency=4, min_concurrency=2, max_retries=10)
+    fn, _ = failing([rate_limit_error()] * 6)
+    g.call("gpt-4", fn, tokens=1)
+    assert g.limit >= 2
+
+
+def test_split_divides_configured_limits():
+    g = governor()
+    g.configure("gpt-4", rpm=600, tpm=60000)
+    g.split(4)
+    requests_bucket, tokens_bucket = g._buckets("gpt-4")
+    assert (requests_bucket.capacity, tokens_bucket.capacity) == (150, 15000)
+
+
+def test_token_bucket_caps_request_at_capacity():
+    bucket = Token_Bucket(per_minute=60)
+    bucket.acquire(60)
+    assert bucket.tokens < 1
+    bucket.tokens = 60
+    bucket.acquire(10**6)   # 超过容量的请求最多等待一个完整的桶, 不会永远等待
+    assert bucket.tokens < 1
+
+
+def test_underlying_clients_do_not_retry(monkeypatch):
+    # 重试只由Rate_Governor负责, 否则一次请求可能绕过限流器被重复发送
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    from RagSGE_chinese.gen_gt import Gen_GT
+    from RagSGE_chinese.llm_cache import LLM_Cache
+
+    assert Gen_GT(cache=LLM_Cache(enabled=False)).client().max_retries == 0
+    pytest.importorskip("ragas")
+    from RagSGE_chinese.ragas_eval import Governed_LLM
+
+    llm = Governed_LLM("gpt-3.5-turbo-16k", governor())
+    assert llm.langchain_llm.max_retries == 0
+    llm.set_run_config(llm.run_config)
+    assert llm.run_config.max_retries == 1
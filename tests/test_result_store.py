@@ -0,0 +1,55 @@
+import json
+import os
+import pytest
+from RagSGE_chinese.compactjsonencoder import CompactJSONEncoder
+from RagSGE_chinese.result_store import Result_Writer, Sorted_Results, write_json
+from stub_sort import Stub_Sort
+
+
+def record(question, contexts):
+    return {"question": question, "contexts": contexts, "good": [0], "bad": [1], "sorted": [0], "unordered": None, "spearman": 1.0, "sim": 1.0, "overlap": [0]}
+
+
+RESULTS = [record("问题一", ["共同的背景", "背景\n甲"]), record("问题二", ["共同的背景", "背景\"乙\""]), record("问题三", [])]
+
+
+def test_round_trip_and_contexts_saved_once(tmp_path):
+    writer = Result_Writer(str(tmp_path))
+    for res in RESULTS:
+        writer.append(res)
+    writer.close()
+
+    results = Sorted_Results(str(tmp_path))
+    assert len(results) == 3
+    assert results[1] == RESULTS[1]
+    assert results[-2:] == RESULTS[1:]
+    assert results.to_list() == RESULTS
+    assert [res["question"] for res in results.iter_raw()] == ["问题一", "问题二", "问题三"]
+    with open(tmp_path / "contexts.jsonl", 'r', encoding='utf-8') as f:
+        assert len(f.readlines()) == 3   # "共同的背景"只保存一次
+
+
+def test_write_json_from_saved_results_matches_json_dump(tmp_path):
+    writer = Result_Writer(str(tmp_path))
+    for res in RESULTS:
+        writer.append(res)
+    writer.close()
+
+    path = str(tmp_path / "sorted_indices.json")
+    assert write_json(path, writer.reader()) == 3
+    with open(path, 'r', encoding='utf-8') as f:
+        assert f.read() == json.dumps(RESULTS, ensure_ascii=False, cls=CompactJSONEncoder)
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_stream_writes_legacy_file_only_when_asked(tmp_path, monkeypatch, legacy):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    results = Stub_Sort().run(["问题一", "问题二"], [["好", "坏"], ["好好", "好"]], k=1, stream=True, legacy=legacy, result_dir=str(tmp_path))
+
+    assert isinstance(results, Sorted_Results)
+    assert [res["sorted"] for res in results] == [[0], [0, 1]]
+    assert os.path.exists(tmp_path / "sorted_indices.jsonl")
+    assert os.path.exists(tmp_path / "sorted_indices.json") == legacy
+    if legacy:
+        with open(tmp_path / "sorted_indices.json", 'r', encoding='utf-8') as f:
+            assert f.read() == json.dumps(results.to_list(), ensure_ascii=False, cls=CompactJSONEncoder)
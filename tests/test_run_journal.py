@@ -0,0 +1,71 @@
+import json
+from RagSGE_chinese.run_journal import Run_Journal
+
+
+def read_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_record_and_reload(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Run_Journal(path)
+    journal.record("01", "问题一", {"good": [0, 2], "bad": [1]})
+    journal.record("01", "问题一", {"good": [0], "bad": [1, 2]})
+    journal.close()
+
+    journal = Run_Journal(path)
+    assert journal.has("01", "问题一")
+    assert journal.get("01", "问题一") == {"good": [0], "bad": [1, 2]}   # 同一个key以最后一次为准
+    assert journal.get("01", "问题二") is None
+
+
+def test_torn_last_line_is_dropped_before_append(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Run_Journal(path)
+    journal.record("answer", "问题一", "答案一")
+    journal.close()
+    # 模拟写入一半时崩溃: 最后一行没有换行符, 也不是完整的json
+    with open(path, 'ab') as f:
+        f.write('{"kind": "answer", "key": "问题二", "da'.encode('utf-8'))
+
+    journal = Run_Journal(path)
+    assert journal.get("answer", "问题一") == "答案一"
+    assert not journal.has("answer", "问题二")
+    journal.record("answer", "问题三", "答案三")
+    journal.close()
+
+    # 不完整的一行被截掉, 新的一行是完整的
+    assert [record["key"] for record in read_lines(path)] == ["问题一", "问题三"]
+    journal = Run_Journal(path)
+    assert journal.get("answer", "问题三") == "答案三"
+
+
+def test_complete_last_line_without_newline_is_not_trusted(tmp_path):
+    # 最后一行即使恰好是完整的json, 没有换行符时也可能是截断的数字等, 同样丢弃
+    path = str(tmp_path / "journal.jsonl")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"kind": "score", "key": "q", "data": 1}) + "\n")
+        f.write(json.dumps({"kind": "score", "key": "r", "data": 12}))
+
+    journal = Run_Journal(path)
+    assert journal.get("score", "q") == 1
+    assert not journal.has("score", "r")
+    journal.record("score", "s", 3)
+    journal.close()
+    assert [record["key"] for record in read_lines(path)] == ["q", "s"]
+
+
+def test_corrupt_middle_line_is_skipped(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    with open(path, 'wb') as f:
+        f.write(json.dumps({"kind": "a", "key": "1", "data": 1}).encode('utf-8') + b"\n")
+        f.write(b"\xff\xfe not json\n")
+        f.write(json.dumps({"kind": "a", "key": "2", "data": 2}).encode('utf-8') + b"\n")
+
+    journal = Run_Journal(path)
+    assert journal.get("a", "1") == 1
+    assert journal.get("a", "2") == 2
+    journal.record("a", "3", 3)
+    journal.close()
+    assert Run_Journal(path).get("a", "3") == 3
@@ -0,0 +1,104 @@
+import json
+import os
+import pytest
+from RagSGE_chinese import shard
+from RagSGE_chinese.result_store import write_json
+from RagSGE_chinese.shard import Shard_Error
+
+QUESTIONS = [f"问题{i}" for i in range(23)]
+NUM_SHARDS = 4
+
+
+def result(index):
+    return {"question": QUESTIONS[index], "contexts": [f"背景{index}-{n}" for n in range(3)], "good": [0, 2], "bad": [1], "sorted": [2, 0], "unordered": None, "spearman": -1.0, "sim": 1.0, "overlap": [2, 0]}
+
+
+def write_shard(result_dir, number, indices=None, results=None, finished=True, num_shards=NUM_SHARDS, questions=QUESTIONS):
+    '''按run_shard的格式写入一个排序分片的清单和结果 (不调用GPT)'''
+    if indices is None:
+        indices = shard.shard_indices(questions, number, num_shards)
+    folder = shard.shard_dir("sort", number, num_shards, result_dir)
+    os.makedirs(folder, exist_ok=True)
+    manifest = {
+        "task": "sort", "shard": number, "num_shards": num_shards, "total": len(questions), "digest": shard.digest(questions),
+        "finished": finished, "indices": indices, "questions": [questions[i] for i in indices],
+    }
+    with open(os.path.join(folder, shard.MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    write_json(os.path.join(folder, "sorted_indices.json"), results if results is not None else [result(i) for i in indices])
+
+
+def write_all(result_dir, skip=()):
+    for number in range(NUM_SHARDS):
+        if number not in skip:
+            write_shard(result_dir, number)
+
+
+def test_shards_cover_every_question_once():
+    covered = sorted(i for number in range(NUM_SHARDS) for i in shard.shard_indices(QUESTIONS, number, NUM_SHARDS))
+    assert covered == list(range(len(QUESTIONS)))
+    # 同一个问题总是分到同一个分片, 与问题列表的顺序无关
+    reordered = QUESTIONS[::-1]
+    for number in range(NUM_SHARDS):
+        assert {QUESTIONS[i] for i in shard.shard_indices(QUESTIONS, number, NUM_SHARDS)} == {reordered[i] for i in shard.shard_indices(reordered, number, NUM_SHARDS)}
+
+
+def test_merge_restores_question_order(tmp_path):
+    write_all(str(tmp_path))
+    path = shard.merge("sort", str(tmp_path))
+    with open(path, 'r', encoding='utf-8') as f:
+        merged = json.load(f)
+    assert merged == [result(i) for i in range(len(QUESTIONS))]
+
+
+def test_missing_shard(tmp_path):
+    write_all(str(tmp_path), skip=(2,))
+    with pytest.raises(Shard_Error, match="缺少分片"):
+        shard.merge("sort", str(tmp_path))
+    assert not os.path.exists(tmp_path / "sorted_indices.json")
+
+
+def test_unfinished_shard(tmp_path):
+    write_all(str(tmp_path), skip=(1,))
+    write_shard(str(tmp_path), 1, finished=False)
+    with pytest.raises(Shard_Error, match="还没有运行完成"):
+        shard.merge("sort", str(tmp_path))
+
+
+def test_duplicate_question_in_two_shards(tmp_path):
+    write_all(str(tmp_path), skip=(3,))
+    indices = shard.shard_indices(QUESTIONS, 3, NUM_SHARDS) + shard.shard_indices(QUESTIONS, 0, NUM_SHARDS)[:1]
+    write_shard(str(tmp_path), 3, indices=sorted(indices))
+    with pytest.raises(Shard_Error, match="重复出现"):
+        shard.merge("sort", str(tmp_path))
+
+
+def test_question_in_no_shard(tmp_path):
+    write_all(str(tmp_path), skip=(0,))
+    write_shard(str(tmp_path), 0, indices=shard.shard_indices(QUESTIONS, 0, NUM_SHARDS)[1:])
+    with pytest.raises(Shard_Error, match="不在任何分片中"):
+        shard.merge("sort", str(tmp_path))
+
+
+def test_results_missing_a_question(tmp_path):
+    # 分片中断: 清单中有的问题在结果中缺失
+    write_all(str(tmp_path), skip=(1,))
+    indices = shard.shard_indices(QUESTIONS, 1, NUM_SHARDS)
+    write_shard(str(tmp_path), 1, results=[result(i) for i in indices[:-1]])
+    with pytest.raises(Shard_Error, match="结果中有"):
+        shard.merge("sort", str(tmp_path))
+
+
+def test_results_duplicate_a_question(tmp_path):
+    write_all(str(tmp_path), skip=(1,))
+    indices = shard.shard_indices(QUESTIONS, 1, NUM_SHARDS)
+    write_shard(str(tmp_path), 1, results=[result(i) for i in indices[:-1]] + [result(indices[0])])
+    with pytest.raises(Shard_Error, match="应为"):
+        shard.merge("sort", str(tmp_path))
+
+
+def test_shards_from_different_runs(tmp_path):
+    write_all(str(tmp_path))
+    write_shard(str(tmp_path), 0, num_shards=2)
+    with pytest.raises(Shard_Error, match="不同的运行"):
+        shard.merge("sort", str(tmp_path))
@@ -0,0 +1,71 @@
+import pytest
+from stub_sort import Stub_Sort
+
+
+@pytest.fixture(autouse=True)
+def openai_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+
+
+def run(sorter, tmp_path, contexts, **options):
+    options = {"k": 2, "method": "topk", "resume": True, "stream": False, "result_dir": str(tmp_path), **options}
+    return sorter.run(["问题"], [contexts], **options)[0]
+
+
+CONTEXTS = ["好" * 3, "坏", "好" * 5, "好"]
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_resume_reuses_finished_question(tmp_path, fast):
+    first = run(Stub_Sort(), tmp_path, CONTEXTS, fast=fast)
+    sorter = Stub_Sort()
+    second = run(sorter, tmp_path, CONTEXTS, fast=fast)
+    assert second == first
+    assert sorter.calls == {"sort_01": 0, "rank": 0}
+
+
+def test_changed_k_is_not_restored(tmp_path):
+    run(Stub_Sort(), tmp_path, CONTEXTS, k=1)
+    sorter = Stub_Sort()
+    res = run(sorter, tmp_path, CONTEXTS, k=2)
+    assert sorter.calls == {"sort_01": 0, "rank": 1}   # 0-1筛选与k无关, 可以复用
+    assert res["unordered"] == [3]
+
+
+def test_changed_contexts_are_not_restored(tmp_path):
+    run(Stub_Sort(), tmp_path, CONTEXTS)
+    sorter = Stub_Sort()
+    contexts = ["坏", "好" * 2]
+    res = run(sorter, tmp_path, contexts)
+    assert sorter.calls == {"sort_01": 1, "rank": 1}
+    assert res["good"] == [1] and res["sorted"] == [1]
+
+
+def test_changed_model_is_not_restored(tmp_path):
+    run(Stub_Sort(), tmp_path, CONTEXTS)
+    sorter = Stub_Sort(model="gpt-4")
+    run(sorter, tmp_path, CONTEXTS)
+    assert sorter.calls == {"sort_01": 1, "rank": 1}
+
+
+class Stub_GT():
+    def __init__(self):
+        self.calls = 0
+
+    def generate_gt_fast(self, question, contexts, **options):
+        self.calls += 1
+        return f"答案{self.calls}: " + "".join(contexts)
+
+
+def test_ground_truth_keyed_by_contexts(tmp_path):
+    from RagSGE_chinese.eval_pipeline import Pipeline
+    from RagSGE_chinese.run_journal import Run_Journal
+
+    pipeline = Pipeline.__new__(Pipeline)
+    pipeline.gt, pipeline.budget = Stub_GT(), None
+    journal = Run_Journal(str(tmp_path / "journal.jsonl"))
+    first = pipeline.ground_truth("问题", ["甲", "乙"], "gpt-4-turbo", True, journal, resume=True)
+    assert pipeline.ground_truth("问题", ["甲", "乙"], "gpt-4-turbo", True, journal, resume=True) == first
+    assert pipeline.ground_truth("问题", ["甲", "丙"], "gpt-4-turbo", True, journal, resume=True) == "答案2: 甲丙"
+    assert pipeline.ground_truth("问题", ["甲", "乙"], "gpt-4", True, journal, resume=True) == "答案3: 甲乙"
+    assert pipeline.gt.calls == 3
@@ -0,0 +1,66 @@
+import random
+import pytest
+from RagSGE_chinese.token_counter import budget_k, budget_k_batch
+from char_tokens import use_char_tokens
+
+
+@pytest.fixture(autouse=True)
+def char_tokens(monkeypatch):
+    use_char_tokens(monkeypatch)
+
+
+def brute_k(counts, k, max_tokens):
+    return max(n for n in range(min(k, len(counts)) + 1) if sum(counts[:n]) < max_tokens)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_budget_k_matches_brute_force(seed):
+    rnd = random.Random(seed)
+    counts_list = [[rnd.randint(0, 50) for _ in range(rnd.randint(0, 30))] for _ in range(20)]
+    k, max_tokens = rnd.randint(1, 30), rnd.randint(1, 500)
+
+    expected = [brute_k(counts, k, max_tokens) for counts in counts_list]
+    assert [budget_k(counts, k, max_tokens) for counts in counts_list] == expected
+    assert budget_k_batch(counts_list, k, max_tokens).tolist() == expected
+
+
+def test_budget_k_batch_empty():
+    assert len(budget_k_batch([], 10, 100)) == 0
+    assert budget_k_batch([[]], 10, 100).tolist() == [0]
+
+
+@pytest.fixture
+def gen(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    from RagSGE_chinese.gen_gt import Gen_GT
+    from RagSGE_chinese.llm_cache import LLM_Cache
+    return Gen_GT(cache=LLM_Cache(enabled=False))
+
+
+PROMPT = "问题: {question} 文档: {context_list}"
+
+
+def test_chunk_dataset_same_as_max_item_when_everything_fits(gen):
+    contexts = [f"背景{i}" for i in range(45)]
+    groups = gen.chunk_dataset(PROMPT, "问题", contexts, "gpt-4-turbo", max_item=20)
+    assert groups == [contexts[:20], contexts[20:40], contexts[40:]]
+
+
+@pytest.mark.parametrize("budget", [120, 200, 400])
+def test_chunk_dataset_respects_token_limit(gen, budget):
+    rnd = random.Random(budget)
+    contexts = ["字" * rnd.randint(1, 60) for _ in range(40)]
+    groups = gen.chunk_dataset(PROMPT, "问题", contexts, "gpt-4", max_item=20, budget=budget)
+
+    limit = budget - 16
+    assert all(len(PROMPT.format(question="问题", context_list=group)) <= limit for group in groups)
+    assert all(len(group) <= 20 for group in groups)
+    assert [text for group in groups for text in group] == contexts
+    assert len(groups) > 40 * 30 // budget   # 按token分组后组数变多
+
+
+def test_chunk_dataset_merges_at_least_two(gen):
+    answers = ["答" * 80 for _ in range(5)]
+    groups = gen.chunk_dataset(PROMPT, "问题", answers, "gpt-4", max_item=4, budget=150, min_per_group=2)
+    assert all(len(group) >= 2 for group in groups[:-1])
+    assert all(len(PROMPT.format(question="问题", context_list=group)) <= 150 - 16 for group in groups)
@@ -0,0 +1,31 @@
+import pytest
+from RagSGE_chinese.token_counter import Token_Counter, Message_Budget, token_counter
+from char_tokens import use_char_tokens
+
+
+@pytest.fixture(autouse=True)
+def char_tokens(monkeypatch):
+    use_char_tokens(monkeypatch)
+
+
+def test_message_budget_tracks_total():
+    budget = Message_Budget(Token_Counter("gpt-4"), [{"role": "system", "content": "abc"}])
+    budget.append({"role": "user", "content": "12345"})
+    budget.append({"role": "user", "content": "xy"})
+    assert (len(budget), budget.total) == (3, 10)
+    assert budget.pop(1)["content"] == "12345"
+    assert budget.total == 5 and [m["content"] for m in budget.messages] == ["abc", "xy"]
+
+
+def test_token_counter_lru():
+    counter = Token_Counter("gpt-4", memo_size=2)
+    assert counter.count("aa") == 2 and counter.count("bbb") == 3
+    counter.count("aa")          # aa变为最近使用
+    counter.count("c")           # 丢弃最久没有用到的bbb
+    assert len(counter.memo) == 2
+    assert counter.count("bbb") == 3
+
+
+def test_token_counter_shared_per_model():
+    assert token_counter("gpt-4") is token_counter("gpt-4")
+    assert token_counter("gpt-4") is not token_counter("gpt-3.5-turbo")
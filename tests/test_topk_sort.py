@@ -0,0 +1,53 @@
+import math
+import random
+import pytest
+from RagSGE_chinese.es_context_sort import DOC_SORT
+
+
+class Score_Sort(DOC_SORT):
+    '''不调用GPT的DOC_SORT: 按contexts的分数比较, 分数越高越重要'''
+
+    def __init__(self, scores):
+        self.scores = scores
+
+    def compare_pairs(self, contexts, question, pairs):
+        return [self.scores[i] > self.scores[j] for i, j in pairs], len(pairs)
+
+
+@pytest.mark.parametrize("n, k", [(1, 1), (7, 3), (32, 10), (50, 50), (200, 10)])
+@pytest.mark.parametrize("top", [True, False])
+def test_topk_sort_orders_only_k(n, k, top):
+    scores = list(range(n))
+    random.Random(n + k).shuffle(scores)
+    sorter = Score_Sort(scores)
+    by_importance = sorted(range(n), key=lambda i: -scores[i])
+
+    indices, comparisons = sorter.topk_sort(contexts=[str(s) for s in scores], question="q", k=k, top=top)
+
+    assert sorted(indices) == list(range(n))
+    if top:
+        assert indices[:k] == by_importance[:k]
+        assert indices[k:] == [i for i in range(n) if i not in by_importance[:k]]   # 其余保持原顺序
+    else:
+        assert indices[n - k:] == by_importance[n - k:]
+        assert indices[:n - k] == [i for i in range(n) if i not in by_importance[n - k:]]
+    assert comparisons <= n + k * math.ceil(math.log2(max(n, 2)))
+
+
+def test_topk_sort_subset_and_zero_k():
+    scores = [5, 1, 9, 3, 7, 0, 8]
+    sorter = Score_Sort(scores)
+    indices, _ = sorter.topk_sort(contexts=[str(s) for s in scores], question="q", indices=[0, 1, 3, 6], k=2)
+    assert indices == [6, 0, 1, 3]
+    assert sorter.topk_sort(contexts=[], question="q", k=0) == ([], 0)
+
+
+def test_clamp_k_and_unordered(capsys):
+    assert DOC_SORT.clamp_k(10, 4) == 4
+    assert "k值大于可排序contexts的数量" in capsys.readouterr().out
+    assert DOC_SORT.clamp_k(3, 4) == 3
+
+    sorter = Score_Sort([])
+    assert sorter.unordered([4, 2, 0, 1, 3], "topk", 2, True) == [0, 1, 3]
+    assert sorter.unordered([4, 2, 0, 1, 3], "topk", 2, False) == [4, 2, 0]
+    assert sorter.unordered([4, 2, 0, 1, 3], "binary", 2, True) is None